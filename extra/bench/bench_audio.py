@@ -0,0 +1,84 @@
+"""
+Wall time to transcribe a long recording in one request vs. in concurrent chunks.
+
+Writes `--minutes` of synthetic 16 kHz mono audio (noise bursts separated by
+short pauses) to a temporary WAV file, and transcribes it against `fake_openai`,
+which takes `--audio-rate` seconds per MB uploaded, first as a single request
+and then with `lovelaice.audio.transcribe`:
+
+    python extra/bench/bench_audio.py --minutes 60 --audio-rate 0.5
+"""
+
+import argparse
+import asyncio
+import pathlib
+import sys
+import tempfile
+import time
+import wave
+
+sys.path.insert(0, str(pathlib.Path(__file__).parents[2]))
+
+import numpy as np
+
+from fake_openai import FakeOpenAI
+from lovelaice.audio import transcribe
+from lovelaice.config import AudioConfig, LovelaiceConfig, ModelConfig
+from lovelaice.connectors import LLM
+
+RATE = 16000
+
+
+def write_audio(path: pathlib.Path, minutes: float, seed: int = 0):
+    """Bursts of 3 to 15 seconds separated by half-second pauses, written a burst at a time."""
+    rng = np.random.default_rng(seed)
+    remaining = int(minutes * 60 * RATE)
+
+    with wave.open(str(path), "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(RATE)
+
+        while remaining > 0:
+            burst = rng.standard_normal(min(int(rng.uniform(3, 15) * RATE), remaining)) * 3000
+            pause = rng.standard_normal(min(RATE // 2, max(remaining - len(burst), 0))) * 30
+            out.writeframes(np.concatenate([burst, pause]).clip(-32768, 32767).astype(np.int16).tobytes())
+            remaining -= len(burst) + len(pause)
+
+
+async def main(args):
+    async with FakeOpenAI(audio_rate=args.audio_rate, ttft=args.ttft) as server:
+        model = ModelConfig(base_url=server.base_url, api_key="fake", model="fake")
+        config = LovelaiceConfig(chat_model=model, audio_model=model)
+        audio = AudioConfig(chunk_seconds=args.chunk_seconds, concurrency=args.concurrency)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = pathlib.Path(tmp) / "recording.wav"
+            write_audio(path, args.minutes)
+            print(f"{args.minutes:.0f} minutes of audio, {path.stat().st_size / 2**20:.0f} MB")
+
+            async with LLM(config) as llm:
+                start = time.perf_counter()
+                await llm.transcribe((path.name, path.read_bytes()))
+                print(f"single request: {time.perf_counter() - start:.2f} s")
+
+            async with LLM(config) as llm:
+                start = time.perf_counter()
+                first = None
+                parts = 0
+
+                async for _ in transcribe(llm, path, audio):
+                    first = first or time.perf_counter() - start
+                    parts += 1
+
+                print(f"chunked ({audio.concurrency} concurrent): {time.perf_counter() - start:.2f} s, first text after {first:.2f} s, {parts} parts")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("bench_audio")
+    parser.add_argument("--minutes", type=float, default=60)
+    parser.add_argument("--audio-rate", type=float, default=0.5, help="Seconds the fake provider takes per MB uploaded.")
+    parser.add_argument("--ttft", type=float, default=0.2, help="Fixed seconds per request of the fake provider.")
+    parser.add_argument("--chunk-seconds", type=float, default=30.0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,93 @@
+"""
+Throughput and output size of `google.extract_main_content` vs. the previous
+BeautifulSoup implementation (requires `beautifulsoup4` to be installed).
+
+The corpus is every `*.html` file saved in `extra/bench/html/`, plus
+synthetic pages of increasing size built by repeating the saved ones with
+extra boilerplate. Run with:
+
+    python extra/bench/bench_html.py --repeat 5
+"""
+
+import argparse
+import pathlib
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).parents[2]))
+
+from lovelaice.google import extract_main_content
+
+CORPUS = pathlib.Path(__file__).parent / "html"
+
+BOILERPLATE = """
+<nav><ul>{links}</ul></nav>
+<script>var config = {{"items": [{items}]}}; function track(e) {{ console.log(e); }}</script>
+<style>{styles}</style>
+<svg viewBox="0 0 10 10">{paths}</svg>
+"""
+
+
+def legacy_extract(html, url, query):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+
+    for tag in ['script', 'style', 'svg', 'path', 'footer', 'header', 'nav']:
+        for element in soup.find_all(tag):
+            element.decompose()
+
+    return str(soup)
+
+
+def synthetic(page: str, copies: int) -> str:
+    boilerplate = BOILERPLATE.format(
+        links="".join(f'<li><a href="/p/{i}">Link {i}</a></li>' for i in range(50)),
+        items=",".join(str(i) for i in range(500)),
+        styles="".join(f".c{i} {{ margin: {i}px; }}" for i in range(200)),
+        paths="".join(f'<path d="M{i} {i}L{i + 1} {i + 1}"/>' for i in range(100)),
+    )
+    body = page.split("<body>", 1)[-1].rsplit("</body>", 1)[0]
+    return "<html><body>" + (boilerplate + body) * copies + "</body></html>"
+
+
+def corpus() -> dict[str, str]:
+    pages = {path.name: path.read_text() for path in sorted(CORPUS.glob("*.html"))}
+    base = next(iter(pages.values()))
+
+    for copies in (10, 100, 500):
+        pages[f"synthetic-x{copies}"] = synthetic(base, copies)
+
+    return pages
+
+
+def measure(function, html, repeat):
+    best = float("inf")
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = function(html, "", "")
+        best = min(best, time.perf_counter() - start)
+
+    return best, len(output.encode())
+
+
+def main(args):
+    print(f"{'page':<24} {'size':>9} {'legacy ms':>10} {'new ms':>8} {'speedup':>8} {'legacy out':>11} {'new out':>9}")
+
+    for name, html in corpus().items():
+        legacy_time, legacy_size = measure(legacy_extract, html, args.repeat)
+        new_time, new_size = measure(
+            lambda h, u, q: extract_main_content(h, u, q, max_bytes=args.max_bytes), html, args.repeat
+        )
+        print(
+            f"{name:<24} {len(html.encode()):>9} {legacy_time * 1000:>10.2f} {new_time * 1000:>8.2f} "
+            f"{legacy_time / new_time:>7.1f}x {legacy_size:>11} {new_size:>9}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("bench_html")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-bytes", type=int, default=10**9, help="Output cap for the new extractor.")
+    main(parser.parse_args())
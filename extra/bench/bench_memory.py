@@ -0,0 +1,86 @@
+"""
+Search latency of `lovelaice.memory.Memory` as the index grows.
+
+Builds an index of `--entries` records in a temporary directory (random
+unit vectors, written directly to skip embedding hundreds of thousands of
+texts), then times `search` (best and median of `--repeat`) and reports how
+much the resident memory grew (mostly mapped pages of the index, which unlike
+loaded arrays the OS can drop at any time):
+
+    python extra/bench/bench_memory.py --entries 300000
+"""
+
+import argparse
+import json
+import pathlib
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).parents[2]))
+
+import numpy as np
+
+from lovelaice.memory import Memory
+
+QUERIES = [
+    "how do I run the tests of this project",
+    "what is the weather in Havana",
+    "list the files changed in the last commit",
+    "compute the 30th fibonacci number",
+]
+
+
+def build(memory: Memory, entries: int, seed: int = 0):
+    """Writes `entries` records with random vectors, plus a few real ones to find."""
+    rng = np.random.default_rng(seed)
+    memory.path.mkdir(parents=True, exist_ok=True)
+    offsets = []
+
+    with open(memory.path / "records.jsonl", "wb") as fp:
+        for i in range(entries):
+            offsets.append(fp.tell())
+            fp.write(json.dumps(dict(time=0, query=f"query {i}", answer=f"answer {i}")).encode() + b"\n")
+
+    np.array(offsets, dtype=np.uint64).tofile(memory.path / "offsets.u64")
+
+    with open(memory.path / "vectors.f32", "wb") as fp:
+        for start in range(0, entries, 65536):
+            block = rng.standard_normal((min(65536, entries - start), memory.dim), dtype=np.float32)
+            block /= np.linalg.norm(block, axis=1, keepdims=True)
+            block.tofile(fp)
+
+    for query in QUERIES:
+        memory.add(query, f"the answer to: {query}")
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        memory = Memory(pathlib.Path(tmp), dim=args.dim)
+        start = time.perf_counter()
+        build(memory, args.entries)
+        print(f"built {len(memory)} entries ({len(memory) * args.dim * 4 / 2**20:.0f} MB of vectors) in {time.perf_counter() - start:.1f} s")
+
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        times = []
+
+        for _ in range(args.repeat):
+            for query in QUERIES:
+                start = time.perf_counter()
+                results = memory.search(query, k=args.k)
+                times.append(time.perf_counter() - start)
+                assert results[0][1]["query"] == query, results[0]
+
+        grown = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 1024
+        print(f"search: best={min(times) * 1000:.1f} ms median={statistics.median(times) * 1000:.1f} ms, max RSS grew {grown:.0f} MB (mapped pages, which the OS can reclaim)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("bench_memory")
+    parser.add_argument("--entries", type=int, default=300_000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    main(parser.parse_args())
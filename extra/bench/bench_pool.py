@@ -0,0 +1,82 @@
+"""
+Per-query latency of a fresh `AsyncOpenAI` per call vs. the pooled clients in `LLM`.
+
+Each simulated `Agent.query` makes two sequential calls (routing + answer),
+as the agent does for a non-Chat tool. Run with:
+
+    python extra/bench/bench_pool.py --queries 50 --connect-latency 0.05
+"""
+
+import argparse
+import asyncio
+import pathlib
+import statistics
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).parents[2]))
+
+from openai import AsyncOpenAI
+
+from fake_openai import FakeOpenAI
+from lovelaice.config import LovelaiceConfig, ModelConfig
+from lovelaice.connectors import LLM
+from lovelaice.models import Message
+
+MESSAGES = [Message(role="user", content="hello")]
+
+
+async def fresh_call(config: LovelaiceConfig):
+    # The pre-pooling behaviour: one client (and connection pool) per call.
+    client = AsyncOpenAI(api_key=config.chat_model.api_key, base_url=config.chat_model.base_url)
+    stream = await client.chat.completions.create(
+        messages=[m.model_dump() for m in MESSAGES], model=config.chat_model.model, stream=True
+    )
+
+    async for _ in stream:
+        pass
+
+    await client.close()
+
+
+async def pooled_call(llm: LLM):
+    await llm.chat(MESSAGES)
+
+
+async def measure(name, call, queries):
+    latencies = []
+
+    for _ in range(queries):
+        start = time.perf_counter()
+        await call()
+        await call()
+        latencies.append(time.perf_counter() - start)
+
+    p50 = statistics.median(latencies) * 1000
+    mean = statistics.mean(latencies) * 1000
+    print(f"{name:>8}: mean={mean:8.2f}ms p50={p50:8.2f}ms")
+    return latencies
+
+
+async def main(args):
+    async with FakeOpenAI(connect_latency=args.connect_latency, ttft=args.ttft) as server:
+        config = LovelaiceConfig(chat_model=ModelConfig(base_url=server.base_url, api_key="fake", model="fake"))
+
+        connections = server.connections
+        await measure("fresh", lambda: fresh_call(config), args.queries)
+        print(f"          connections opened: {server.connections - connections}")
+
+        connections = server.connections
+
+        async with LLM(config) as llm:
+            await measure("pooled", lambda: pooled_call(llm), args.queries)
+
+        print(f"          connections opened: {server.connections - connections}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("bench_pool")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--ttft", type=float, default=0.0)
+    parser.add_argument("--connect-latency", type=float, default=0.05)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,112 @@
+"""
+CPU time and writes to print a streamed response, per chunk vs. in frames.
+
+Streams `--chunks` chunks of a Markdown response (prose, a list and a code
+fence) at `--rate` chunks per second, as a fast local model would, to a
+terminal console writing to /dev/null, and compares:
+
+- print: rich `print(chunk, end="", flush=True)` for every chunk, as before.
+- raw: `Renderer`, the text as is in frames (what a pipe gets).
+- markdown: `MarkdownRenderer`, what a terminal gets.
+
+    python extra/bench/bench_render.py --chunks 2000 --rate 1000
+"""
+
+import argparse
+import asyncio
+import os
+import pathlib
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).parents[2]))
+
+from rich.console import Console
+
+from lovelaice.render import MarkdownRenderer, Renderer
+
+RESPONSE = """Here is how to do it, step by step, with **a few** notes along the way.
+
+- First, install the `package` and check its version.
+- Then, run the following code:
+
+```python
+def solve(numbers):
+    total = 0
+
+    for n in numbers:
+        total += n * n
+
+    return total
+```
+
+That is all, the result is printed at the end.
+
+"""
+
+
+class Counter:
+    """A file that counts its writes and flushes, and discards them."""
+
+    def __init__(self) -> None:
+        self.file = open(os.devnull, "w")
+        self.writes = 0
+
+    def write(self, text: str):
+        self.writes += 1
+        return self.file.write(text)
+
+    def flush(self):
+        self.writes += 1
+
+    def isatty(self) -> bool:
+        return True
+
+    def fileno(self):
+        return self.file.fileno()
+
+
+def chunks(count: int):
+    text = RESPONSE * (count * 4 // len(RESPONSE) + 1)
+    return [text[i * 4:(i + 1) * 4] for i in range(count)]
+
+
+async def stream(write, parts: list[str], rate: float):
+    start = time.monotonic()
+
+    for i, part in enumerate(parts):
+        write(part)
+        # Sleeps only every few chunks, as the timer resolution cannot keep up with fast models.
+        if i % 10 == 9:
+            await asyncio.sleep(max(start + (i + 1) / rate - time.monotonic(), 0))
+
+
+async def measure(name: str, parts: list[str], rate: float, fps: float):
+    out = Counter()
+    console = Console(file=out, force_terminal=True, width=100, height=40)
+    start = time.process_time()
+
+    if name == "print":
+        await stream(lambda chunk: console.print(chunk, end="", soft_wrap=True), parts, rate)
+    else:
+        renderer = Renderer(fps, out) if name == "raw" else MarkdownRenderer(fps, console)
+
+        with renderer:
+            await stream(renderer.write, parts, rate)
+
+    print(f"{name:<10} cpu={time.process_time() - start:.3f} s  writes={out.writes}")
+
+
+async def main(args):
+    parts = chunks(args.chunks)
+
+    for name in ["print", "raw", "markdown"]:
+        await measure(name, parts, args.rate, args.fps)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("bench_render")
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=1000.0, help="Chunks per second.")
+    parser.add_argument("--fps", type=float, default=20.0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,83 @@
+"""
+Cold-start budget for the `lovelaice` entry points, based on `python -X importtime`.
+
+Each case imports a module in a fresh interpreter and reports the cumulative
+import time (best of `--repeat` runs), the slowest dependencies, and any heavy
+module that was imported although that path does not need it. Exits with a
+non-zero status if a case goes over its budget, so it can gate CI:
+
+    python extra/bench/bench_startup.py --repeat 5
+"""
+
+import argparse
+import os
+import pathlib
+import subprocess
+import sys
+
+ROOT = pathlib.Path(__file__).parents[2]
+
+# Modules that must only be loaded by the code paths that use them.
+HEAVY = ["openai", "httpx", "requests", "googlesearch", "numpy", "fastapi", "uvicorn", "rich.prompt"]
+
+# (module, budget in ms, heavy modules allowed)
+CASES = [
+    ("lovelaice.client", 50, []),
+    ("lovelaice.cli", 600, []),
+    ("lovelaice.core", 1000, ["numpy"]),
+]
+
+
+def importtime(module: str) -> dict[str, int]:
+    """Cumulative import time in microseconds of every module loaded by `import module` (and at startup)."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(ROOT), os.environ.get("PYTHONPATH", "")]))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env, check=True,
+    )
+    times = {}
+
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = int(cumulative)
+
+    return times
+
+
+def main(args):
+    failed = False
+    startup = set(importtime("sys"))
+    print(f"{'module':<20} {'ms':>8} {'budget':>8}  slowest dependencies / unexpected heavy imports")
+
+    for module, budget, allowed in CASES:
+        runs = [importtime(module) for _ in range(args.repeat)]
+        best = min(runs, key=lambda times: times[module])
+        elapsed = best[module] / 1000
+        budget *= args.scale
+        slowest = sorted(
+            ((t, name) for name, t in best.items() if name not in startup and name != module and "." not in name),
+            reverse=True,
+        )[:3]
+        heavy = [name for name in HEAVY if name in best and name not in allowed]
+        over = elapsed > budget
+
+        print(
+            f"{module:<20} {elapsed:>8.1f} {budget:>8.0f}  "
+            + ", ".join(f"{name} {t / 1000:.0f}" for t, name in slowest)
+            + (f"  [heavy: {', '.join(heavy)}]" if heavy else "")
+            + ("  OVER BUDGET" if over else "")
+        )
+
+        failed = failed or over or bool(heavy)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("bench_startup")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply all budgets, e.g. on slow CI machines.")
+    sys.exit(main(parser.parse_args()))
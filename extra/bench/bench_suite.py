@@ -0,0 +1,289 @@
+"""
+End-to-end benchmarks of `lovelaice` against `fake_openai`, so that changes to
+`LLM` or `Agent` can be measured without a live (and noisy) provider.
+
+Cases (select some with `--cases`):
+
+- cli: a one-shot query in a fresh process (`--no-daemon`), routed locally to Chat.
+- daemon: the same query through a warm background daemon.
+- complete: `--complete` in a fresh process.
+- complete_files: `--complete-files` on a file with `--markers` markers.
+- api: `--clients` concurrent clients sending `--requests` requests each to `/complete`.
+- routing: local tool routing decisions, in-process.
+- batch: `--batch-size` queries from a JSONL file with `--batch`, `--clients` at a time, in one process.
+
+Every metric ends in `_ms` (lower is better) or `_per_s` (higher is better).
+`--save` writes the results to `extra/bench/results/<version>.json`, and
+`--compare FILE` prints the change of each metric against a previous run,
+exiting with a non-zero status if any got worse by more than `--tolerance`:
+
+    python extra/bench/bench_suite.py --save
+    python extra/bench/bench_suite.py --compare extra/bench/results/0.3.6.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+ROOT = pathlib.Path(__file__).parents[2]
+RESULTS = pathlib.Path(__file__).parent / "results"
+
+sys.path.insert(0, str(ROOT))
+
+from fake_openai import FakeOpenAI
+from lovelaice import VERSION
+
+QUERY = "hello there, how are you today?"
+ROUTING_PASSES = 25
+CASES = ["cli", "daemon", "complete", "complete_files", "api", "routing", "batch"]
+
+
+def summary(seconds: list[float]) -> dict:
+    ordered = sorted(seconds)
+
+    return dict(
+        median_ms=statistics.median(ordered) * 1000,
+        p95_ms=ordered[min(int(0.95 * len(ordered)), len(ordered) - 1)] * 1000,
+    )
+
+
+def start_fake(args) -> FakeOpenAI:
+    """Serves the fake provider from a background thread, for this process and its children."""
+    loop = asyncio.new_event_loop()
+    server = FakeOpenAI(ttft=args.ttft, token_rate=args.token_rate, tokens=args.tokens, seed=args.seed)
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    asyncio.run_coroutine_threadsafe(server.start(), loop).result()
+    return server
+
+
+def write_config(workdir: pathlib.Path, server: FakeOpenAI, args):
+    model = dict(base_url=server.base_url, api_key="fake", model="fake")
+    config = dict(
+        chat_model=model,
+        router=dict(mode="local"),
+        cache=dict(enabled=False),
+        api=dict(concurrency=args.clients, queue=args.clients * args.requests),
+    )
+    (workdir / ".lovelaice.yml").write_text(json.dumps(config))
+
+
+class Bench:
+    def __init__(self, args, workdir: pathlib.Path, server: FakeOpenAI) -> None:
+        self.args = args
+        self.workdir = workdir
+        self.server = server
+        self.env = dict(
+            os.environ,
+            PYTHONPATH=os.pathsep.join([str(ROOT), os.environ.get("PYTHONPATH", "")]),
+            XDG_CACHE_HOME=str(workdir / "cache"),
+            XDG_RUNTIME_DIR=str(workdir / "run"),
+        )
+        self.env.pop("LOVELAICE_DAEMON", None)
+
+    def lovelaice(self, *argv: str) -> float:
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "lovelaice", *argv],
+            cwd=self.workdir, env=self.env, check=True, stdout=subprocess.DEVNULL, stdin=subprocess.DEVNULL,
+        )
+        return time.perf_counter() - start
+
+    def cli(self) -> dict:
+        return summary([self.lovelaice("--no-daemon", QUERY) for _ in range(self.args.repeat)])
+
+    def daemon(self) -> dict:
+        self.lovelaice(QUERY)
+
+        try:
+            return summary([self.lovelaice(QUERY) for _ in range(self.args.repeat)])
+        finally:
+            self.lovelaice("--stop-daemon")
+
+    def complete(self) -> dict:
+        return summary([self.lovelaice("--no-daemon", "-c", "once upon a time") for _ in range(self.args.repeat)])
+
+    def complete_files(self) -> dict:
+        path = self.workdir / "story.md"
+        times = []
+
+        for _ in range(self.args.repeat):
+            path.write_text("".join(f"Chapter {i}.\n\n+++\n\n" for i in range(self.args.markers)))
+            times.append(self.lovelaice("-cf", str(path)))
+
+        return summary(times)
+
+    def api(self) -> dict:
+        port = _free_port()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "lovelaice", "--api", "--port", str(port)],
+            cwd=self.workdir, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+
+        try:
+            _wait_for(f"http://127.0.0.1:{port}/health")
+            return asyncio.run(self._api_load(f"http://127.0.0.1:{port}"))
+        finally:
+            process.terminate()
+            process.wait()
+
+    async def _api_load(self, url: str) -> dict:
+        import httpx
+
+        latencies = []
+        limits = httpx.Limits(max_connections=self.args.clients)
+
+        async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as http:
+            async def client(c: int):
+                for i in range(self.args.requests):
+                    start = time.perf_counter()
+                    response = await http.post("/complete", json=dict(prompt=f"client {c} request {i}", stream=False))
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(client(c) for c in range(self.args.clients)))
+            elapsed = time.perf_counter() - start
+
+        return dict(summary(latencies), requests_per_s=len(latencies) / elapsed)
+
+    def routing(self) -> dict:
+        from lovelaice.cli import build_agent
+        from lovelaice.config import LovelaiceConfig
+        from lovelaice.connectors import LLM
+        from lovelaice.core import LocalRouter
+
+        config = LovelaiceConfig.load(self.workdir)
+        agent = build_agent(config, LLM(config))
+        router = LocalRouter(agent.tools, config.router.threshold, config.router.margin)
+        prompts = [example for tool in agent.tools for example in tool.examples]
+
+        async def route_all(passes: int):
+            for _ in range(passes):
+                for prompt in prompts:
+                    await router.route(prompt)
+
+        asyncio.run(route_all(1))
+        runs = []
+
+        for _ in range(self.args.repeat):
+            start = time.perf_counter()
+            asyncio.run(route_all(ROUTING_PASSES))
+            runs.append((time.perf_counter() - start) / (len(prompts) * ROUTING_PASSES))
+
+        return dict(summary(runs), routes_per_s=1 / statistics.median(runs))
+
+    def batch(self) -> dict:
+        source = self.workdir / "batch.jsonl"
+        output = self.workdir / "batch.out.jsonl"
+        source.write_text("".join(json.dumps(dict(id=i, prompt=f"{QUERY} ({i})")) + "\n" for i in range(self.args.batch_size)))
+        times = []
+
+        for _ in range(self.args.repeat):
+            output.unlink(missing_ok=True)
+            times.append(self.lovelaice("--batch", str(source), "--jobs", str(self.args.clients)))
+
+        return dict(summary(times), queries_per_s=self.args.batch_size / statistics.median(times))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+
+    while True:
+        try:
+            urllib.request.urlopen(url, timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+
+            time.sleep(0.1)
+
+
+def compare(results: dict, previous: dict, tolerance: float) -> bool:
+    """Prints the change of each metric, returning whether any got worse by more than `tolerance`."""
+    worse = False
+    print(f"\nvs. {previous['version']} ({time.strftime('%Y-%m-%d %H:%M', time.localtime(previous['time']))})")
+
+    for case, metrics in results["results"].items():
+        for metric, value in metrics.items():
+            old = previous["results"].get(case, {}).get(metric)
+
+            if not old:
+                continue
+
+            change = value / old - 1
+            regression = change > tolerance if metric.endswith("_ms") else change < -tolerance
+            worse = worse or regression
+            print(f"{case:<16} {metric:<16} {old:>12.2f} {value:>12.2f} {change:>+8.1%}" + ("  REGRESSION" if regression else ""))
+
+    return worse
+
+
+def main(args):
+    cases = args.cases.split(",") if args.cases else CASES
+    server = start_fake(args)
+    results = dict(
+        version=VERSION,
+        time=time.time(),
+        python=platform.python_version(),
+        machine=platform.machine(),
+        params={k: v for k, v in vars(args).items() if k not in ("save", "compare", "cases")},
+        results={},
+    )
+
+    with tempfile.TemporaryDirectory() as workdir:
+        workdir = pathlib.Path(workdir)
+        write_config(workdir, server, args)
+        bench = Bench(args, workdir, server)
+
+        for case in cases:
+            metrics = getattr(bench, case)()
+            results["results"][case] = metrics
+            print(f"{case:<16} " + "  ".join(f"{k}={v:.2f}" for k, v in metrics.items()), flush=True)
+
+    if args.save:
+        RESULTS.mkdir(exist_ok=True)
+        path = RESULTS / f"{VERSION}.json"
+        path.write_text(json.dumps(results, indent=2))
+        print(f"Saved to {path}")
+
+    if args.compare:
+        previous = json.loads(pathlib.Path(args.compare).read_text())
+        return 1 if compare(results, previous, args.tolerance) else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("bench_suite")
+    parser.add_argument("--cases", default="", help=f"Comma-separated cases to run, out of: {', '.join(CASES)}.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--ttft", type=float, default=0.05, help="Seconds before the first token of the fake provider.")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="Tokens per second of the fake provider.")
+    parser.add_argument("--tokens", type=int, default=16, help="Tokens per response.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--markers", type=int, default=8, help="Markers in the --complete-files case.")
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent clients in the api case.")
+    parser.add_argument("--requests", type=int, default=8, help="Requests per client in the api case.")
+    parser.add_argument("--batch-size", type=int, default=64, help="Queries in the batch case.")
+    parser.add_argument("--save", action="store_true", help="Save the results under extra/bench/results/.")
+    parser.add_argument("--compare", default=None, metavar="FILE", help="Compare against previously saved results.")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative change that counts as a regression.")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,310 @@
+"""
+A tiny OpenAI-compatible server for benchmarking lovelaice without a real provider.
+
+It speaks just enough HTTP/1.1 (keep-alive included) to serve streaming
+`/chat/completions` and `/completions` requests, and `/audio/transcriptions`
+(streamed if asked to), with a configurable time-to-first-token and token rate
+(plus `audio_rate` seconds per MB of uploaded audio, standing in for decoding it). Every new TCP connection pays
+`connect_latency` seconds before being served, which stands in for the
+TCP + TLS handshake cost of a remote provider.
+
+Failures can be scripted with `faults`, a list of what happens to the next
+requests, in order: "429" (rate limited, with a Retry-After header), "500",
+"stall" (never sends a token), "slow" (ten times the ttft), or "ok".
+Once the script runs out, `error_rate` of the requests fail with a 429 or
+a 500 and `stall_rate` of them stall, drawn from a generator seeded with
+`seed` so that runs are reproducible.
+
+Run standalone with:
+
+    python extra/bench/fake_openai.py --port 8765 --ttft 0.05 --connect-latency 0.1
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+
+class FakeOpenAI:
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        ttft=0.0,
+        token_rate=0.0,
+        tokens=16,
+        connect_latency=0.0,
+        faults=(),
+        retry_after=0.05,
+        error_rate=0.0,
+        stall_rate=0.0,
+        seed=0,
+        audio_rate=0.0,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.ttft = ttft
+        self.token_rate = token_rate
+        self.tokens = tokens
+        self.connect_latency = connect_latency
+        self.faults = list(faults)
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.random = random.Random(seed)
+        self.audio_rate = audio_rate
+        self.connections = 0
+        self.requests = 0
+        self._server: asyncio.Server | None = None
+        self._writers: set[asyncio.StreamWriter] = set()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+
+            # Idle keep-alive connections would otherwise hold `wait_closed` forever.
+            for writer in self._writers:
+                writer.close()
+
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *args):
+        await self.stop()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        self._writers.add(writer)
+
+        if self.connect_latency:
+            await asyncio.sleep(self.connect_latency)
+
+        try:
+            while True:
+                request = await _read_request(reader)
+
+                if request is None:
+                    break
+
+                self.requests += 1
+                method, path, headers, body = request
+                await self._respond(reader, writer, path, body)
+
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    def _fault(self) -> str:
+        if self.faults:
+            return self.faults.pop(0)
+
+        draw = self.random.random()
+
+        if draw < self.error_rate:
+            return self.random.choice(["429", "500"])
+
+        if draw < self.error_rate + self.stall_rate:
+            return "stall"
+
+        return "ok"
+
+    async def _respond(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, path: str, body: bytes):
+        if path.endswith("/chat/completions"):
+            kind = "chat"
+        elif path.endswith("/completions"):
+            kind = "text"
+        elif path.endswith("/audio/transcriptions"):
+            kind = "audio"
+        else:
+            return await _send(writer, 404, b'{"error": {"message": "not found"}}')
+
+        fault = self._fault()
+
+        if fault == "429":
+            error = b'{"error": {"message": "rate limited", "type": "rate_limit_error"}}'
+            return await _send(writer, 429, error, {"Retry-After": self.retry_after})
+        elif fault == "500":
+            return await _send(writer, 500, b'{"error": {"message": "internal error", "type": "server_error"}}')
+
+        if kind == "audio":
+            # A multipart form: only the `stream` field matters here.
+            payload = dict(stream=b'name="stream"\r\n\r\ntrue' in body)
+
+            if self.audio_rate:
+                await asyncio.sleep(len(body) / 2**20 * self.audio_rate)
+        else:
+            payload = json.loads(body or b"{}")
+
+        if kind == "audio" and not payload["stream"]:
+            await self._wait(reader, writer, fault)
+            text = "".join(f"word{i} " for i in range(self.tokens))
+            return await _send(writer, 200, json.dumps(dict(text=text)).encode())
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Transfer-Encoding: chunked\r\n"
+            b"Connection: keep-alive\r\n\r\n"
+        )
+
+        if not await self._wait(reader, writer, fault):
+            return
+
+        # Completions accept a list of prompts, answered as choices with matching indices.
+        prompts = payload.get("prompt")
+        choices = len(prompts) if kind == "text" and isinstance(prompts, list) else 1
+
+        for i in range(self.tokens):
+            if i and self.token_rate:
+                await asyncio.sleep(1 / self.token_rate)
+
+            if kind == "audio":
+                _write_chunk(writer, _data(dict(type="transcript.text.delta", delta=f"word{i} ")))
+            else:
+                _write_chunk(writer, _event(kind, payload.get("model", "fake"), f"tok{i} ", choices))
+
+            await writer.drain()
+
+        if kind == "audio":
+            text = "".join(f"word{i} " for i in range(self.tokens))
+            _write_chunk(writer, _data(dict(type="transcript.text.done", text=text)))
+
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            prompt_tokens = sum(len(str(p).split()) for p in (prompts if choices > 1 else [payload.get("prompt") or payload.get("messages")]))
+            usage = dict(prompt_tokens=prompt_tokens, completion_tokens=self.tokens * choices, total_tokens=prompt_tokens + self.tokens * choices)
+            _write_chunk(writer, _event(kind, payload.get("model", "fake"), "", 0, usage))
+
+        _write_chunk(writer, b"data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _wait(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, fault: str) -> bool:
+        """Waits for the first token. Returns False if the request stalled until the client gave up."""
+        if fault == "stall":
+            # Hold the request until the client gives up on it.
+            await writer.drain()
+            await reader.read()
+            return False
+
+        if self.ttft:
+            await asyncio.sleep(self.ttft * (10 if fault == "slow" else 1))
+
+        return True
+
+
+def _event(kind: str, model: str, text: str, choices: int = 1, usage: dict | None = None) -> bytes:
+    if kind == "chat":
+        choices = [dict(index=i, delta=dict(role="assistant", content=text), finish_reason=None) for i in range(choices)]
+        obj = "chat.completion.chunk"
+    else:
+        choices = [dict(index=i, text=text, logprobs=None, finish_reason=None) for i in range(choices)]
+        obj = "text_completion"
+
+    return _data(dict(id="fake", object=obj, created=int(time.time()), model=model, choices=choices, usage=usage))
+
+
+def _data(data: dict) -> bytes:
+    return b"data: " + json.dumps(data).encode() + b"\n\n"
+
+
+def _write_chunk(writer: asyncio.StreamWriter, data: bytes):
+    writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+
+async def _send(writer: asyncio.StreamWriter, status: int, body: bytes, headers: dict | None = None):
+    head = [f"HTTP/1.1 {status} Fake", "Content-Type: application/json", f"Content-Length: {len(body)}"]
+    head += [f"{k}: {v}" for k, v in (headers or {}).items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+    await writer.drain()
+
+
+async def _read_request(reader: asyncio.StreamReader):
+    line = await reader.readline()
+
+    if not line:
+        return None
+
+    method, path, _ = line.decode("latin1").split(" ", 2)
+    headers = {}
+
+    while True:
+        line = await reader.readline()
+
+        if line in (b"\r\n", b"\n", b""):
+            break
+
+        key, _, value = line.decode("latin1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        body = b""
+
+        while size := int((await reader.readline()).split(b";")[0], 16):
+            body += await reader.readexactly(size)
+            await reader.readline()
+
+        await reader.readline()
+    else:
+        length = int(headers.get("content-length", 0))
+        body = await reader.readexactly(length) if length else b""
+
+    return method, path, headers, body
+
+
+async def _serve(args):
+    server = FakeOpenAI(
+        host=args.host,
+        port=args.port,
+        ttft=args.ttft,
+        token_rate=args.token_rate,
+        tokens=args.tokens,
+        connect_latency=args.connect_latency,
+        error_rate=args.error_rate,
+        stall_rate=args.stall_rate,
+        seed=args.seed,
+        audio_rate=args.audio_rate,
+    )
+
+    async with server:
+        print(f"Serving fake OpenAI API on {server.base_url}", flush=True)
+        await asyncio.Event().wait()
+
+
+def _parser():
+    parser = argparse.ArgumentParser("fake_openai")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ttft", type=float, default=0.0, help="Seconds before the first token.")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="Tokens per second (0 = unthrottled).")
+    parser.add_argument("--tokens", type=int, default=16, help="Tokens per response.")
+    parser.add_argument("--connect-latency", type=float, default=0.0, help="Simulated handshake cost per new connection.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail with a 429 or a 500.")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Fraction of requests that never send a token.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the error and stall injection.")
+    parser.add_argument("--audio-rate", type=float, default=0.0, help="Seconds of processing per MB of uploaded audio.")
+    return parser
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(_serve(_parser().parse_args()))
+    except KeyboardInterrupt:
+        pass
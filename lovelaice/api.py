@@ -1,21 +1,180 @@
-from fastapi import FastAPI
-from .core import Agent
-from .connectors import OpenAILLM
-from .config import LovelaiceConfig
-from .tools import *
+import asyncio
+import contextlib
+import json
+
 import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from .cli import build_agent
+from .config import LovelaiceConfig
+from .connectors import LLM
+from .google import ProcessPool
+from .tools import decline, prompter
+
+
+class ChatRequest(BaseModel):
+    prompt: str
+    tool: str | None = None
+    max_tokens: int | None = None
+
+
+class CompleteRequest(BaseModel):
+    prompt: str
+    max_tokens: int | None = None
+    stream: bool = True
+
+
+class Limiter:
+    """
+    Admits at most `concurrency` requests at a time, with up to `queue`
+    more waiting for a slot. Requests beyond that are rejected right away.
+    """
+
+    def __init__(self, concurrency: int = 8, queue: int = 32) -> None:
+        self.concurrency = max(concurrency, 1)
+        self.queue = queue
+        self.running = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def acquire(self) -> bool:
+        """Waits for a slot, or returns False if the queue is full."""
+        if self._semaphore.locked() and self.waiting >= self.queue:
+            return False
+
+        self.waiting += 1
+
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.running += 1
+        return True
+
+    def release(self):
+        self.running -= 1
+        self._semaphore.release()
+
+
+class EventStream(StreamingResponse):
+    """
+    Server-Sent Events response that closes its source and gives back its
+    `Limiter` slot however it ends, including when the client disconnects.
+    """
+
+    def __init__(self, events, limiter: Limiter) -> None:
+        super().__init__(events, media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+            self.limiter.release()
+
+
+def sse(data: dict, event: str | None = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _events(chunks):
+    try:
+        async for chunk in chunks:
+            yield sse(dict(text=chunk))
+    except Exception as e:
+        yield sse(dict(message=f"{type(e).__name__}: {e}"), event="error")
+        return
+
+    yield sse({}, event="done")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    config = LovelaiceConfig.load()
+    llm = LLM(config)
+    executor = ProcessPool()
+    agent = build_agent(config, llm, executor)
+    agent.warmup()
+
+    app.state.config = config
+    app.state.llm = llm
+    app.state.agent = agent
+    app.state.limiter = Limiter(config.api.concurrency, config.api.queue)
+
+    try:
+        yield
+    finally:
+        await agent.close()
+        await llm.close()
+        executor.shutdown(cancel_futures=True)
+
+
+app = FastAPI(title="Lovelaice", lifespan=lifespan)
+
+
+async def _admit(request: Request) -> Limiter:
+    limiter: Limiter = request.app.state.limiter
+
+    if not await limiter.acquire():
+        retry_after = str(request.app.state.config.api.retry_after)
+        raise HTTPException(429, "Too many requests, try again later.", headers={"Retry-After": retry_after})
+
+    return limiter
+
+
+@app.post("/chat")
+async def chat(body: ChatRequest, request: Request):
+    """Answers `prompt` with the agent, streaming the response as Server-Sent Events."""
+    config: LovelaiceConfig = request.app.state.config
+    agent = request.app.state.agent
+    limiter = await _admit(request)
+
+    async def chunks():
+        prompter.set(decline)
+
+        async for chunk in agent.query(body.prompt, use_tool=body.tool, max_tokens=body.max_tokens or config.max_tokens):
+            yield chunk
+
+    return EventStream(_events(chunks()), limiter)
+
+
+@app.post("/complete")
+async def complete(body: CompleteRequest, request: Request):
+    """Completes `prompt`, streaming Server-Sent Events, or returning the whole text if not `stream`."""
+    config: LovelaiceConfig = request.app.state.config
+    llm: LLM = request.app.state.llm
+    limiter = await _admit(request)
+    chunks = llm.complete_stream(body.prompt, max_tokens=body.max_tokens or config.max_tokens)
+
+    if body.stream:
+        return EventStream(_events(chunks), limiter)
+
+    try:
+        completion = "".join([chunk async for chunk in chunks])
+    finally:
+        limiter.release()
 
-app = FastAPI(title="Lovelaice")
+    return dict(completion=body.prompt + completion)
 
-config = LovelaiceConfig.load()
-llm = OpenAILLM(config.model, config.api_key, config.base_url)
-agent: Agent = Agent(llm, tools=[Bash(), Chat(), Interpreter(), Codegen()])
 
+@app.get("/health")
+async def health(request: Request):
+    limiter: Limiter = request.app.state.limiter
+    llm: LLM = request.app.state.llm
+    coalescing = llm.coalescing
 
-@app.post("/complete/")
-async def chat(prompt):
-    completion = await llm.complete(prompt, max_tokens=config.max_tokens)
-    return dict(completion=prompt + completion)
+    return dict(
+        status="ok",
+        running=limiter.running,
+        waiting=limiter.waiting,
+        coalescing=dict(coalescing.model_dump(), hit_rate=coalescing.hit_rate, saved=coalescing.saved),
+        models=llm.latency(),
+    )
 
 
 def run_api(debug, host, port):
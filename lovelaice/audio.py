@@ -0,0 +1,244 @@
+"""
+Transcription of long recordings in concurrent chunks.
+
+A WAV file (or anything `ffmpeg`, if installed, can convert to one) is
+split into chunks of about `chunk_seconds`, cut at the quietest pause near
+the end of each chunk when there is one, or else at a fixed point with
+`overlap` seconds shared with the next chunk. The chunks are transcribed
+concurrently, and their text is yielded in order as soon as it is ready,
+with the words transcribed twice in an overlap removed.
+"""
+
+import asyncio
+import difflib
+import io
+import pathlib
+import re
+import shutil
+import wave
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from .config import AudioConfig
+
+if TYPE_CHECKING:
+    from .connectors import LLM
+
+
+# Loudness is measured over steps of this many seconds.
+STEP = 0.02
+
+
+class Chunk:
+    def __init__(self, start: float, end: float, overlapped: bool) -> None:
+        self.start = start
+        self.end = end
+        # Whether it starts before the end of the previous chunk.
+        self.overlapped = overlapped
+
+    def __repr__(self) -> str:
+        return f"Chunk({self.start:.2f}, {self.end:.2f}, overlapped={self.overlapped})"
+
+
+def loudness(audio: wave.Wave_read, step: float = STEP, block: int = 2**16) -> np.ndarray:
+    """The RMS of the samples of each `step` seconds, read in blocks of about `block` frames."""
+    frames = max(int(audio.getframerate() * step), 1)
+    block = max(block // frames, 1) * frames
+    levels = []
+    audio.rewind()
+
+    while True:
+        samples = _samples(audio.readframes(block), audio.getsampwidth())
+
+        if not len(samples):
+            break
+
+        samples = samples.reshape(-1, audio.getnchannels()).mean(axis=1)
+        steps = -(-len(samples) // frames)
+        samples = np.pad(samples, (0, steps * frames - len(samples)))
+        levels.append(np.sqrt((samples.reshape(steps, frames) ** 2).mean(axis=1)))
+
+    return np.concatenate(levels) if levels else np.empty(0)
+
+
+def _samples(data: bytes, width: int) -> np.ndarray:
+    """PCM bytes as float samples."""
+    if width == 1:
+        return np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128
+
+    if width == 3:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+        return ((raw[:, 0].astype(np.int32) | raw[:, 1].astype(np.int32) << 8 | raw[:, 2].astype(np.int32) << 16) << 8 >> 8).astype(np.float32)
+
+    return np.frombuffer(data, dtype=f"<i{width}").astype(np.float32)
+
+
+def split(levels: np.ndarray, duration: float, config: AudioConfig, step: float = STEP) -> list[Chunk]:
+    """
+    Chunks of about `config.chunk_seconds` covering `duration` seconds. Each one ends at the
+    quietest `min_silence` seconds of its second half if quiet enough, or else overlaps the next.
+    """
+    size = max(config.chunk_seconds, 1.0)
+    overlap = min(max(config.overlap, 0.0), size / 4)
+    window = max(int(config.min_silence / step), 1)
+    # The average loudness over each window, and what counts as a pause.
+    smoothed = np.convolve(levels, np.ones(window) / window, mode="valid") if len(levels) >= window else levels
+    quiet = config.silence * float(levels.mean()) if len(levels) else 0.0
+
+    chunks = []
+    start, overlapped = 0.0, False
+
+    # The last chunk may be a bit longer, rather than leaving a tiny one.
+    while duration - start > size * 1.25:
+        low, high = int((start + size / 2) / step), min(int((start + size) / step), len(smoothed))
+
+        if high > low and smoothed[low + (i := int(np.argmin(smoothed[low:high])))] <= quiet:
+            end = (low + i + window / 2) * step
+            chunks.append(Chunk(start, end, overlapped))
+            start, overlapped = end, False
+        else:
+            end = start + size
+            chunks.append(Chunk(start, end, overlapped))
+            start, overlapped = end - overlap, overlap > 0
+
+    chunks.append(Chunk(start, duration, overlapped))
+    return chunks
+
+
+def encode(audio: wave.Wave_read, chunk: Chunk) -> bytes:
+    """The frames of `chunk` as a WAV file of their own."""
+    rate = audio.getframerate()
+    audio.setpos(int(chunk.start * rate))
+    frames = audio.readframes(int(chunk.end * rate) - int(chunk.start * rate))
+    output = io.BytesIO()
+
+    with wave.open(output, "wb") as out:
+        out.setnchannels(audio.getnchannels())
+        out.setsampwidth(audio.getsampwidth())
+        out.setframerate(rate)
+        out.writeframes(frames)
+
+    return output.getvalue()
+
+
+def _normalize(word: str) -> str:
+    return re.sub(r"\W", "", word.lower())
+
+
+class Stitcher:
+    """
+    Joins the text of consecutive chunks. The last `window` words of a chunk that
+    overlaps the next are held back until the next one arrives, and then the
+    longest run of words both share is kept only once, cutting each chunk there:
+    the words cut off at the edges of a chunk are the least reliable.
+    """
+
+    def __init__(self, window: int) -> None:
+        self.window = window
+        self.held: list[str] = []
+        self.started = False
+
+    def add(self, text: str, overlapped: bool, overlaps_next: bool) -> str:
+        """The text that can be output after adding the chunk `text`."""
+        words = text.split()
+
+        if overlapped and self.held and words:
+            head = words[:self.window]
+            matcher = difflib.SequenceMatcher(None, [_normalize(w) for w in self.held], [_normalize(w) for w in head], autojunk=False)
+            match = matcher.find_longest_match(0, len(self.held), 0, len(head))
+
+            # A single common word may well be a coincidence.
+            if match.size >= min(2, len(head)):
+                self.held = self.held[:match.a + match.size]
+                words = words[match.b + match.size:]
+
+        words = self.held + words
+        self.held = []
+
+        if overlaps_next:
+            words, self.held = words[:max(len(words) - self.window, 0)], words[max(len(words) - self.window, 0):]
+
+        return self._join(words)
+
+    def flush(self) -> str:
+        words, self.held = self.held, []
+        return self._join(words)
+
+    def _join(self, words: list[str]) -> str:
+        if not words:
+            return ""
+
+        text = " ".join(words)
+
+        if self.started:
+            text = " " + text
+
+        self.started = True
+        return text
+
+
+async def _wav(path: pathlib.Path) -> io.BytesIO | None:
+    """Converts `path` to a 16 kHz mono WAV with `ffmpeg`, or None if not installed or it fails."""
+    if shutil.which("ffmpeg") is None:
+        return None
+
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-v", "error", "-i", str(path), "-ac", "1", "-ar", "16000", "-f", "wav", "-",
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+    )
+    data, _ = await process.communicate()
+    return io.BytesIO(data) if process.returncode == 0 else None
+
+
+async def transcribe(llm: "LLM", path: str | pathlib.Path, config: AudioConfig):
+    """Yields the transcription of the audio file at `path`, in order, as its chunks finish."""
+    path = pathlib.Path(path)
+
+    try:
+        audio = wave.open(str(path), "rb")
+    except (wave.Error, EOFError):
+        source = await _wav(path)
+
+        if source is None:
+            # Not something we can split: sent as is.
+            yield await llm.transcribe((path.name, path.read_bytes()))
+            return
+
+        audio = wave.open(source, "rb")
+
+    with audio:
+        duration = audio.getnframes() / audio.getframerate()
+
+        if duration <= config.chunk_seconds * 1.25:
+            yield await llm.transcribe((f"{path.stem}.wav", encode(audio, Chunk(0.0, duration, False))))
+            return
+
+        chunks = split(loudness(audio), duration, config)
+        limit = asyncio.Semaphore(max(config.concurrency, 1))
+
+        async def run(i: int, chunk: Chunk) -> str:
+            async with limit:
+                # Read when its turn comes, so only the chunks being sent are in memory.
+                data = encode(audio, chunk)
+                return await llm.transcribe((f"{path.stem}.{i}.wav", data))
+
+        tasks = [asyncio.create_task(run(i, chunk)) for i, chunk in enumerate(chunks)]
+        # Enough words to cover the overlap, even when spoken fast.
+        stitcher = Stitcher(max(int(config.overlap * 4) + 4, 8))
+
+        try:
+            for i, (chunk, task) in enumerate(zip(chunks, tasks)):
+                overlaps_next = i + 1 < len(chunks) and chunks[i + 1].overlapped
+                text = stitcher.add(await task, chunk.overlapped, overlaps_next)
+
+                if text:
+                    yield text
+
+            if text := stitcher.flush():
+                yield text
+        finally:
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,197 @@
+"""
+Runs every query of a JSONL file through one process, `concurrency` at a time.
+
+Each input line is either a JSON string (the prompt) or an object with a
+`prompt` and optionally an `id` (the line number by default), a `tool` and
+`max_tokens`. Each result is appended to the output as soon as it finishes,
+as one JSON object with the `id`, the `output` (or `error`), and how long it
+took. Records already in the output without an error are skipped, so running
+the same batch again resumes it after an interruption.
+"""
+
+import asyncio
+import json
+import pathlib
+import time
+from typing import TYPE_CHECKING
+
+from rich import print
+
+from .cli import continuation
+from .config import LovelaiceConfig
+from .connectors import LLM, Latency
+from .tools import decline, prompter
+
+if TYPE_CHECKING:
+    from .core import Agent
+
+
+def output_path(path: str) -> pathlib.Path:
+    """The default output of a batch: `queries.jsonl` -> `queries.out.jsonl`."""
+    path = pathlib.Path(path)
+    return path.with_name(f"{path.stem}.out.jsonl")
+
+
+def key(id) -> str:
+    """A hashable key for a record `id`, which may be any JSON value."""
+    return json.dumps(id, sort_keys=True)
+
+
+def finished(path: pathlib.Path) -> set[str]:
+    """
+    The keys of the ids with a successful result in `path`. A last line cut by an
+    interruption is removed, so that the next result is not appended to it.
+    """
+    done = set()
+
+    try:
+        with open(path, "rb+") as fp:
+            end = 0
+
+            for line in fp:
+                if not line.endswith(b"\n"):
+                    fp.truncate(end)
+                    break
+
+                end += len(line)
+
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+                if isinstance(record, dict) and "id" in record and "error" not in record:
+                    done.add(key(record["id"]))
+    except FileNotFoundError:
+        pass
+
+    return done
+
+
+def records(path: pathlib.Path):
+    """Yields the `(id, request)` of each line in `path`, where `request` is an error message if the line is invalid."""
+    with open(path) as fp:
+        for number, line in enumerate(fp, 1):
+            if not line.strip():
+                continue
+
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield number, f"Invalid JSON: {e}"
+                continue
+
+            if isinstance(request, str):
+                request = dict(prompt=request)
+
+            if not isinstance(request, dict) or not isinstance(request.get("prompt"), str):
+                yield number, "Expected a string or an object with a `prompt`"
+                continue
+
+            yield request.get("id", number), request
+
+
+class Batch:
+    def __init__(self, config: LovelaiceConfig, llm: LLM, agent: "Agent | None", concurrency: int) -> None:
+        self.config = config
+        self.llm = llm
+        self.agent = agent
+        self.concurrency = max(concurrency, 1)
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.chars = 0
+        self.elapsed = 0.0
+        self.latency = Latency(size=2**20)
+        self.ttft = Latency(size=2**20)
+
+    async def run(self, source: pathlib.Path, output: pathlib.Path):
+        skip = finished(output)
+        pending = records(source)
+        start = time.perf_counter()
+
+        with open(output, "a") as out:
+            async def worker():
+                # Nobody is there to confirm, as in the API.
+                prompter.set(decline)
+
+                for id, request in pending:
+                    if key(id) in skip:
+                        self.skipped += 1
+                        continue
+
+                    result = await self._run(id, request)
+                    out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    out.flush()
+
+            await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+        self.elapsed = time.perf_counter() - start
+
+    async def _run(self, id, request: dict | str) -> dict:
+        if isinstance(request, str):
+            self.failed += 1
+            return dict(id=id, error=request)
+
+        start = time.perf_counter()
+        ttft = None
+        chunks = []
+
+        try:
+            async for chunk in self._chunks(request):
+                if ttft is None and chunk:
+                    ttft = time.perf_counter() - start
+
+                chunks.append(chunk)
+        except Exception as e:
+            self.failed += 1
+            return dict(id=id, error=f"{type(e).__name__}: {e}", elapsed=time.perf_counter() - start)
+
+        elapsed = time.perf_counter() - start
+        output = "".join(chunks)
+        self.done += 1
+        self.chars += len(output)
+        self.latency.add(elapsed)
+
+        if ttft is not None:
+            self.ttft.add(ttft)
+
+        return dict(id=id, output=output, elapsed=elapsed, ttft=ttft)
+
+    def _chunks(self, request: dict):
+        max_tokens = request.get("max_tokens") or self.config.max_tokens
+
+        if self.agent is None:
+            return continuation(request["prompt"], self.config, self.llm, max_tokens)
+
+        return self.agent.query(request["prompt"], use_tool=request.get("tool"), max_tokens=max_tokens)
+
+    def report(self) -> list[str]:
+        elapsed = max(self.elapsed, 1e-9)
+        latency, ttft = self.latency.summary(), self.ttft.summary()
+
+        return [
+            f":: {self.done} done, {self.failed} failed, {self.skipped} skipped (already done) in {elapsed:.1f} s "
+            f"with {self.concurrency} concurrent, {self.done / elapsed:.2f} queries/s, {self.chars / elapsed:.0f} chars/s",
+            f":: Latency p50/p95/p99 {latency['p50']:.2f}/{latency['p95']:.2f}/{latency['p99']:.2f} s, "
+            f"TTFT p50/p95/p99 {ttft['p50']:.2f}/{ttft['p95']:.2f}/{ttft['p99']:.2f} s",
+        ]
+
+
+async def run_batch(args, config: LovelaiceConfig, llm: LLM, agent: "Agent | None"):
+    output = pathlib.Path(args.output) if args.output else output_path(args.batch)
+    batch = Batch(config, llm, agent, args.jobs or config.batch_concurrency)
+
+    if agent is not None:
+        agent.warmup()
+
+    try:
+        await batch.run(pathlib.Path(args.batch), output)
+    finally:
+        if agent is not None:
+            await agent.close()
+
+    print(f"Results written to {output}.")
+
+    for line in batch.report():
+        print(f"[dim]{line}[/dim]")
@@ -0,0 +1,122 @@
+import collections
+import random
+
+
+CHARS_PER_TOKEN = 4
+SAMPLED_LINE = 80
+
+
+def estimate_tokens(text: str) -> int:
+    """A cheap, tokenizer-free estimate of the number of tokens in `text`."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class BoundedOutput:
+    """
+    Collects streamed tool output within a token budget, in constant memory.
+
+    The first lines are kept until half the budget is used (the head), and
+    the most recent lines fill the rest (the tail). Lines pushed out of the
+    tail are dropped and counted, except for an optional uniform sample of
+    them (`sample` is the fraction of the budget reserved for it), cut
+    to `SAMPLED_LINE` characters. Very long lines are cut to a fraction
+    of the budget.
+    """
+
+    def __init__(self, tokens: int = 2048, sample: float = 0.0, seed: int = 0) -> None:
+        budget = max(tokens, 1) * CHARS_PER_TOKEN
+        self.max_line = max(budget // 8, 80)
+        self.sample_budget = int(budget * min(max(sample, 0.0), 0.5))
+        self.head_budget = (budget - self.sample_budget) // 2
+        self.tail_budget = budget - self.sample_budget - self.head_budget
+
+        self.head: list[str] = []
+        self.head_chars = 0
+        self.tail: collections.deque[str] = collections.deque()
+        self.tail_chars = 0
+        self.sampled: list[tuple[int, str]] = []
+        self.sample_size = self.sample_budget // SAMPLED_LINE
+        self.dropped_lines = 0
+        self.dropped_bytes = 0
+        self.lines = 0
+        self._partial = ""
+        self._random = random.Random(seed)
+
+    def write(self, text: str):
+        """Adds a chunk of output, which may contain partial lines."""
+        text = self._partial + text
+        lines = text.split("\n")
+        self._partial = lines.pop()
+
+        if len(self._partial) > self.max_line:
+            self._drop_chars(self._partial[self.max_line:])
+            self._partial = self._partial[:self.max_line]
+
+        for line in lines:
+            self._add(line + "\n")
+
+    def flush(self):
+        if self._partial:
+            self._add(self._partial)
+            self._partial = ""
+
+    def text(self) -> str:
+        self.flush()
+        parts = list(self.head)
+
+        if self.dropped_lines or self.sampled:
+            omitted = self.dropped_lines
+            parts.append(f"\n[... {omitted} lines ({self.dropped_bytes} bytes) omitted ...]\n")
+
+            if self.sampled:
+                parts.append(f"[... {len(self.sampled)} lines sampled from the middle: ...]\n")
+                parts.extend(line for _, line in sorted(self.sampled))
+                parts.append("[... end of sampled lines ...]\n")
+
+        parts.extend(self.tail)
+        return "".join(parts)
+
+    def __str__(self) -> str:
+        return self.text()
+
+    def _add(self, line: str):
+        self.lines += 1
+
+        if len(line) > self.max_line:
+            self._drop_chars(line[self.max_line:])
+            line = line[:self.max_line] + " [...]\n"
+
+        if not self.tail and self.head_chars + len(line) <= self.head_budget:
+            self.head.append(line)
+            self.head_chars += len(line)
+            return
+
+        self.tail.append(line)
+        self.tail_chars += len(line)
+
+        while self.tail_chars > self.tail_budget and len(self.tail) > 1:
+            evicted = self.tail.popleft()
+            self.tail_chars -= len(evicted)
+            self._evict(evicted)
+
+    def _evict(self, line: str):
+        # Reservoir sampling (Algorithm R) over the lines evicted from the tail.
+        if self.sample_size:
+            if len(line) > SAMPLED_LINE:
+                self._drop_chars(line[SAMPLED_LINE - 1:])
+                line = line[:SAMPLED_LINE - 1] + "\n"
+
+            if len(self.sampled) < self.sample_size:
+                self.sampled.append((self.lines, line))
+                return
+
+            index = self._random.randint(0, self.dropped_lines + self.sample_size)
+
+            if index < self.sample_size:
+                self.sampled[index], line = (self.lines, line), self.sampled[index][1]
+
+        self.dropped_lines += 1
+        self.dropped_bytes += len(line.encode())
+
+    def _drop_chars(self, text: str):
+        self.dropped_bytes += len(text.encode())
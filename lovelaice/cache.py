@@ -0,0 +1,334 @@
+import collections
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+
+
+def cache_dir() -> pathlib.Path:
+    """The per-user cache directory, following the XDG convention."""
+    root = os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+    return pathlib.Path(root) / "lovelaice"
+
+
+def cache_key(*parts) -> str:
+    """A stable hash of any JSON-serializable request description."""
+    data = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache of streamed LLM responses, stored as the list of chunks
+    so they can be replayed exactly as they were received.
+
+    The memory tier is an LRU of at most `memory_entries` responses.
+    The disk tier is an SQLite database bounded to `disk_bytes`, evicting
+    the least recently accessed entries first. Entries older than `ttl`
+    seconds are ignored and dropped on both tiers.
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path | None = None,
+        ttl: float = 86400,
+        memory_entries: int = 256,
+        disk_bytes: int = 64 * 2**20,
+    ) -> None:
+        self.path = path or cache_dir() / "responses.sqlite"
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.disk_bytes = disk_bytes
+        self._memory: collections.OrderedDict[str, tuple[float, list[str]]] = collections.OrderedDict()
+        self._db: sqlite3.Connection | None = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.path, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, created REAL, accessed REAL, size INTEGER, chunks TEXT)"
+            )
+
+        return self._db
+
+    def get(self, key: str) -> list[str] | None:
+        now = time.time()
+        entry = self._memory.get(key)
+
+        if entry is not None:
+            created, chunks = entry
+
+            if now - created <= self.ttl:
+                self._memory.move_to_end(key)
+                return chunks
+
+            del self._memory[key]
+
+        if not self.disk_bytes:
+            return None
+
+        row = self.db.execute("SELECT created, chunks FROM responses WHERE key = ?", (key,)).fetchone()
+
+        if row is None:
+            return None
+
+        created, data = row
+
+        if now - created > self.ttl:
+            self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            return None
+
+        self.db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        chunks = json.loads(data)
+        self._remember(key, created, chunks)
+        return chunks
+
+    def put(self, key: str, chunks: list[str]):
+        now = time.time()
+        self._remember(key, now, chunks)
+
+        if not self.disk_bytes:
+            return
+
+        data = json.dumps(chunks, ensure_ascii=False)
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+            (key, now, now, len(data), data),
+        )
+        self._evict(now)
+
+    def clear(self):
+        self._memory.clear()
+        self.db.execute("DELETE FROM responses")
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _remember(self, key: str, created: float, chunks: list[str]):
+        if not self.memory_entries:
+            return
+
+        self._memory[key] = (created, chunks)
+        self._memory.move_to_end(key)
+
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now: float):
+        self.db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+        if total <= self.disk_bytes:
+            return
+
+        rows = self.db.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall()
+
+        for key, size in rows:
+            if total <= self.disk_bytes:
+                break
+
+            self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+
+
+class PageCache:
+    """
+    Disk cache of fetched web pages and search results.
+
+    Pages are content-addressed by the hash of their URL: each entry stores
+    the raw HTML, the extracted text (when known) and a small JSON record with
+    the `ETag` and `Last-Modified` validators for conditional requests.
+    Pages younger than `page_ttl` are served without touching the network.
+    Search result lists are kept for `search_ttl` seconds. The whole cache is
+    bounded to `max_bytes`: its size is kept as a running total, and only when
+    it is unknown (on the first write) or over the limit is the cache scanned,
+    in a background thread, evicting the least recently used entries (all the
+    files of a page together) down to 90% of the limit.
+    """
+
+    def __init__(
+        self,
+        root: pathlib.Path | None = None,
+        max_bytes: int = 256 * 2**20,
+        page_ttl: float = 3600,
+        search_ttl: float = 86400,
+    ) -> None:
+        self.root = root or cache_dir() / "web"
+        self.max_bytes = max_bytes
+        self.page_ttl = page_ttl
+        self.search_ttl = search_ttl
+        self._size: int | None = None
+        # What was written or deleted while a scan was running, added to its total.
+        self._delta = 0
+        self._lock = threading.Lock()
+        self._scan: threading.Thread | None = None
+
+    def _path(self, kind: str, key: str, suffix: str) -> pathlib.Path:
+        return self.root / kind / key[:2] / f"{key}{suffix}"
+
+    def page(self, url: str) -> dict | None:
+        """The stored record of `url` (validators and fetch time), if any."""
+        key = cache_key(url)
+        meta = self._read(self._path("pages", key, ".json"))
+
+        if meta is None or not self._path("pages", key, ".html").exists():
+            return None
+
+        meta["fresh"] = time.time() - meta["fetched"] <= self.page_ttl
+        return meta
+
+    def validators(self, url: str) -> dict:
+        """Headers for a conditional GET of `url`."""
+        meta = self.page(url) or {}
+        headers = {}
+
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+        return headers
+
+    def html(self, url: str) -> str | None:
+        return self._text(self._path("pages", cache_key(url), ".html"))
+
+    def text(self, url: str) -> str | None:
+        return self._text(self._path("pages", cache_key(url), ".txt"))
+
+    def store(self, url: str, html: str, etag: str | None = None, last_modified: str | None = None):
+        key = cache_key(url)
+        self._write(self._path("pages", key, ".html"), html)
+        self._unlink(self._path("pages", key, ".txt"))
+        meta = dict(url=url, etag=etag, last_modified=last_modified, fetched=time.time())
+        self._write(self._path("pages", key, ".json"), json.dumps(meta))
+
+    def store_text(self, url: str, text: str):
+        self._write(self._path("pages", cache_key(url), ".txt"), text)
+
+    def revalidated(self, url: str):
+        """Marks `url` as fresh again after a `304 Not Modified`."""
+        path = self._path("pages", cache_key(url), ".json")
+        meta = self._read(path)
+
+        if meta is not None:
+            meta["fetched"] = time.time()
+            self._write(path, json.dumps(meta))
+
+    def search(self, query: str, num_results: int) -> list[dict] | None:
+        data = self._read(self._path("search", cache_key(query, num_results), ".json"))
+
+        if data is None or time.time() - data["created"] > self.search_ttl:
+            return None
+
+        return data["results"]
+
+    def store_search(self, query: str, num_results: int, results: list[dict]):
+        data = dict(query=query, created=time.time(), results=results)
+        self._write(self._path("search", cache_key(query, num_results), ".json"), json.dumps(data))
+
+    @property
+    def size(self) -> int | None:
+        """The total size of the cache, or None until it has been scanned."""
+        return self._size
+
+    def evict(self, target: int | None = None):
+        """
+        Scans the cache, deleting the least recently used entries until it is at
+        most `target` bytes (`max_bytes` by default), and updates its size.
+        """
+        target = self.max_bytes if target is None else target
+        entries: dict[pathlib.Path, list] = {}
+
+        with self._lock:
+            self._delta = 0
+
+        for path in self.root.rglob("*"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+
+            if not path.is_file():
+                continue
+
+            # The files of an entry share the hash, e.g., `<key>.html`, `<key>.txt` and `<key>.json`.
+            entry = entries.setdefault(path.parent / path.name.split(".")[0], [0.0, 0, []])
+            entry[0] = max(entry[0], stat.st_atime, stat.st_mtime)
+            entry[1] += stat.st_size
+            entry[2].append(path)
+
+        total = sum(size for _, size, _ in entries.values())
+
+        for _, size, paths in sorted(entries.values(), key=lambda entry: entry[0]):
+            if total <= target:
+                break
+
+            for path in paths:
+                path.unlink(missing_ok=True)
+
+            total -= size
+
+        with self._lock:
+            self._size = total + self._delta
+
+    def _check(self):
+        """Starts a scan in the background if the size is unknown or over the limit, and none is running."""
+        if self._scan is not None and self._scan.is_alive():
+            return
+
+        if self._size is None or self._size > self.max_bytes:
+            self._scan = threading.Thread(target=self.evict, args=(self.max_bytes * 9 // 10,), daemon=True)
+            self._scan.start()
+
+    def _text(self, path: pathlib.Path) -> str | None:
+        try:
+            text = path.read_text(encoding="utf-8")
+        except OSError:
+            return None
+
+        os.utime(path)
+        return text
+
+    def _read(self, path: pathlib.Path) -> dict | None:
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path: pathlib.Path, data: str):
+        old = _size(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp = path.with_suffix(path.suffix + ".tmp")
+        temp.write_text(data, encoding="utf-8")
+        os.replace(temp, path)
+        self._add(_size(path) - old)
+        self._check()
+
+    def _unlink(self, path: pathlib.Path):
+        size = _size(path)
+        path.unlink(missing_ok=True)
+        self._add(-size)
+
+    def _add(self, size: int):
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+
+            self._delta += size
+
+
+def _size(path: pathlib.Path) -> int:
+    try:
+        return path.stat().st_size
+    except OSError:
+        return 0
@@ -1,20 +1,31 @@
 import os
 import dotenv
+import shutil
 import asyncio
+import pathlib
+import tempfile
 import argparse
+import contextlib
+from typing import TYPE_CHECKING
 from pydantic import BaseModel
-from rich.prompt import Prompt, Confirm
 from rich import print
-from .core import Agent
 from .connectors import LLM
-from .tools import Bash, Chat, Codegen, Interpreter, Weather
+from .buffers import estimate_tokens
+from .cache import PageCache
 from .config import LovelaiceConfig
+from .trace import span, tracing
+from .watch import Watcher, signature
 
+if TYPE_CHECKING:
+    # The agent, its tools and their dependencies are imported only when a query runs.
+    import concurrent.futures
 
-def run():
-    dotenv.load_dotenv()
-    config = LovelaiceConfig.load()
+    from .core import Agent
+    from .memory import Memory
+    from .sandbox import SandboxPool
 
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser("lovelaice", usage="lovelaice [options] query ...")
     parser.add_argument("--version", action="store_true", help="Print version and exit")
     parser.add_argument(
@@ -48,62 +59,189 @@ def run():
         "-a", "--audio", action="store", help="Add an audio file to the context"
     )
 
+    parser.add_argument(
+        "-b", "--batch", action="store", help="Run every query in this JSONL file (or complete it, with --complete) and write the results to --output.", metavar="FILE", default=None
+    )
+    parser.add_argument("-o", "--output", action="store", help="Used only with --batch, where to write the results (FILE.out.jsonl by default).", metavar="FILE", default=None)
+    parser.add_argument("-j", "--jobs", action="store", type=int, help="Used only with --batch, max number of queries run at the same time.", default=None)
+
     parser.add_argument("--api", action="store_true", help="Run an HTTP server instead of CLI.", default=False)
     parser.add_argument("--host", action="store", help="Host to bind the API.", default="127.0.0.1")
     parser.add_argument("--port", action="store", type=int, help="Port to bind the API.", default=8000)
     parser.add_argument("--debug", action="store_true", help="Runs in debug mode, e.g. more verbose.", default=False)
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the response cache.", default=False)
+    parser.add_argument("--profile", action="store_true", help="Print how long each stage of the answer took, and its tokens.", default=False)
+    parser.add_argument("--trace", action="store", help="Append a JSON line with the timings of each stage to this file.", metavar="FILE", default=None)
+    parser.add_argument("--daemon", action="store_true", help="Run the background daemon that serves queries (started automatically).", default=False)
+    parser.add_argument("--stop-daemon", action="store_true", help="Stop the background daemon, if running.", default=False)
+    parser.add_argument("--no-daemon", action="store_true", help="Run this query in-process instead of through the daemon.", default=False)
     parser.add_argument("query", nargs="*", default=None)
 
-    args = parser.parse_args()
+    return parser
+
+
+def run():
+    args = build_parser().parse_args()
 
     if args.version:
         from lovelaice import VERSION
         print(f"version={VERSION}")
         return
 
+    dotenv.load_dotenv()
+    config = LovelaiceConfig.load()
+
     if args.config:
         configure(config)
         return
 
-    llm = LLM(config)
-
-    if args.complete:
-        asyncio.run(complete(args, config, llm))
+    if args.daemon:
+        from .daemon import serve
+        asyncio.run(serve(config))
         return
 
-    if args.complete_files:
-        asyncio.run(complete_files(args, config, llm))
+    if args.stop_daemon:
+        from .client import stop
+        stop()
         return
 
-    agent = Agent(
-        llm,
-        tools=[Bash(), Chat(), Interpreter(), Codegen(), Weather()],
-    )
-
     if args.api:
         try:
             from .api import run_api
-            run_api(debug=args.debug, host=args.host, port=args.port)
         except ImportError:
             print("[red]ERROR[white]: To run the API you need to install lovelaice with the `api` extra.")
+            return
+
+        run_api(debug=args.debug, host=args.host, port=args.port)
+        return
+
+    if args.no_cache:
+        config.cache.enabled = False
+
+    llm = LLM(config)
+
+    if args.batch:
+        from .batch import run_batch
+        from .google import ProcessPool
+
+        # A batch runs long enough for a warm pool of processes to pay off.
+        executor = ProcessPool()
+        agent = None if args.complete else build_agent(config, llm, executor)
+
+        try:
+            asyncio.run(_closing(llm, run_batch(args, config, llm, agent)))
+        except KeyboardInterrupt:
+            print("Interrupted, run the same command again to resume.")
+        finally:
+            executor.shutdown(cancel_futures=True)
 
         return
 
+    if args.complete:
+        asyncio.run(_closing(llm, complete(args, config, llm)))
+        return
+
+    if args.complete_files:
+        asyncio.run(_closing(llm, complete_files(args, config, llm)))
+        return
+
+    agent = build_agent(config, llm)
+
     if args.query:
-        asyncio.run(run_once(args, config, agent))
-    else:
-        asyncio.run(run_forever(args, config, agent))
+        asyncio.run(_closing(llm, run_once(args, config, agent)))
+        return
+
+    try:
+        asyncio.run(_closing(llm, run_forever(args, config, agent)))
+    except KeyboardInterrupt:
+        pass
+
+
+def environment(cwd: str, env: dict[str, str]) -> dict[str, str]:
+    """The environment of a query run from `cwd`: `env`, plus what the nearest `.env` sets that it does not."""
+    for path in [pathlib.Path(cwd), *pathlib.Path(cwd).parents]:
+        if (path / ".env").is_file():
+            values = dotenv.dotenv_values(path / ".env")
+            return {**{k: v for k, v in values.items() if v is not None}, **env}
+
+    return dict(env)
+
+
+def build_agent(config: LovelaiceConfig, llm: LLM, executor: "concurrent.futures.Executor | None" = None) -> "Agent":
+    from .core import Agent
+    from .tools import Bash, Chat, Codegen, GoogleSearch, Interpreter, Weather
+
+    return Agent(
+        llm,
+        tools=[
+            Bash(timeout=config.bash_timeout),
+            Chat(),
+            Interpreter(_sandbox(config)),
+            Codegen(),
+            Weather(),
+            GoogleSearch(
+                num_results=config.search.results,
+                deadline=config.search.deadline,
+                per_host=config.search.per_host,
+                delay=config.search.delay,
+                timeout=config.search.timeout,
+                cache=_page_cache(config),
+                executor=executor,
+            ),
+        ],
+        memory=_memory(config),
+    )
+
+
+async def _closing(llm: LLM, coro):
+    async with llm:
+        return await coro
+
+
+def _sandbox(config: LovelaiceConfig) -> "SandboxPool":
+    from .sandbox import SandboxPool
+
+    return SandboxPool(
+        workers=config.sandbox.workers,
+        preload=[m.strip() for m in config.sandbox.preload.split(",") if m.strip()],
+        cpu_seconds=config.sandbox.cpu_seconds,
+        memory_mb=config.sandbox.memory_mb,
+        timeout=config.sandbox.timeout,
+    )
+
+
+def _memory(config: LovelaiceConfig) -> "Memory | None":
+    if not config.memory.enabled:
+        return None
+
+    from .memory import Memory
+
+    path = pathlib.Path(config.memory.path).expanduser() if config.memory.path else None
+    return Memory(path, dim=config.memory.dim)
+
+
+def _page_cache(config: LovelaiceConfig) -> PageCache | None:
+    if not config.search.cache:
+        return None
+
+    return PageCache(
+        max_bytes=config.search.cache_mb * 2**20,
+        page_ttl=config.search.page_ttl,
+        search_ttl=config.search.search_ttl,
+    )
 
 
 def _build_config(model: type[BaseModel], old_config, indent=0):
+    from rich.prompt import Prompt
+
     new_config = {}
 
     for field, info in model.model_fields.items():
         if isinstance(info.annotation, type) and issubclass(info.annotation, BaseModel):
-            print(f"[purple]{indent * "  "}{field}[/purple]: {info.description}\n")
+            print(f"[purple]{indent * '  '}{field}[/purple]: {info.description}\n")
             value = _build_config(info.annotation, old_config.get(field, {}), indent+1)
         else:
-            print(f"[yellow]{indent * "  "}{info.description}[/yellow]")
+            print(f"[yellow]{indent * '  '}{info.description}[/yellow]")
             value = Prompt.ask(indent * "  " + field, default=str(old_config[field]))
             print()
 
@@ -114,6 +252,8 @@ def _build_config(model: type[BaseModel], old_config, indent=0):
 
 
 def configure(config: LovelaiceConfig):
+    from rich.prompt import Confirm
+
     old_config = config.model_dump(mode="json")
     new_config = _build_config(LovelaiceConfig, old_config)
 
@@ -125,16 +265,36 @@ def configure(config: LovelaiceConfig):
 
 
 async def complete(args, config: LovelaiceConfig, llm: LLM):
+    from .render import renderer
+
+    with traced(args) as trace, renderer(config.render, markdown=False) as out:
+        async for chunk in completion(args, config, llm):
+            out.write(chunk)
+
+        out.write("\n")
+
+    if args.profile:
+        _print_dim(trace.report())
+
+
+async def completion(args, config: LovelaiceConfig, llm: LLM):
+    """Yields the prompt followed by its completion, continued until `min_words` are reached."""
     prompt = " ".join(args.query)
 
-    print(prompt, end="", flush=True)
+    yield prompt
 
+    async for chunk in continuation(prompt, config, llm):
+        yield chunk
+
+
+async def continuation(prompt: str, config: LovelaiceConfig, llm: LLM, max_tokens: int | None = None):
+    """Yields the completion of `prompt`, continued until `min_words` are reached."""
     while True:
         generated = False
 
-        async for chunk in llm.complete_stream(prompt, max_tokens=config.max_tokens):
+        async for chunk in llm.complete_stream(prompt, max_tokens=max_tokens or config.max_tokens):
             prompt += chunk
-            print(chunk, end="", flush=True)
+            yield chunk
 
             if chunk:
                 generated = True
@@ -142,95 +302,285 @@ async def complete(args, config: LovelaiceConfig, llm: LLM):
         if not generated or len(prompt.split()) > config.min_words:
             break
 
-    print()
 
+async def complete_files(args, config: LovelaiceConfig, llm: LLM):
+    watcher = Watcher(args.complete_files)
+    limit = asyncio.Semaphore(max(config.complete_concurrency, 1))
+    await asyncio.gather(*(_complete_file(file, config, llm, watcher, limit) for file in watcher.targets()))
 
-async def _detect_file_changes(file, interval=1):
-    last_modified = os.path.getmtime(file)
+    if not args.watch:
+        return
 
-    while True:
-        current_modified = os.path.getmtime(file)
+    print("Waiting for changes, press Ctrl+C to stop.")
+    running: dict[pathlib.Path, asyncio.Task] = {}
+    dirty: set[pathlib.Path] = set()
+
+    async def complete(file):
+        while True:
+            dirty.discard(file)
+            await _complete_file(file, config, llm, watcher, limit)
+
+            if file not in dirty:
+                break
+
+    async for changed in watcher:
+        for file in changed:
+            if file in running and not running[file].done():
+                dirty.add(file)
+            else:
+                running[file] = asyncio.create_task(complete(file))
+
+
+MARKER = "+++"
+
+
+async def _complete_file(
+    file,
+    config: LovelaiceConfig,
+    llm: LLM,
+    watcher: Watcher,
+    limit: asyncio.Semaphore,
+    interval: float = 0.1,
+):
+    """
+    Completes every `+++` marker in `file`, each from the text that precedes it
+    (without the other markers). Completions run concurrently, bounded by `limit`,
+    and stream into the file, which is atomically rewritten at most every `interval`
+    seconds. If someone else changes the file meanwhile, the remaining work is dropped.
+    """
+    path = pathlib.Path(file)
+
+    try:
+        with open(path, newline="") as fp:
+            text = fp.read()
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"Cannot read {file}: {e}")
+        return
 
-        if current_modified != last_modified:
-            return
+    parts = text.split(MARKER)
+    prompts = ["".join(parts[:i + 1]) for i in range(len(parts) - 1)]
+    pending = [i for i, prompt in enumerate(prompts) if prompt.strip()]
 
-        await asyncio.sleep(interval)
+    if not pending:
+        print(f"Nothing to do in {file}.")
+        return
 
+    # None keeps the marker in place, a string is the completion so far.
+    outputs: list[str | None] = [None] * len(prompts)
+    written = signature(path)
+    updated = asyncio.Event()
+
+    def flush():
+        nonlocal written
+
+        if signature(path) != written:
+            raise FileChangedError(path)
+
+        content = parts[0] + "".join(
+            (MARKER if output is None else output) + part for output, part in zip(outputs, parts[1:])
+        )
+        _write_atomic(path, content)
+        watcher.expect(path)
+        written = signature(path)
+
+    async def writer():
+        while True:
+            await updated.wait()
+            updated.clear()
+            flush()
+            await asyncio.sleep(interval)
+
+    async def run(i):
+        async with limit:
+            try:
+                async for chunk in llm.complete_stream(prompts[i], max_tokens=config.max_tokens):
+                    outputs[i] = (outputs[i] or "") + chunk
+                    updated.set()
+            except Exception:
+                outputs[i] = None
+                raise
 
-async def complete_files(args, config, llm: LLM):
-    for file in args.complete_files:
-        await _complete_file(file, args, llm)
+    print(f"Running completion on {file}...")
+    writing = asyncio.create_task(writer())
+    tasks = [asyncio.create_task(run(i)) for i in pending]
 
+    try:
+        running = set(tasks)
 
-async def _complete_file(file, args, config: LovelaiceConfig, llm: LLM):
-    while True:
-        prompt = []
-        complete = False
-
-        with open(file) as fp:
-            for line in fp:
-                if line.strip().endswith("+++"):
-                    if line.strip() != "+++":
-                        prompt.append(line.replace("+++", ""))
-                    complete = True
-                    break
-                else:
-                    prompt.append(line)
-
-        prompt = "\n".join(prompt)
-
-        if prompt and complete:
-            print(f"Running completion on {file}...")
-            response = await llm.complete(prompt, max_tokens=config.max_tokens)
-            print(f"Done with completion on {file}.")
-
-            lines = open(file).readlines()
-
-            with open(file, "w") as fp:
-                for line in lines:
-                    if "+++" in line:
-                        line = line.replace("+++", response)
-
-                    fp.write(line)
-        else:
-            print(f"Nothing to do in {file}.")
+        while running:
+            done, running = await asyncio.wait([writing, *running], return_when=asyncio.FIRST_COMPLETED)
 
-        if args.watch:
-            print(f"Waiting for changes on {file}.")
-            await _detect_file_changes(file)
-        else:
-            return
+            if writing in done:
+                writing.result()
+
+            running.discard(writing)
+
+        flush()
+    except FileChangedError:
+        print(f"{file} changed during completion, stopping.")
+        return
+    except OSError as e:
+        print(f"Cannot write {file}: {e}")
+        return
+    finally:
+        for task in [writing, *tasks]:
+            task.cancel()
+
+        await asyncio.gather(writing, *tasks, return_exceptions=True)
+
+    for task in tasks:
+        if task.exception() is not None:
+            print(f"Completion failed on {file}: {task.exception()}")
+
+    print(f"Done with completion on {file}.")
+
+
+class FileChangedError(Exception):
+    pass
+
+
+def _write_atomic(path: pathlib.Path, content: str):
+    fd, temp = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+
+    try:
+        with os.fdopen(fd, "w", newline="") as fp:
+            fp.write(content)
+
+        shutil.copymode(path, temp)
+        os.replace(temp, path)
+    except BaseException:
+        os.unlink(temp)
+        raise
+
+
+async def run_once(args, config: LovelaiceConfig, agent: "Agent"):
+    from .render import renderer
+    from .tools import prompter
+
+    with traced(args) as trace, renderer(config.render) as out:
+        prompter.set(out.ask)
 
+        async for response in answer(args, config, agent):
+            out.write(response)
 
-async def run_once(args, config: LovelaiceConfig, agent: Agent):
+        out.write("\n")
+
+    if args.debug:
+        _print_dim(route_info(agent))
+
+    if args.profile:
+        _print_dim(trace.report())
+
+
+@contextlib.contextmanager
+def traced(args, cwd: str = "."):
+    """Traces the command if `--profile` or `--trace` is given, appending it to the `--trace` file."""
+    if not args.profile and not args.trace:
+        yield None
+        return
+
+    with tracing(command="complete" if args.complete else "query", query=" ".join(args.query)) as trace:
+        yield trace
+
+    if args.trace:
+        trace.append(pathlib.Path(cwd) / args.trace)
+
+
+async def answer(args, config: LovelaiceConfig, agent: "Agent", cwd: str = "."):
+    """
+    Yields the agent's response to the query in `args`, preceded by the
+    transcription of the `--audio` file (if any) as it progresses.
+    """
     prompt = " ".join(args.query)
-    transcription = ""
 
     if args.audio:
-        with open(args.audio, 'rb') as fp:
-            transcription = await agent.client.transcribe(fp)
+        from .audio import transcribe
+
+        transcription = []
 
-    prompt = "\n\n".join([transcription, prompt])
+        with span("transcribe"):
+            async for text in transcribe(agent.client, pathlib.Path(cwd) / args.audio, config.audio):
+                transcription.append(text)
+                yield text
+
+        yield "\n\n"
+        prompt = "\n\n".join(["".join(transcription), prompt])
 
     async for response in agent.query(prompt, max_tokens=config.max_tokens):
-        print(response, end="", flush=True)
+        yield response
+
+
+def _print_dim(lines: list[str]):
+    for line in lines:
+        print(f"[dim]{line}[/dim]")
+
+
+def route_info(agent: "Agent") -> list[str]:
+    lines = []
+    route = agent.last_route
+
+    if route is not None:
+        lines.append(f":: Routed to {route.tool} by {route.source} router (confidence={route.confidence:.2f}) in {route.elapsed * 1000:.1f} ms")
 
-    print()
+    if agent.speculative:
+        spec = agent.speculation
+        lines.append(f":: Speculation: {spec.hits}/{spec.attempts} used, {spec.wasted_rate:.0%} wasted, {spec.ttft_saved * 1000:.1f} ms TTFT saved")
 
+    if agent.cascade.escalated:
+        lines.append(f":: Cascade: {agent.cascade.escalated}/{agent.cascade.checked} tool responses escalated to the chat model")
+
+    history = agent.history
+
+    if len(history) or history.summary:
+        summary = f", summary of ~{estimate_tokens(history.summary)} tokens" if history.summary else ""
+        lines.append(f":: History: {len(history)} recent messages (~{history.tokens} tokens){summary}")
+
+    coalescing = agent.client.coalescing
+
+    if coalescing.saved:
+        lines.append(f":: Coalescing: {coalescing.shared}/{coalescing.requests} requests shared ({coalescing.hit_rate:.0%}), {coalescing.batched} batched, {coalescing.saved} upstream requests saved")
+
+    for name, stats in agent.client.latency().items():
+        ttft = stats["ttft"]
+
+        if ttft["count"]:
+            lines.append(
+                f":: {name} model: TTFT p50/p95/p99 {ttft['p50'] * 1000:.0f}/{ttft['p95'] * 1000:.0f}/{ttft['p99'] * 1000:.0f} ms over {ttft['count']} requests, "
+                f"{stats['retries']} retries, {stats['stalls']} stalls, {stats['hedges']} hedged ({stats['hedge_wins']} won), {stats['throttled']:.1f} s throttled"
+            )
+
+    return lines
+
+
+async def run_forever(args, config: LovelaiceConfig, agent: "Agent"):
+    from .render import renderer
+    from .tools import prompter, read_input
+
+    agent.warmup()
 
-async def run_forever(args, config: LovelaiceConfig, agent: Agent):
     while True:
         try:
-            prompt = input("> ")
+            # Reading in a thread keeps the loop free, e.g., to summarize the history while the user types.
+            prompt = await read_input("> ")
 
-            try:
-                async for response in agent.query(prompt, max_tokens=config.max_tokens):
-                    print(response, end="", flush=True)
-            except asyncio.exceptions.CancelledError:
-                print("(!) Cancelled")
+            with renderer(config.render) as out:
+                prompter.set(out.ask)
+
+                try:
+                    async for response in agent.query(prompt, history=agent.history, max_tokens=config.max_tokens):
+                        out.write(response)
+                except asyncio.exceptions.CancelledError:
+                    out.write("(!) Cancelled")
 
-            print("\n")
+                out.write("\n")
+
+            print()
+
+            if args.debug:
+                _print_dim(route_info(agent))
         except KeyboardInterrupt:
             break
         except EOFError:
             break
+
+    await agent.close()
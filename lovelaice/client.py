@@ -0,0 +1,207 @@
+"""
+Thin client for the lovelaice daemon.
+
+This module only depends on the standard library, so a query can be sent
+and its response streamed back without paying for the heavy imports (openai,
+pydantic, rich, ...) on every invocation. The daemon is started in the
+background when none is running, and everything it cannot serve falls back
+to the regular in-process CLI.
+
+The protocol is one JSON object per line in both directions. The client sends
+a `query` (or `stop`) message, and the daemon replies with `chunk` messages to
+print, `ask` messages that expect an `answer`, and a final `exit` or `error`.
+A `local` reply asks the client to run the command in-process instead, which
+the daemon also sends when the answer is to be rendered as Markdown on the
+client's terminal (with `tty` set in the query), since only the CLI can render it.
+"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from . import VERSION
+
+
+# Commands that are always run in-process: interactive, long-running, or trivial.
+LOCAL_FLAGS = {
+    "-h", "--help", "--version", "--config", "--api", "-cf", "--complete-files", "-w", "--watch",
+    "--daemon", "--stop-daemon", "--no-daemon", "-b", "--batch",
+}
+
+
+def runtime_dir() -> str:
+    root = os.environ.get("XDG_RUNTIME_DIR")
+
+    if not root:
+        root = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+
+    return os.path.join(root, "lovelaice")
+
+
+def socket_path() -> str:
+    return os.path.join(runtime_dir(), "daemon.sock")
+
+
+def run():
+    argv = sys.argv[1:]
+
+    if argv == ["--version"]:
+        print(f"version={VERSION}")
+        return
+
+    # Without Unix sockets (e.g., on Windows) there is no daemon.
+    if not argv or os.environ.get("LOVELAICE_DAEMON") == "0" or not hasattr(socket, "AF_UNIX") or any(map(_is_local, _options(argv))):
+        return _local()
+
+    code = query(argv)
+
+    if code is None:
+        return _local()
+
+    sys.exit(code)
+
+
+def _local():
+    from .cli import run
+
+    run()
+
+
+def _options(argv: list[str]):
+    """The arguments that may be options, i.e., those before a `--`."""
+    for arg in argv:
+        if arg == "--":
+            return
+
+        yield arg
+
+
+def _is_local(arg: str) -> bool:
+    """Whether `arg` is one of the `LOCAL_FLAGS`, also as `--flag=value` or a short flag with its value (`-bFILE`)."""
+    if arg.startswith("--"):
+        return arg.partition("=")[0] in LOCAL_FLAGS
+
+    return any(arg.startswith(flag) for flag in LOCAL_FLAGS if not flag.startswith("--"))
+
+
+def connect(start: bool = True, timeout: float = 10.0) -> socket.socket | None:
+    """Connects to the daemon, starting it first if `start` is set. Returns None if unavailable."""
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+
+    deadline = time.monotonic() + timeout
+    started = False
+
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        try:
+            sock.connect(socket_path())
+            return sock
+        except OSError:
+            sock.close()
+
+        if not start or time.monotonic() > deadline:
+            return None
+
+        if not started:
+            _spawn()
+            started = True
+
+        time.sleep(0.02)
+
+
+def _spawn():
+    os.makedirs(runtime_dir(), mode=0o700, exist_ok=True)
+
+    with open(os.path.join(runtime_dir(), "daemon.log"), "ab") as log:
+        subprocess.Popen(
+            [sys.executable, "-m", "lovelaice", "--daemon"],
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+
+
+def query(argv: list[str]) -> int | None:
+    """
+    Runs the command given by `argv` through the daemon, streaming its output.
+    Returns the exit code, or None if the command must run in-process.
+    """
+    for _ in range(2):
+        sock = connect()
+
+        if sock is None:
+            return None
+
+        with sock:
+            try:
+                _send(sock, type="query", version=VERSION, argv=argv, cwd=os.getcwd(), env=dict(os.environ), tty=sys.stdout.isatty())
+                code = _stream(sock)
+            except KeyboardInterrupt:
+                return 130
+            except OSError as e:
+                print(f"(!) Lost connection to the daemon: {e}", file=sys.stderr)
+                return 1
+
+        # A daemon from another version shuts itself down, so retry with a fresh one.
+        if code != "restart":
+            return code
+
+    return None
+
+
+def stop():
+    sock = connect(start=False)
+
+    if sock is None:
+        print("The daemon is not running.")
+        return
+
+    with sock:
+        _send(sock, type="stop")
+        _stream(sock)
+
+    print("The daemon was stopped.")
+
+
+def _send(sock: socket.socket, **message):
+    sock.sendall(json.dumps(message).encode() + b"\n")
+
+
+def _stream(sock: socket.socket) -> int | str | None:
+    with sock.makefile("rb") as reader:
+        for line in reader:
+            message = json.loads(line)
+            kind = message["type"]
+
+            if kind == "chunk":
+                try:
+                    sys.stdout.write(message["text"])
+                    sys.stdout.flush()
+                except BrokenPipeError:
+                    # The output was closed (e.g., piped into `head`): silence it and stop here.
+                    os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+                    return 0
+            elif kind == "ask":
+                try:
+                    answer = input(message["prompt"])
+                except EOFError:
+                    answer = ""
+
+                _send(sock, type="answer", text=answer)
+            elif kind == "exit":
+                return message["code"]
+            elif kind == "error":
+                print(f"(!) {message['message']}", file=sys.stderr)
+                return 1
+            elif kind == "local":
+                return None
+            elif kind == "restart":
+                return "restart"
+
+    raise ConnectionError("the daemon closed the connection")
@@ -7,14 +7,134 @@ class ModelConfig(BaseModel):
     base_url: str = Field(default="", description="The API base URL (in case you're not using OpenAI)")
     api_key: str = Field(default="", description="The API key to authenticate with the LLM provider")
     model: str = Field(default="", description="The concrete LLM model to use")
+    rpm: int = Field(default=0, description="Max requests per minute sent to this model (0 for no limit)")
+    tpm: int = Field(default=0, description="Max tokens per minute (prompt plus max tokens) sent to this model (0 for no limit)")
+    stream_usage: bool = Field(default=True, description="Ask for the token usage of streamed responses (disable it if the provider rejects `stream_options`)")
+
+
+class PoolConfig(BaseModel):
+    max_connections: int = Field(default=20, description="Max number of open connections per model client")
+    max_keepalive: int = Field(default=10, description="Max number of idle connections kept alive per model client")
+    keepalive_expiry: float = Field(default=60.0, description="Seconds an idle connection is kept alive before closing it")
+    http2: bool = Field(default=False, description="Negotiate HTTP/2 with the provider (requires `httpx[http2]`)")
+
+
+class RouterConfig(BaseModel):
+    mode: str = Field(default="hybrid", description="How to pick a tool: `local`, `llm`, or `hybrid` (local, falling back to the LLM)")
+    threshold: float = Field(default=0.25, description="Min similarity for the local router to trust its choice")
+    margin: float = Field(default=0.03, description="Min similarity gap between the best and second best tool for the local router")
+    speculative: bool = Field(default=False, description="Start streaming a Chat answer while routing is still in flight")
+
+
+class CacheConfig(BaseModel):
+    enabled: bool = Field(default=True, description="Cache LLM responses for identical deterministic requests (at temperature 0, e.g., routing and tool commands)")
+    sampled: bool = Field(default=False, description="Also cache answers sampled at a nonzero temperature, so the same question gets the same answer until it expires")
+    ttl: float = Field(default=86400.0, description="Seconds a cached response stays valid")
+    memory_entries: int = Field(default=256, description="Max number of responses kept in memory")
+    disk_mb: int = Field(default=64, description="Max size in MB of the on-disk cache (0 disables it)")
+    path: str = Field(default="", description="Path of the on-disk cache (defaults to the user cache dir)")
+
+
+class CoalesceConfig(BaseModel):
+    enabled: bool = Field(default=True, description="Share one upstream stream among identical concurrent requests")
+    batch_window: float = Field(default=0.0, description="Seconds to wait grouping completion prompts into one request (0 disables it, the provider must accept a list of prompts)")
+    batch_size: int = Field(default=16, description="Max number of prompts in a single batched completion request")
+
+
+class SchedulerConfig(BaseModel):
+    retries: int = Field(default=3, description="Max number of retries of a failed or stalled request before its first chunk")
+    backoff: float = Field(default=0.5, description="Base seconds of the jittered exponential backoff between retries")
+    max_backoff: float = Field(default=30.0, description="Max seconds to wait before a retry, including a provider's Retry-After")
+    first_token_timeout: float = Field(default=60.0, description="Seconds to wait for the first chunk of a response before retrying, except for uploads such as audio (0 for no limit)")
+    stall_timeout: float = Field(default=30.0, description="Max seconds between two chunks of a response before giving up (0 for no limit)")
+    hedge: bool = Field(default=False, description="Send a duplicate request when the first chunk takes longer than the p95 so far, keeping the fastest")
+    hedge_samples: int = Field(default=20, description="Min number of measured requests to a model before hedging")
+
+
+class HistoryConfig(BaseModel):
+    tokens: int = Field(default=2048, description="Max number of tokens of conversation kept verbatim in interactive mode, older turns are summarized")
+    summary_tokens: int = Field(default=256, description="Max number of tokens of the summary of older turns")
+    tool_tokens: int = Field(default=256, description="Max number of tokens of each tool output kept in the conversation")
+
+
+class RenderConfig(BaseModel):
+    fps: float = Field(default=20.0, description="Max number of times per second the output is updated while streaming")
+    markdown: bool = Field(default=True, description="Render responses as Markdown when writing to a terminal")
+
+
+class MemoryConfig(BaseModel):
+    enabled: bool = Field(default=False, description="Remember past queries and answers, and include the most similar ones in new prompts")
+    path: str = Field(default="", description="Directory of the memory index (defaults to the user cache dir)")
+    results: int = Field(default=3, description="Max number of past exchanges included in a prompt")
+    tokens: int = Field(default=256, description="Max number of tokens of past exchanges included in a prompt")
+    min_score: float = Field(default=0.4, description="Min similarity of a past exchange to be included")
+    dim: int = Field(default=256, description="Dimensions of the vectors in the index (changing it requires a new index)")
+
+
+class AudioConfig(BaseModel):
+    chunk_seconds: float = Field(default=30.0, description="Approximate length of the chunks a long recording is split into for transcription")
+    overlap: float = Field(default=2.0, description="Seconds shared by two chunks when there is no pause to split at")
+    silence: float = Field(default=0.1, description="Max loudness of a pause to split at, relative to the average loudness of the recording")
+    min_silence: float = Field(default=0.3, description="Min seconds of a pause to split at")
+    concurrency: int = Field(default=4, description="Max number of chunks transcribed at the same time")
+
+
+class SandboxConfig(BaseModel):
+    workers: int = Field(default=1, description="Number of worker processes that run generated Python code")
+    preload: str = Field(default="math,random,datetime", description="Comma-separated modules imported once by each worker")
+    cpu_seconds: float = Field(default=10.0, description="Max CPU seconds per run")
+    memory_mb: int = Field(default=1024, description="Max address space per worker in MB (0 for no limit)")
+    timeout: float = Field(default=30.0, description="Max wall-clock seconds per run")
+
+
+class SearchConfig(BaseModel):
+    results: int = Field(default=5, description="Number of search results to fetch")
+    deadline: float = Field(default=15.0, description="Max seconds to spend searching and fetching pages")
+    per_host: int = Field(default=2, description="Max concurrent requests to the same host")
+    delay: float = Field(default=1.0, description="Min seconds between requests to the same host")
+    timeout: float = Field(default=10.0, description="Timeout in seconds for each page request")
+    cache: bool = Field(default=True, description="Cache fetched pages and search results on disk")
+    cache_mb: int = Field(default=256, description="Max size in MB of the page cache")
+    page_ttl: float = Field(default=3600.0, description="Seconds a cached page is used without revalidating it")
+    search_ttl: float = Field(default=86400.0, description="Seconds a cached list of search results stays valid")
+
+
+class DaemonConfig(BaseModel):
+    idle_timeout: float = Field(default=900.0, description="Seconds without requests before the background daemon exits (0 to keep it running)")
+
+
+class ApiConfig(BaseModel):
+    concurrency: int = Field(default=8, description="Max number of API requests served at the same time")
+    queue: int = Field(default=32, description="Max number of API requests waiting for a slot before answering 429")
+    retry_after: int = Field(default=1, description="Seconds suggested to clients in the Retry-After header of a 429")
 
 
 class LovelaiceConfig(BaseModel):
     chat_model: ModelConfig = Field(default_factory=ModelConfig, description="Configuration for the default chat model.")
     audio_model: ModelConfig = Field(default_factory=ModelConfig, description="Configuration for the audio model.")
-    code_model: ModelConfig = Field(default_factory=ModelConfig, description="Configuration for the code model.")
+    code_model: ModelConfig = Field(default_factory=ModelConfig, description="Configuration for the code model (defaults to the chat model).")
+    fast_model: ModelConfig = Field(default_factory=ModelConfig, description="Configuration for a small, fast model used for routing and short tool outputs (defaults to the chat model).")
+    cascade: bool = Field(False, description="Ask the chat model again when a tool output from another model fails validation")
     max_tokens: int = Field(2048, description="Max number of tokens to generate in a single prompt")
     min_words: int = Field(0, description="For completion only, min number of words to generate")
+    complete_concurrency: int = Field(4, description="For file completion only, max number of `+++` markers completed at the same time")
+    batch_concurrency: int = Field(8, description="For --batch only, max number of queries run at the same time")
+    bash_timeout: float = Field(300, description="Seconds before a command run by the Bash tool is killed (0 for no limit)")
+    tool_output_tokens: int = Field(2048, description="Max number of tokens of tool output to include when concluding")
+    tool_output_sample: float = Field(0.0, description="Fraction of the tool output budget used to sample omitted lines (0 to 0.5)")
+    pool: PoolConfig = Field(default_factory=PoolConfig, description="Connection pool settings for the model clients.")
+    router: RouterConfig = Field(default_factory=RouterConfig, description="Tool routing settings.")
+    cache: CacheConfig = Field(default_factory=CacheConfig, description="Response cache settings.")
+    coalesce: CoalesceConfig = Field(default_factory=CoalesceConfig, description="Deduplication and batching of concurrent requests.")
+    scheduler: SchedulerConfig = Field(default_factory=SchedulerConfig, description="Rate limits, retries, timeouts and hedging of model requests.")
+    history: HistoryConfig = Field(default_factory=HistoryConfig, description="Conversation history in interactive mode.")
+    render: RenderConfig = Field(default_factory=RenderConfig, description="Output of streamed responses in the terminal.")
+    memory: MemoryConfig = Field(default_factory=MemoryConfig, description="Retrieval of past sessions.")
+    audio: AudioConfig = Field(default_factory=AudioConfig, description="Transcription of audio files.")
+    sandbox: SandboxConfig = Field(default_factory=SandboxConfig, description="Settings for the Interpreter sandbox.")
+    search: SearchConfig = Field(default_factory=SearchConfig, description="Settings for the GoogleSearch tool.")
+    daemon: DaemonConfig = Field(default_factory=DaemonConfig, description="Settings for the background daemon.")
+    api: ApiConfig = Field(default_factory=ApiConfig, description="Settings for the HTTP API server.")
 
     @classmethod
     def load(cls, root_path: pathlib.Path = pathlib.Path(".")):
@@ -1,15 +1,417 @@
 import abc
-from openai import AsyncOpenAI
-from openai.types.chat import ChatCompletionChunk
-from openai.types.completion import Completion
+import asyncio
+import collections
+import email.utils
+import pathlib
+import random
+import time
+from typing import TYPE_CHECKING
 
-from .config import LovelaiceConfig
-from .models import Message
+from .buffers import estimate_tokens
+from .cache import ResponseCache, cache_key
+from .config import LovelaiceConfig, ModelConfig, SchedulerConfig
+from .inflight import Batcher, SharedStream
+from .models import Coalescing, Message, Scheduling
+from . import trace
+
+if TYPE_CHECKING:
+    # openai takes a good part of a second to import, so it is loaded on the first request.
+    from openai import AsyncOpenAI
+    from openai.types.chat.chat_completion_chunk import Choice as ChunkChoice
+    from openai.types.completion_choice import CompletionChoice
+
+
+class UpstreamTimeout(TimeoutError):
+    """The model took too long to send the first chunk of a response, or the next one."""
+
+
+class TokenBucket:
+    """Lets through `rate` units per minute on average, in bursts of up to a minute's worth."""
+
+    def __init__(self, rate: int) -> None:
+        self.rate = rate / 60
+        self.capacity = float(rate)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, amount: float) -> bool:
+        self._refill()
+        amount = min(amount, self.capacity)
+
+        if self._lock.locked() or self.level < amount:
+            return False
+
+        self.level -= amount
+        return True
+
+    async def take(self, amount: float):
+        """Waits until `amount` units are available (in arrival order) and takes them."""
+        amount = min(amount, self.capacity)
+
+        async with self._lock:
+            self._refill()
+
+            while self.level < amount:
+                await asyncio.sleep((amount - self.level) / self.rate)
+                self._refill()
+
+            self.level -= amount
+
+
+class Latency:
+    """Percentiles over the last `size` measurements, in seconds."""
+
+    def __init__(self, size: int = 512) -> None:
+        self.samples = collections.deque(maxlen=size)
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def percentile(self, p: float) -> float:
+        if not self.samples:
+            return 0.0
+
+        ordered = sorted(self.samples)
+        return ordered[min(int(p * len(ordered)), len(ordered) - 1)]
+
+    def summary(self) -> dict:
+        return dict(count=len(self), p50=self.percentile(0.5), p95=self.percentile(0.95), p99=self.percentile(0.99))
+
+
+_END = object()
+
+
+class _Attempt:
+    """One upstream request, read by a background task into a queue."""
+
+    def __init__(self, source) -> None:
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._pump(source))
+
+    async def _pump(self, source):
+        try:
+            async for chunk in source:
+                self.queue.put_nowait(chunk)
+
+            self.queue.put_nowait(_END)
+        except Exception as e:
+            self.queue.put_nowait(e)
+
+    async def next(self):
+        item = await self.queue.get()
+
+        if isinstance(item, Exception):
+            raise item
+
+        return item
+
+
+class Scheduler:
+    """
+    Sends the requests to one model within its requests and tokens per minute,
+    retrying failures (and responses that take too long to start) with jittered
+    exponential backoff, honoring the provider's Retry-After. The time to the
+    first chunk and the total time of each response are measured, and with
+    `hedge` a duplicate request is sent when the first chunk takes longer than
+    the p95 so far, keeping whichever answers first.
+
+    Retries only happen before the first chunk, since what was streamed
+    cannot be taken back: a stream that stalls afterwards is an error.
+
+    The response to an `upload` (e.g., an audio file) can only start once it
+    is sent, which takes as long as it is large: it has no first chunk deadline,
+    is not hedged, and is not sent again after a timeout.
+    """
+
+    def __init__(self, model: ModelConfig, config: SchedulerConfig) -> None:
+        self.config = config
+        self.requests = TokenBucket(model.rpm) if model.rpm else None
+        self.tokens = TokenBucket(model.tpm) if model.tpm else None
+        self.ttft = Latency()
+        self.total = Latency()
+        self.stats = Scheduling()
+
+    async def _admit(self, cost: int):
+        start = time.monotonic()
+
+        if self.requests is not None:
+            await self.requests.take(1)
+
+        if self.tokens is not None:
+            await self.tokens.take(cost)
+
+        self.stats.throttled += time.monotonic() - start
+
+    def _try_admit(self, cost: int) -> bool:
+        if self.requests is not None and not self.requests.try_take(1):
+            return False
+
+        return self.tokens is None or self.tokens.try_take(cost)
+
+    async def stream(self, open, cost: int, upload: bool = False):
+        """
+        Streams the chunks of `open()`, an async iterator that sends the request
+        when iterated, with `cost` the estimated number of tokens it uses.
+        """
+        attempt = 0
+
+        while True:
+            await self._admit(cost)
+            start = time.monotonic()
+
+            try:
+                winner, chunk = await self._first(open, cost, upload)
+                break
+            except Exception as e:
+                delay = None if upload and _timeout(e) else self._retry_delay(e, attempt)
+
+                if delay is None:
+                    raise
+
+                self.stats.retries += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+
+        self.ttft.add(time.monotonic() - start)
+
+        try:
+            while chunk is not _END:
+                yield chunk
+
+                try:
+                    chunk = await asyncio.wait_for(winner.next(), self.config.stall_timeout or None)
+                except asyncio.TimeoutError:
+                    self.stats.stalls += 1
+                    raise UpstreamTimeout(f"No response from the model in {self.config.stall_timeout} seconds.") from None
+
+            self.total.add(time.monotonic() - start)
+        finally:
+            winner.task.cancel()
+
+    async def _first(self, open, cost: int, upload: bool = False):
+        """Starts the request (and its hedge, if due) and returns the attempt that sent a chunk first, with that chunk."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.config.first_token_timeout if self.config.first_token_timeout and not upload else None
+        hedge = self.config.hedge and not upload and len(self.ttft) >= self.config.hedge_samples
+        hedge_at = loop.time() + self.ttft.percentile(0.95) if hedge else None
+
+        attempts = [_Attempt(open())]
+        pending = {asyncio.ensure_future(attempts[0].next()): attempts[0]}
+        winner = None
+
+        try:
+            while pending:
+                wake = min((t for t in (deadline, hedge_at) if t is not None), default=None)
+                done, _ = await asyncio.wait(pending, timeout=wake and max(wake - loop.time(), 0), return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    if hedge_at is not None and loop.time() >= hedge_at:
+                        hedge_at = None
+
+                        if self._try_admit(cost):
+                            self.stats.hedges += 1
+                            attempts.append(_Attempt(open()))
+                            pending[asyncio.ensure_future(attempts[-1].next())] = attempts[-1]
+
+                        continue
+
+                    self.stats.stalls += 1
+                    raise UpstreamTimeout(f"No response from the model in {self.config.first_token_timeout} seconds.")
+
+                for future in done:
+                    attempt = pending.pop(future)
+
+                    # A failed attempt only counts if there is no other one to wait for.
+                    if future.exception() is not None and pending:
+                        continue
+
+                    winner = attempt
+
+                    if attempt is not attempts[0]:
+                        self.stats.hedge_wins += 1
+
+                    return attempt, future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+            for attempt in attempts:
+                if attempt is not winner:
+                    attempt.task.cancel()
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float | None:
+        """Seconds to wait before retrying after `error`, or None if it must not be retried."""
+        if attempt >= self.config.retries or not _retryable(error):
+            return None
+
+        delay = _retry_after(error)
+
+        if delay is None:
+            # "Full jitter": spreads the retries of concurrent requests that failed together.
+            delay = random.uniform(0, self.config.backoff * 2 ** attempt)
+
+        return min(delay, self.config.max_backoff)
+
+    def summary(self) -> dict:
+        return dict(self.stats.model_dump(), ttft=self.ttft.summary(), total=self.total.summary())
+
+
+def _retryable(error: Exception) -> bool:
+    if isinstance(error, UpstreamTimeout):
+        return True
+
+    status = getattr(error, "status_code", None)
+
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+
+    import httpx
+    import openai
+
+    return isinstance(error, (openai.APIConnectionError, httpx.TransportError))
+
+
+def _timeout(error: Exception) -> bool:
+    import httpx
+    import openai
+
+    return isinstance(error, (UpstreamTimeout, openai.APITimeoutError, httpx.TimeoutException))
+
+
+def _retry_after(error: Exception) -> float | None:
+    response = getattr(error, "response", None)
+
+    if response is None:
+        return None
+
+    headers = response.headers
+
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+
+        if "retry-after" in headers:
+            value = headers["retry-after"]
+
+            try:
+                return float(value)
+            except ValueError:
+                return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        pass
+
+    return None
+
+
+def _prompts(request: dict) -> list[str]:
+    if "messages" in request:
+        return ["".join(m["content"] for m in request["messages"])]
+
+    prompt = request["prompt"]
+    return prompt if isinstance(prompt, list) else [prompt]
+
+
+def _cost(request: dict) -> int:
+    """Estimated number of tokens used by `request`: its prompt and the max tokens it may generate."""
+    return sum(estimate_tokens(p) + (request.get("max_tokens") or 0) for p in _prompts(request)) * request.get("n", 1)
 
 
 class LLM(abc.ABC):
     def __init__(self, config: LovelaiceConfig) -> None:
         self.config = config
+        self._clients: dict[str, "AsyncOpenAI"] = {}
+        self._inflight: dict[str, SharedStream] = {}
+        self._batchers: dict[str, Batcher] = {}
+        self._schedulers: dict[str, Scheduler] = {}
+        self.coalescing = Coalescing()
+        self.cache: ResponseCache | None = None
+
+        if config.cache.enabled:
+            self.cache = ResponseCache(
+                path=pathlib.Path(config.cache.path) if config.cache.path else None,
+                ttl=config.cache.ttl,
+                memory_entries=config.cache.memory_entries,
+                disk_bytes=config.cache.disk_mb * 2**20,
+            )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    def client(self, name: str) -> "AsyncOpenAI":
+        """
+        Returns the long-lived client for the `<name>_model` configuration,
+        creating it (and its connection pool) on first use.
+        """
+        client = self._clients.get(name)
+
+        if client is None:
+            import httpx
+            from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+            model: ModelConfig = getattr(self.config, f"{name}_model")
+            pool = self.config.pool
+
+            http_client = DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=pool.max_connections,
+                    max_keepalive_connections=pool.max_keepalive,
+                    keepalive_expiry=pool.keepalive_expiry,
+                ),
+                http2=pool.http2,
+            )
+
+            client = AsyncOpenAI(
+                api_key=model.api_key,
+                base_url=model.base_url or None,
+                http_client=http_client,
+                # Retries are up to the scheduler, which knows about rate limits and stalls.
+                max_retries=0,
+            )
+            self._clients[name] = client
+
+        return client
+
+    def resolve(self, name: str) -> str:
+        """The model configuration used for `name`: those without a model fall back to the chat model."""
+        model: ModelConfig = getattr(self.config, f"{name}_model")
+        return name if model.model else "chat"
+
+    def scheduler(self, name: str) -> Scheduler:
+        scheduler = self._schedulers.get(name)
+
+        if scheduler is None:
+            model: ModelConfig = getattr(self.config, f"{name}_model")
+            scheduler = self._schedulers[name] = Scheduler(model, self.config.scheduler)
+
+        return scheduler
+
+    def latency(self) -> dict[str, dict]:
+        """Scheduling stats and latency percentiles of each model used so far."""
+        return {name: scheduler.summary() for name, scheduler in self._schedulers.items()}
+
+    async def close(self):
+        for shared in list(self._inflight.values()):
+            shared.task.cancel()
+
+        clients, self._clients = self._clients, {}
+
+        for client in clients.values():
+            await client.close()
+
+        if self.cache is not None:
+            self.cache.close()
 
     async def chat(self, messages: list[Message], **kwargs):
         result = []
@@ -27,36 +429,182 @@ class LLM(abc.ABC):
 
         return "".join(result)
 
-    async def chat_stream(self, messages: list[Message], **kwargs):
-        client = AsyncOpenAI(api_key=self.config.chat_model.api_key, base_url=self.config.chat_model.base_url)
-        model = self.config.chat_model.model
+    async def chat_stream(self, messages: list[Message], cache: bool = True, name: str = "chat", **kwargs):
+        """Streams the answer of the `<name>_model` (e.g., "fast" or "code") to `messages`."""
+        request = dict(messages=[dict(role=m.role, content=m.content) for m in messages], **kwargs)
+
+        async for chunk in self._stream("chat", self.resolve(name), request, cache):
+            yield chunk
+
+    async def complete_stream(self, prompt: str, cache: bool = True, name: str = "chat", **kwargs):
+        request = dict(prompt=prompt, **kwargs)
+
+        async for chunk in self._stream("text", self.resolve(name), request, cache):
+            yield chunk
+
+    async def _stream(self, kind: str, name: str, request: dict, cache: bool):
+        """
+        Streams a `kind` ("chat" or "text") request to the `<name>_model`,
+        replaying it from the response cache when possible, and sharing
+        a single upstream stream among identical concurrent requests.
+        """
+        model: ModelConfig = getattr(self.config, f"{name}_model")
+        prompt_tokens = sum(estimate_tokens(p) for p in _prompts(request))
+
+        with trace.span(f"llm.{name}", model=model.model, prompt_tokens=prompt_tokens, usage="estimate") as span:
+            start = time.perf_counter()
+            chunks = []
+
+            async for chunk in self._chunks(kind, name, model, request, cache):
+                if not chunks:
+                    span.set(ttft=time.perf_counter() - start)
+
+                chunks.append(chunk)
+                yield chunk
+
+            if span.attributes.get("usage") == "estimate":
+                span.set(completion_tokens=estimate_tokens("".join(chunks)))
+
+    async def _chunks(self, kind: str, name: str, model: ModelConfig, request: dict, cache: bool):
+        key = cache_key(kind, model.base_url, model.model, request)
+        # A sampled answer is only one of many, not to be repeated unless asked for.
+        cache = cache and (request.get("temperature") == 0 or self.config.cache.sampled)
+
+        if cache and self.cache is not None:
+            chunks = self.cache.get(key)
+
+            if chunks is not None:
+                trace.current().set(cached=True)
+
+                for chunk in chunks:
+                    yield chunk
+
+                return
+
+        self.coalescing.requests += 1
+        store = key if cache else None
+
+        if not self.config.coalesce.enabled:
+            async for chunk in self._fetch(kind, name, request, store):
+                yield chunk
+
+            return
+
+        shared = self._inflight.get(key)
 
-        stream = await client.chat.completions.create(
-            messages=[dict(role=m.role, content=m.content) for m in messages],
-            model=model,
-            stream=True,
-            **kwargs,
-        )
+        if shared is None:
+            shared = self._inflight[key] = SharedStream(self._fetch(kind, name, request, store))
+            shared.task.add_done_callback(lambda _: self._forget(key, shared))
+        else:
+            self.coalescing.shared += 1
+            trace.current().set(shared=True)
 
-        async for response in stream:
-            r: ChatCompletionChunk = response
-            yield r.choices[0].delta.content or ""
+        async for chunk in shared.subscribe():
+            yield chunk
 
-    async def complete_stream(self, prompt: str, **kwargs):
-        client = AsyncOpenAI(api_key=self.config.chat_model.api_key, base_url=self.config.chat_model.base_url)
-        model = self.config.chat_model.model
+    def _forget(self, key: str, shared: SharedStream):
+        if self._inflight.get(key) is shared:
+            del self._inflight[key]
 
-        stream = await client.completions.create(
-            model=model, prompt=prompt, stream=True, **kwargs
-        )
+    async def _fetch(self, kind: str, name: str, request: dict, key: str | None):
+        """Streams the request from upstream, storing the response under `key` once complete."""
+        if kind == "text" and self.config.coalesce.batch_window and request.get("n", 1) == 1:
+            source = self._batch(name, request)
+        else:
+            self.coalescing.upstream += 1
+            source = self._upstream(kind, name, request)
 
-        async for chunk in stream:
-            r: Completion = chunk
-            yield r.choices[0].text or ""
+        chunks = []
 
-    async def transcribe(self, file, **kwargs):
-        client = AsyncOpenAI(api_key=self.config.audio_model.api_key, base_url=self.config.audio_model.base_url)
+        async for chunk in source:
+            chunks.append(chunk)
+            yield chunk
+
+        if key is not None and self.cache is not None:
+            self.cache.put(key, chunks)
+
+    async def _upstream(self, kind: str, name: str, request: dict):
+        """Streams the text of the first choice of `request` through the model's scheduler."""
+        async for index, text in self._scheduled(kind, name, request):
+            if index == 0:
+                yield text
+
+    async def _scheduled(self, kind: str, name: str, request: dict):
+        scheduler = self.scheduler(name)
+        # Creating the client first keeps the (one-off) import of openai out of the measured latency.
+        self.client(name)
+
+        async for pair in scheduler.stream(lambda: self._open(kind, name, request), _cost(request)):
+            yield pair
+
+    async def _open(self, kind: str, name: str, request: dict):
+        """Sends `request` upstream, streaming `(index, text)` pairs for each choice."""
+        client = self.client(name)
+        model: ModelConfig = getattr(self.config, f"{name}_model")
+        options = dict(stream_options=dict(include_usage=True)) if model.stream_usage else {}
+
+        if kind == "chat":
+            stream = await client.chat.completions.create(model=model.model, stream=True, **options, **request)
+        else:
+            stream = await client.completions.create(model=model.model, stream=True, **options, **request)
+
+        # Closing the stream as soon as we stop reading (e.g., cancelled) frees the connection upstream.
+        async with stream:
+            async for response in stream:
+                # The usage of a batch of prompts cannot be told apart, so it is left to the estimates.
+                if response.usage is not None and not isinstance(request.get("prompt"), list):
+                    trace.current().set(
+                        prompt_tokens=response.usage.prompt_tokens,
+                        completion_tokens=response.usage.completion_tokens,
+                        usage="provider",
+                    )
+
+                for choice in response.choices:
+                    if kind == "chat":
+                        c: ChunkChoice = choice
+                        yield c.index, c.delta.content or ""
+                    else:
+                        c: CompletionChoice = choice
+                        yield c.index, c.text or ""
+
+    async def _batch(self, name: str, request: dict):
+        batcher = self._batchers.get(name)
+
+        if batcher is None:
+            async def send(prompts: list[str], params: dict):
+                self.coalescing.upstream += 1
+                self.coalescing.batches += 1
+
+                if len(prompts) > 1:
+                    self.coalescing.batched += len(prompts)
+
+                prompt = prompts if len(prompts) > 1 else prompts[0]
+
+                async for pair in self._scheduled("text", name, dict(params, prompt=prompt)):
+                    yield pair
+
+            batcher = self._batchers[name] = Batcher(
+                send, self.config.coalesce.batch_window, self.config.coalesce.batch_size
+            )
+
+        params = {k: v for k, v in request.items() if k != "prompt"}
+
+        async for chunk in batcher.stream(cache_key(params), request["prompt"], params):
+            yield chunk
+
+    async def transcribe(self, file, **kwargs) -> str:
+        """
+        The text of the audio `file`, as accepted by the openai client. Prefer
+        a `(name, bytes)` tuple: a file object cannot be sent again on a retry.
+        It is sent as an upload, without a deadline for the response to start.
+        """
+        scheduler = self.scheduler("audio")
+        client = self.client("audio")
         model = self.config.audio_model.model
 
-        response = await client.audio.transcriptions.create(file=file, model=model, **kwargs)
-        return response
+        async def request():
+            response = await client.audio.transcriptions.create(file=file, model=model, **kwargs)
+            yield response.text
+
+        with trace.span("llm.audio"):
+            return "".join([text async for text in scheduler.stream(request, 0, upload=True)])
@@ -1,6 +1,18 @@
+import abc
+import asyncio
+import time
+
+import numpy as np
+
+from .buffers import BoundedOutput
+from .config import RouterConfig
 from .connectors import LLM
-from .models import Message
+from .embeddings import HashingVectorizer
+from .history import History, summary_prompt
+from .memory import Memory
+from .models import Cascade, Message, Route, Speculation, Verbatim
 from .tools import Chat, Tool
+from . import trace
 
 
 SYSTEM_PROMPT = """
@@ -26,67 +38,338 @@ Tool:
 """
 
 
-class Agent:
+class Router(abc.ABC):
+    @abc.abstractmethod
+    async def route(self, prompt: str, **kwargs) -> Route:
+        pass
+
+
+class LLMRouter(Router):
+    """Asks the LLM to pick the tool, one extra round-trip per query."""
+
     def __init__(self, client: LLM, tools: list[Tool]) -> None:
+        self.client = client
+        self.tools_line = "\n".join(t.describe() for t in tools)
+
+    async def route(self, prompt: str, **kwargs) -> Route:
+        start = time.perf_counter()
+
+        messages = [
+            Message(role="system", content=SYSTEM_PROMPT),
+            Message(
+                role="user",
+                content=TOOLS_PROMPT.format(query=prompt, tools=self.tools_line),
+            ),
+        ]
+
+        kwargs.setdefault("temperature", 0)
+        tool_name = await self.client.chat(messages, name="fast", **kwargs)
+        tool_name = (tool_name.split() or ["Chat"])[0].strip(",.:")
+
+        return Route(tool=tool_name, source="llm", elapsed=time.perf_counter() - start)
+
+
+class LocalRouter(Router):
+    """
+    Scores the query against each tool's docstring and examples with
+    hashed n-gram TF-IDF vectors, and picks the most similar tool.
+
+    When the best match is below `threshold`, or too close to the
+    runner-up, the decision is delegated to `fallback` (if any).
+    """
+
+    def __init__(
+        self,
+        tools: list[Tool],
+        threshold: float = 0.25,
+        margin: float = 0.03,
+        fallback: Router | None = None,
+    ) -> None:
+        self.threshold = threshold
+        self.margin = margin
+        self.fallback = fallback
+        self.vectorizer = HashingVectorizer()
+
+        documents = []
+        owners = []
+
+        for index, tool in enumerate(tools):
+            for text in [tool.description or tool.name, *tool.examples]:
+                documents.append(text)
+                owners.append(index)
+
+        self.names = [t.name for t in tools]
+        self.owners = np.array(owners)
+        self.idf = self.vectorizer.idf(documents)
+        self.matrix = self.vectorizer.transform(documents, self.idf)
+
+    def scores(self, prompt: str) -> np.ndarray:
+        """Best cosine similarity of the prompt against each tool."""
+        query = self.vectorizer.transform([prompt], self.idf)[0]
+        similarities = self.matrix @ query
+        scores = np.zeros(len(self.names), dtype=np.float32)
+        np.maximum.at(scores, self.owners, similarities)
+        return scores
+
+    async def route(self, prompt: str, **kwargs) -> Route:
+        start = time.perf_counter()
+        scores = self.scores(prompt)
+        ranking = np.argsort(scores)[::-1]
+        best = float(scores[ranking[0]])
+        second = float(scores[ranking[1]]) if len(ranking) > 1 else 0.0
+
+        if self.fallback is not None and (best < self.threshold or best - second < self.margin):
+            route = await self.fallback.route(prompt, **kwargs)
+            route.confidence = best
+            route.elapsed = time.perf_counter() - start
+            return route
+
+        return Route(
+            tool=self.names[ranking[0]],
+            source="local",
+            confidence=best,
+            elapsed=time.perf_counter() - start,
+        )
+
+
+def build_router(config: RouterConfig, client: LLM, tools: list[Tool]) -> Router:
+    if config.mode == "llm":
+        return LLMRouter(client, tools)
+
+    if config.mode == "local":
+        return LocalRouter(tools, config.threshold, config.margin)
+
+    if config.mode == "hybrid":
+        return LocalRouter(tools, config.threshold, config.margin, fallback=LLMRouter(client, tools))
+
+    raise ValueError(f"Unknown router mode: {config.mode!r}")
+
+
+class Agent:
+    def __init__(
+        self,
+        client: LLM,
+        tools: list[Tool],
+        router: Router | None = None,
+        speculative: bool | None = None,
+        memory: Memory | None = None,
+    ) -> None:
         self.client = client
         self.tools = tools
         self.tools_dir = {t.name: t for t in tools}
-        self.tools_line = "\n".join(t.describe() for t in tools)
-        self.history = []
+        self.router = router or build_router(client.config.router, client, tools)
+        self.speculative = client.config.router.speculative if speculative is None else speculative
+        self.speculation = Speculation()
+        self.cascade = Cascade()
+        self.last_route: Route | None = None
+        config = client.config.history
+        self.history = History(self._summarize, config.tokens, config.summary_tokens)
+        self.memory = memory
+
+    def warmup(self):
+        for tool in self.tools:
+            tool.warmup()
+
+    async def close(self):
+        await self.history.close()
+
+        for tool in self.tools:
+            await tool.close()
+
+    def _tool(self, name: str) -> Tool:
+        if name not in self.tools_dir:
+            return Chat()
+
+        return self.tools_dir[name]
 
     async def query(
         self,
         prompt: str,
         use_tool=None,
+        history: History | None = None,
         **kwargs,
     ):
-        if use_tool is None:
-            messages = [
-                Message(role="system", content=SYSTEM_PROMPT),
-                Message(
-                    role="user",
-                    content=TOOLS_PROMPT.format(query=prompt, tools=self.tools_line),
-                ),
-            ]
-
-            tool_name = await self.client.chat(messages, **kwargs)
-            tool_name = tool_name.split()[0].strip(",.:")
-
-            async for response in self.query(prompt, use_tool=tool_name, **kwargs):
+        """
+        Answers `prompt` with `use_tool`, or the tool picked by the router.
+        With a `history`, the conversation so far is included in the prompts
+        and the query and its answer are added to it.
+        """
+        if use_tool is None and self.speculative and "Chat" in self.tools_dir:
+            async for response in self._speculate(prompt, history, **kwargs):
+                yield response
+
+        elif use_tool is None:
+            route = await self._route(prompt, **kwargs)
+
+            async for response in self.query(prompt, use_tool=route.tool, history=history, **kwargs):
                 yield response
 
         else:
-            if use_tool not in self.tools_dir:
-                tool: Tool = Chat()
-            else:
-                tool: Tool = self.tools_dir[use_tool]
+            tool = self._tool(use_tool)
+            context = await self._context(prompt, history)
+            answer = []
 
             if tool.name != "Chat":
                 yield f":: Using {tool.name}\n\n"
 
-            messages = [Message(role="user", content=tool.prompt(prompt))]
+            with trace.span("prompt", tool=tool.name):
+                messages = context + [Message(role="user", content=tool.prompt(prompt))]
 
             if tool.skip_use:
-                async for response in self.client.chat_stream(messages, **kwargs):
-                    yield response
+                with trace.span("answer", tool=tool.name):
+                    async for response in self.client.chat_stream(messages, cache=tool.cacheable, name=tool.model, **kwargs):
+                        answer.append(response)
+                        yield response
 
             else:
-                response = await self.client.chat(messages, **kwargs)
-                output = []
-
-                for line in tool.use(prompt, response):
-                    output.append(line)
-                    yield line
-                
-                output = "\n".join(output)
+                with trace.span("generate", tool=tool.name):
+                    response = await self._tool_response(tool, messages, **kwargs)
+
+                config = self.client.config
+                output = BoundedOutput(config.tool_output_tokens, config.tool_output_sample)
+                # What is remembered of the tool output is much shorter than what is used to conclude.
+                remembered = BoundedOutput(config.history.tool_tokens)
+
+                with trace.span("use", tool=tool.name):
+                    async for line in tool.use(prompt, response):
+                        output.write(line)
+                        remembered.write(line)
+                        yield Verbatim(line)
+
+                output = output.text()
                 conclusion = tool.conclude(prompt, output)
+                answer.append(f"{tool.name} output:\n{remembered.text()}\n")
+
+                if conclusion is not None:
+                    messages = context + [Message(role="user", content=conclusion)]
+
+                    yield "\n"
+
+                    with trace.span("conclude", tool=tool.name):
+                        async for response in self.client.chat_stream(messages, cache=tool.cacheable, name=tool.conclusion_model, **kwargs):
+                            answer.append(response)
+                            yield response
+
+            self._remember(history, prompt, "".join(answer), tool.name)
+
+    async def _context(self, prompt: str, history: History | None) -> list[Message]:
+        """The messages that go before the prompt: related past exchanges, and the conversation so far."""
+        context = []
+
+        if self.memory is not None:
+            config = self.client.config.memory
+
+            with trace.span("recall"):
+                recalled = await asyncio.to_thread(self.memory.recall, prompt, config.results, config.tokens, config.min_score)
+
+            if recalled:
+                context.append(Message(role="system", content=f"Related exchanges from past sessions:\n\n{recalled}"))
+
+        if history is not None:
+            context.extend(history.messages())
+
+        return context
+
+    def _remember(self, history: History | None, prompt: str, answer: str, tool: str):
+        if history is not None:
+            history.append("user", prompt)
+            history.append("assistant", answer)
+            history.compact()
+
+        if self.memory is not None and answer.strip():
+            self.memory.add(prompt, answer, tool=tool)
 
-                if conclusion is None:
-                    return
+    async def _summarize(self, summary: str, messages: list[Message], tokens: int) -> str:
+        prompt = summary_prompt(summary, messages, tokens)
+        response = await self.client.chat([Message(role="user", content=prompt)], cache=False, name="fast", max_tokens=tokens)
+        return response.strip()
 
-                messages = [Message(role="user", content=conclusion)]
+    async def _route(self, prompt: str, **kwargs) -> Route:
+        with trace.span("route") as span:
+            route = await self.router.route(prompt, **kwargs)
+            span.set(tool=route.tool, source=route.source, confidence=route.confidence)
 
-                yield "\n"
+        self.last_route = route
+        return route
 
-                async for response in self.client.chat_stream(messages, **kwargs):
+    async def _tool_response(self, tool: Tool, messages: list[Message], **kwargs) -> str:
+        """
+        Asks the tool's model for its response, escalating to the chat model
+        when cascading is enabled and the response fails the tool's validation.
+        The response is deterministic, so that it can be cached.
+        """
+        kwargs.setdefault("temperature", 0)
+        response = await self.client.chat(messages, cache=tool.cacheable, name=tool.model, **kwargs)
+
+        if not self.client.config.cascade or self.client.resolve(tool.model) == "chat":
+            return response
+
+        self.cascade.checked += 1
+
+        if tool.validate(response):
+            return response
+
+        self.cascade.escalated += 1
+        return await self.client.chat(messages, cache=tool.cacheable, name="chat", **kwargs)
+
+    async def _speculate(self, prompt: str, history: History | None = None, **kwargs):
+        """
+        Streams the Chat answer concurrently with routing. The speculative
+        tokens are replayed if the router picks Chat, and dropped otherwise.
+        """
+        chat = self.tools_dir["Chat"]
+        messages = await self._context(prompt, history) + [Message(role="user", content=chat.prompt(prompt))]
+        chunks = asyncio.Queue()
+        started = False
+        start = time.perf_counter()
+        first_token = None
+
+        async def produce():
+            nonlocal started, first_token
+            started = True
+
+            try:
+                with trace.span("answer", tool=chat.name, speculative=True):
+                    async for chunk in self.client.chat_stream(messages, name=chat.model, **kwargs):
+                        if first_token is None:
+                            first_token = time.perf_counter() - start
+
+                        chunks.put_nowait(chunk)
+            except Exception as e:
+                chunks.put_nowait(e)
+            finally:
+                chunks.put_nowait(None)
+
+        task = asyncio.create_task(produce())
+        self.speculation.attempts += 1
+
+        try:
+            route = await self._route(prompt, **kwargs)
+
+            if self._tool(route.tool).name != "Chat":
+                task.cancel()
+
+                if started:
+                    self.speculation.wasted += 1
+
+                async for response in self.query(prompt, use_tool=route.tool, history=history, **kwargs):
                     yield response
+
+                return
+
+            self.speculation.hits += 1
+            answer = []
+
+            while (chunk := await chunks.get()) is not None:
+                if isinstance(chunk, Exception):
+                    raise chunk
+
+                answer.append(chunk)
+                yield chunk
+
+            if first_token is not None:
+                self.speculation.ttft_saved += min(route.elapsed, first_token)
+
+            self._remember(history, prompt, "".join(answer), chat.name)
+        finally:
+            task.cancel()
@@ -0,0 +1,262 @@
+import asyncio
+import json
+import os
+import pathlib
+import signal
+import socket
+
+from . import VERSION
+from .cli import answer, build_agent, build_parser, completion, environment, route_info, traced
+from .client import socket_path
+from .config import LovelaiceConfig
+from .connectors import LLM
+from .core import Agent
+from .google import ProcessPool
+from .render import Renderer
+from .tools import environ, prompter, workdir
+
+
+class Daemon:
+    """
+    Serves CLI queries over a Unix socket (see `lovelaice.client` for the protocol),
+    keeping one warm `Agent` (with its model clients, caches and sandbox) per
+    distinct configuration. Exits after `idle_timeout` seconds without requests.
+    """
+
+    def __init__(self, path: str | None = None, idle_timeout: float = 900) -> None:
+        self.path = path or socket_path()
+        self.idle_timeout = idle_timeout
+        self._agents: dict[str, Agent] = {}
+        # Shared by the agents of every configuration.
+        self.executor = ProcessPool()
+        self._active = 0
+        self._last = 0.0
+        self._inode = None
+        self._stopped = asyncio.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+
+        if not hasattr(socket, "AF_UNIX"):
+            print("The daemon needs Unix sockets, which are not available on this platform.")
+            return
+
+        if _listening(self.path):
+            print(f"A daemon is already listening on {self.path}.")
+            return
+
+        pathlib.Path(self.path).unlink(missing_ok=True)
+        os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+        umask = os.umask(0o077)
+
+        try:
+            server = await asyncio.start_unix_server(self._handle, self.path, limit=2**20)
+        finally:
+            os.umask(umask)
+
+        self._inode = os.stat(self.path).st_ino
+
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.stop)
+
+        self._last = loop.time()
+        watchdog = asyncio.create_task(self._watchdog())
+        print(f"Lovelaice {VERSION} daemon listening on {self.path} (pid {os.getpid()}).", flush=True)
+
+        try:
+            await self._stopped.wait()
+        finally:
+            watchdog.cancel()
+            server.close()
+            self._unlink()
+
+            for agent in self._agents.values():
+                await agent.close()
+                await agent.client.close()
+
+            self._agents.clear()
+            self.executor.shutdown(cancel_futures=True)
+
+    def _unlink(self):
+        # Only remove our own socket, not one bound by a newer daemon in the meantime.
+        try:
+            if os.stat(self.path).st_ino == self._inode:
+                os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def agent(self, config: LovelaiceConfig) -> Agent:
+        key = config.model_dump_json()
+        agent = self._agents.get(key)
+
+        if agent is None:
+            agent = build_agent(config, LLM(config), self.executor)
+            agent.warmup()
+            self._agents[key] = agent
+
+        return agent
+
+    async def _watchdog(self):
+        loop = asyncio.get_running_loop()
+
+        while self.idle_timeout:
+            await asyncio.sleep(min(self.idle_timeout, 30))
+
+            if not self._active and loop.time() - self._last > self.idle_timeout:
+                print("Idle timeout reached, exiting.", flush=True)
+                self.stop()
+                return
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._active += 1
+
+        def post(**message):
+            writer.write(json.dumps(message).encode() + b"\n")
+
+        async def send(**message):
+            post(**message)
+            await writer.drain()
+
+        drain = writer.drain
+
+        try:
+            request = json.loads(await reader.readline() or "{}")
+
+            if request.get("type") == "stop":
+                self.stop()
+                await send(type="exit", code=0)
+            elif request.get("type") != "query":
+                await send(type="error", message="Unknown request.")
+            elif request.get("version") != VERSION:
+                # The client was upgraded: make room for a daemon of the same version.
+                self._unlink()
+                self.stop()
+                await send(type="restart")
+            else:
+                await self._serve_query(request, reader, send, post, drain)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            self._active -= 1
+            self._last = asyncio.get_running_loop().time()
+            writer.close()
+
+    async def _serve_query(self, request: dict, reader: asyncio.StreamReader, send, post, drain):
+        answers = asyncio.Queue()
+
+        async def ask(prompt):
+            await send(type="ask", prompt=prompt)
+            return await answers.get()
+
+        task = asyncio.create_task(self._query(request, send, post, drain, ask))
+
+        async def listen():
+            while line := await reader.readline():
+                message = json.loads(line)
+
+                if message.get("type") == "answer":
+                    answers.put_nowait(message.get("text", ""))
+
+            # The client went away (e.g., Ctrl+C), so stop working for it.
+            task.cancel()
+
+        listener = asyncio.create_task(listen())
+
+        try:
+            await task
+        except asyncio.CancelledError:
+            if not listener.done():
+                raise
+        except Exception as e:
+            await send(type="error", message=f"{type(e).__name__}: {e}")
+        finally:
+            listener.cancel()
+
+    async def _query(self, request: dict, send, post, drain, ask):
+        cwd = request["cwd"]
+
+        try:
+            args = build_parser().parse_args(request["argv"])
+        except SystemExit:
+            await send(type="local")
+            return
+
+        if not args.query:
+            await send(type="local")
+            return
+
+        config = LovelaiceConfig.load(pathlib.Path(cwd))
+
+        if args.no_cache:
+            config.cache.enabled = False
+
+        if request.get("tty") and config.render.markdown and not args.complete:
+            # Only the CLI renders Markdown, so the client runs the query itself.
+            await send(type="local")
+            return
+
+        agent = self.agent(config)
+        # Sent in frames, as the CLI prints it to a pipe.
+        out = Renderer(config.render.fps, _Chunks(post))
+
+        async def confirm(prompt):
+            out.close()
+            return await ask(prompt)
+
+        prompter.set(confirm)
+        workdir.set(cwd)
+        # Commands run with the client's environment, not that of the shell that started the daemon.
+        environ.set(environment(cwd, request.get("env") or dict(os.environ)))
+
+        if args.complete:
+            chunks = completion(args, config, agent.client)
+        else:
+            chunks = answer(args, config, agent, cwd)
+
+        with traced(args, cwd) as trace, out:
+            async for chunk in chunks:
+                out.write(chunk)
+                # Don't buffer more than a frame for a client that reads slower than the model writes.
+                await drain()
+
+        await send(type="chunk", text="\n")
+
+        if args.debug and not args.complete:
+            await send(type="chunk", text="".join(f"{line}\n" for line in route_info(agent)))
+
+        if args.profile:
+            await send(type="chunk", text="".join(f"{line}\n" for line in trace.report()))
+
+        await send(type="exit", code=0)
+
+
+class _Chunks:
+    """A file for a `Renderer` that sends what is written to the client as `chunk` messages."""
+
+    def __init__(self, post) -> None:
+        self.post = post
+
+    def write(self, text: str):
+        self.post(type="chunk", text=text)
+
+    def flush(self):
+        pass
+
+
+def _listening(path: str) -> bool:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        sock.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+async def serve(config: LovelaiceConfig):
+    await Daemon(idle_timeout=config.daemon.idle_timeout).serve()
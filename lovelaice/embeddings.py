@@ -0,0 +1,63 @@
+import re
+import zlib
+
+import numpy as np
+
+
+_WORD = re.compile(r"\w+")
+
+
+class HashingVectorizer:
+    """
+    Deterministic, vocabulary-free text vectors built from hashed
+    word unigrams, word bigrams and character n-grams.
+
+    Vectors are L2-normalized, so a dot product is a cosine similarity.
+    """
+
+    def __init__(self, dim: int = 4096, char_ngrams: tuple[int, ...] = (3, 4)) -> None:
+        self.dim = dim
+        self.char_ngrams = char_ngrams
+
+    def features(self, text: str) -> list[str]:
+        words = _WORD.findall(text.lower())
+        features = [f"w:{w}" for w in words]
+        features.extend(f"b:{a} {b}" for a, b in zip(words, words[1:]))
+
+        for word in words:
+            padded = f" {word} "
+
+            for n in self.char_ngrams:
+                features.extend(f"c:{padded[i:i + n]}" for i in range(len(padded) - n + 1))
+
+        return features
+
+    def counts(self, texts: list[str]) -> np.ndarray:
+        """Raw hashed feature counts, one row per text."""
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+
+        for row, text in enumerate(texts):
+            for feature in self.features(text):
+                matrix[row, zlib.crc32(feature.encode()) % self.dim] += 1
+
+        return matrix
+
+    def transform(self, texts: list[str], idf: np.ndarray | None = None) -> np.ndarray:
+        """Sublinear TF (optionally times IDF), L2-normalized."""
+        matrix = self.counts(texts)
+        np.log1p(matrix, out=matrix)
+
+        if idf is not None:
+            matrix *= idf
+
+        return normalize(matrix)
+
+    def idf(self, texts: list[str]) -> np.ndarray:
+        df = (self.counts(texts) > 0).sum(axis=0)
+        return (np.log((1 + len(texts)) / (1 + df)) + 1).astype(np.float32)
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
@@ -1,85 +1,180 @@
-import requests
-from bs4 import BeautifulSoup
-from googlesearch import search
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
 import time
+from html.parser import HTMLParser
 from urllib.parse import urlparse
-import os
-from openai import OpenAI
 
-def extract_main_content(html, url, query):
-    """Extract the main content from an HTML page using an LLM."""
-    try:
-        # Try to get a title from the HTML using BeautifulSoup
-        # This is still useful for context
-        soup = BeautifulSoup(html, 'html.parser')
-        title = soup.title.string if soup.title else "Unknown Title"
-        
-        # Initialize OpenAI client
-        client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-        
-        # Remove some HTML boilerplate to reduce token usage
-        # This is a simple clean-up, not full parsing
-        for tag in ['script', 'style', 'svg', 'path', 'footer', 'header', 'nav']:
-            for element in soup.find_all(tag):
-                element.decompose()
-        
-        # Get cleaned HTML
-        cleaned_html = str(soup)
-        return cleaned_html
-#         # Construct the prompt for the LLM
-#         prompt = f"""
-# Task: Extract the most useful and relevant information from this webpage related to the search query.
-
-# # Search Query: {query}
-# # Webpage URL: {url}
-# # Webpage Title: {title}
-
-# # Instructions:
-# # 1. Focus only on content directly relevant to the search query
-# # 2. Extract key facts, definitions, explanations, and important details
-# # 3. Organize the information in a coherent way
-# # 4. Ignore navigation elements, ads, footers, headers, and other irrelevant parts
-# # 5. If there's no relevant information, state that clearly
-
-# # Do not rewrite the information, just extract information.
-
-# # HTML Content:
-# # {cleaned_html}
-
-# # Extracted Information:
-# # """
-        
-#         # Call the LLM API
-#         response = client.chat.completions.create(
-#             model="gpt-4o-mini",  # or whatever model is available/preferred
-#             messages=[
-#                 {"role": "system", "content": "You are a helpful assistant, specialized content extraction. Your task is to extract all the relevant information from webpage HTML based on a search query."},
-#                 {"role": "user", "content": prompt}
-#             ],
-#             temperature=0.3  # Keep temperature low for more factual extraction
-#         )
-        
-#         # Get the extracted content from the response
-#         extracted_text = response.choices[0].message.content
-        
-#         return extracted_text
-    
-    # except Exception as e:
-    #     return f"Error extracting content via LLM: {str(e)}"
-
-def fetch_webpage(url, timeout=10):
-    """Fetch the webpage content with error handling."""
+import httpx
+
+from .cache import PageCache
+
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Referer': 'https://www.google.com/'
+}
+
+
+SKIP_TAGS = {
+    'script', 'style', 'svg', 'noscript', 'template', 'iframe', 'canvas',
+    'nav', 'footer', 'aside', 'button', 'select',
+}
+
+# A `header` is dropped only as the page's own: within these it holds the title of the content.
+CONTENT_TAGS = {'article', 'main', 'section'}
+
+BLOCK_TAGS = {
+    'p', 'div', 'br', 'hr', 'li', 'ul', 'ol', 'dl', 'dt', 'dd', 'tr', 'table',
+    'section', 'article', 'main', 'pre', 'blockquote', 'figure', 'figcaption',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'title',
+}
+
+
+class TextExtractor(HTMLParser):
+    """
+    Single-pass HTML to text extraction. Text inside boilerplate elements
+    (`SKIP_TAGS` and the page's own `header`) is dropped as it is parsed,
+    block elements become line breaks, and parsing stops once `max_bytes` of
+    text have been emitted.
+
+    Feed the page incrementally with `feed()` and stop early when `full`.
+    """
+
+    def __init__(self, max_bytes: int = 20000) -> None:
+        super().__init__(convert_charrefs=True)
+        self.max_bytes = max_bytes
+        self.full = False
+        self._parts: list[str] = []
+        self._size = 0
+        self._skip = 0
+        self._pre = 0
+        self._content = 0
+        # Whether each open `header` is skipped.
+        self._headers: list[bool] = []
+        self._newline = True
+        self._space = False
+
+    def feed(self, data: str):
+        if not self.full:
+            super().feed(data)
+
+    def text(self) -> str:
+        return "".join(self._parts).strip()
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'header':
+            self._headers.append(not self._content)
+            self._skip += not self._content
+        elif tag in SKIP_TAGS:
+            self._skip += 1
+        elif tag == 'pre':
+            self._pre += 1
+        elif tag in CONTENT_TAGS:
+            self._content += 1
+
+        if tag in BLOCK_TAGS:
+            self._break()
+
+        if tag == 'li' and not self._skip:
+            self._emit("- ")
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self._break()
+
+    def handle_endtag(self, tag):
+        if tag == 'header':
+            if self._headers and self._headers.pop():
+                self._skip = max(self._skip - 1, 0)
+        elif tag in SKIP_TAGS:
+            self._skip = max(self._skip - 1, 0)
+        elif tag == 'pre':
+            self._pre = max(self._pre - 1, 0)
+        elif tag in CONTENT_TAGS:
+            self._content = max(self._content - 1, 0)
+
+        if tag in BLOCK_TAGS:
+            self._break()
+
+    def handle_data(self, data):
+        if self._skip or self.full:
+            return
+
+        if not self._pre:
+            text = " ".join(data.split())
+
+            if not text:
+                self._space = True
+                return
+
+            if (self._space or data[0].isspace()) and not self._newline:
+                text = " " + text
+
+            self._space = data[-1].isspace()
+            data = text
+
+        self._emit(data)
+
+    def _break(self):
+        if not self._newline and not self._skip:
+            self._emit("\n")
+            self._newline = True
+            self._space = False
+
+    def _emit(self, text: str):
+        # The UTF-8 size, without encoding the (usual) ASCII text.
+        size = len(text) if text.isascii() else len(text.encode())
+
+        if self._size + size >= self.max_bytes:
+            text = text.encode()[:self.max_bytes - self._size].decode(errors="ignore")
+            size = len(text.encode())
+            self.full = True
+
+        self._parts.append(text)
+        self._size += size
+        self._newline = text.endswith("\n")
+
+
+def extract_main_content(html, url, query, max_bytes=20000):
+    """Extract the readable text of an HTML page, dropping boilerplate to reduce token usage."""
+    extractor = TextExtractor(max_bytes)
+
+    for i in range(0, len(html), 2**16):
+        extractor.feed(html[i:i + 2**16])
+
+        if extractor.full:
+            break
+
+    return extractor.text()
+
+
+def fetch_webpage(url, timeout=10, cache: PageCache | None = None):
+    """Fetch the webpage content with error handling, revalidating cached copies when possible."""
+    import requests
+
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Referer': 'https://www.google.com/'
-        }
-        
+        if cache is not None:
+            page = cache.page(url)
+
+            if page and page["fresh"] and (html := cache.html(url)) is not None:
+                return html
+
+        headers = dict(HEADERS, **cache.validators(url)) if cache is not None else HEADERS
         response = requests.get(url, headers=headers, timeout=timeout)
+
+        if response.status_code == 304 and cache is not None and (html := cache.html(url)) is not None:
+            cache.revalidated(url)
+            return html
+
         response.raise_for_status()  # Raise exception for 4XX/5XX responses
-        
+
+        if cache is not None:
+            cache.store(url, response.text, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+
         return response.text
     except requests.exceptions.Timeout:
         return None, "Request timed out"
@@ -88,6 +183,7 @@ def fetch_webpage(url, timeout=10):
     except requests.exceptions.RequestException as e:
         return None, f"Request error: {str(e)}"
 
+
 def is_safe_url(url):
     """Check if a URL is likely safe to request."""
     parsed = urlparse(url)
@@ -96,62 +192,229 @@ def is_safe_url(url):
         return False
     return True
 
-def run_search():
-    optimized_query = "deep research open source"
-    
+
+class _Host:
+    def __init__(self, limit: int) -> None:
+        self.semaphore = asyncio.Semaphore(limit)
+        self.next_at = 0.0
+
+
+class Fetcher:
+    """
+    Fetches pages through one pooled HTTP client, with at most `per_host`
+    concurrent requests to the same host, spaced at least `delay` seconds apart.
+
+    With a `cache`, fresh pages skip the network and stale ones are
+    revalidated with conditional requests.
+    """
+
+    def __init__(
+        self,
+        per_host: int = 2,
+        delay: float = 1.0,
+        timeout: float = 10.0,
+        cache: PageCache | None = None,
+    ) -> None:
+        self.per_host = per_host
+        self.delay = delay
+        self.timeout = timeout
+        self.cache = cache
+        self._client: httpx.AsyncClient | None = None
+        self._hosts: dict[str, _Host] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(headers=HEADERS, timeout=self.timeout, follow_redirects=True)
+
+        return self._client
+
+    async def fetch(self, url: str) -> str:
+        headers = {}
+
+        if self.cache is not None:
+            page = self.cache.page(url)
+
+            if page and page["fresh"] and (html := self.cache.html(url)) is not None:
+                return html
+
+            headers = self.cache.validators(url)
+
+        host = self._hosts.setdefault(urlparse(url).netloc, _Host(self.per_host))
+
+        async with host.semaphore:
+            now = time.monotonic()
+            wait = host.next_at - now
+            host.next_at = max(now, host.next_at) + self.delay
+
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            response = await self.client.get(url, headers=headers)
+
+        if response.status_code == 304 and self.cache is not None and (html := self.cache.html(url)) is not None:
+            self.cache.revalidated(url)
+            return html
+
+        response.raise_for_status()
+
+        if self.cache is not None:
+            self.cache.store(url, response.text, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+
+        return response.text
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class ProcessPool(concurrent.futures.Executor):
+    """
+    Processes to extract the text of pages in parallel (it holds the GIL, so
+    threads take turns), started on first use and then kept warm. Only worth
+    their startup in long-lived processes: the daemon, the API and batches.
+    """
+
+    def __init__(self, workers: int | None = None) -> None:
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self._pool: concurrent.futures.ProcessPoolExecutor | None = None
+
+    def submit(self, fn, /, *args, **kwargs):
+        if self._pool is None:
+            # Forking a process with threads running (e.g., the executor's) is not safe.
+            context = multiprocessing.get_context("spawn")
+            self._pool = concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=context)
+
+        return self._pool.submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        if self._pool is not None:
+            self._pool.shutdown(wait, cancel_futures=cancel_futures)
+            self._pool = None
+
+
+_executor: concurrent.futures.Executor | None = None
+
+
+def _cleanup_executor() -> concurrent.futures.Executor:
+    # Threads have no startup cost, which matters for one-shot queries.
+    # Long-lived processes pass a `ProcessPool` instead.
+    global _executor
+
+    if _executor is None:
+        _executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="lovelaice-html")
+
+    return _executor
+
+
+async def search_results(query, num_results=5, cache: PageCache | None = None) -> list[dict]:
+    """Runs the (blocking) Google search in a thread, or reuses a cached result list."""
+    if cache is not None and (results := cache.search(query, num_results)) is not None:
+        return results
+
+    from googlesearch import search
+
+    results = await asyncio.to_thread(
+        lambda: list(search(query, sleep_interval=2, num_results=num_results, advanced=True))
+    )
+    results = [dict(title=r.title, url=r.url, description=r.description) for r in results]
+
+    if cache is not None and results:
+        cache.store_search(query, num_results, results)
+
+    return results
+
+
+async def search_and_fetch(
+    query,
+    num_results=5,
+    deadline=15.0,
+    fetcher: Fetcher | None = None,
+    executor: concurrent.futures.Executor | None = None,
+):
+    """
+    Searches for `query` and fetches all results concurrently, yielding a
+    dict with `title`, `url` and cleaned `content` for each page as soon as
+    it is ready. Pages not ready after `deadline` seconds are reported as such.
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    fetcher = fetcher or Fetcher()
+    executor = executor or _cleanup_executor()
+    cache = fetcher.cache
+    results = await search_results(query, num_results, cache)
+
+    async def process(result):
+        url = result["url"]
+        page = dict(title=result["title"], url=url)
+
+        if not is_safe_url(url):
+            return dict(page, content="Skipping fetch: URL appears unsafe")
+
+        try:
+            html = await fetcher.fetch(url)
+        except httpx.TimeoutException:
+            return dict(page, content="Failed to fetch content: request timed out")
+        except httpx.HTTPError as e:
+            return dict(page, content=f"Failed to fetch content: {e}")
+
+        content = cache.text(url) if cache is not None else None
+
+        if content is None:
+            try:
+                content = await loop.run_in_executor(executor, extract_main_content, html, url, query)
+            except Exception as e:
+                return dict(page, content=f"Failed to extract content: {e}")
+
+            if cache is not None:
+                cache.store_text(url, content)
+
+        return dict(page, content=content)
+
+    tasks = {asyncio.ensure_future(process(result)): result for result in results}
+    remaining = max(deadline - (loop.time() - start), 0)
+
+    try:
+        for future in asyncio.as_completed(tasks, timeout=remaining):
+            yield await future
+    except asyncio.TimeoutError:
+        for task, result in tasks.items():
+            if not task.done():
+                yield dict(title=result["title"], url=result["url"], content="Not fetched before the deadline")
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def run_search(optimized_query="deep research open source"):
     print(f"Searching for: {optimized_query}\n")
-    search_results = []
-    
-    count = 0
-    for result in search(optimized_query, sleep_interval=2, num_results=5, advanced=True):
-        print(f"\n{count+1}. {result.title}\n   {result.url}")
-        
-        if is_safe_url(result.url):
-            print("   Fetching content...")
-            
-            # Fetch the webpage content
-            html_content = fetch_webpage(result.url)
-            
-            if html_content:
-                # Extract useful text from the webpage - pass the query now
-                extracted_text = extract_main_content(html_content, result.url, optimized_query)
-                
-                # Store the result including the extracted content
-                result_with_content = {
-                    'title': result.title,
-                    'url': result.url,
-                    'content': extracted_text
-                }
-                search_results.append(result_with_content)
-                
-                # Print a preview of the extracted content
-                preview = extracted_text[:500].replace('\n', ' ')
-                if len(extracted_text) > 500:
-                    preview += "..."
-                print(f"   Content preview: {preview}")
-            else:
-                print(f"   Failed to fetch content")
-                search_results.append({
-                    'title': result.title,
-                    'url': result.url,
-                    'content': "Failed to fetch content"
-                })
-        else:
-            print("   Skipping fetch: URL appears unsafe")
-            
-        count += 1
-        # Short delay between requests to be respectful
-        time.sleep(1)
-    
+    pages = []
+    fetcher = Fetcher(cache=PageCache())
+
+    try:
+        async for result in search_and_fetch(optimized_query, fetcher=fetcher):
+            print(f"\n{len(pages) + 1}. {result['title']}\n   {result['url']}")
+
+            preview = result['content'][:500].replace('\n', ' ')
+            if len(result['content']) > 500:
+                preview += "..."
+            print(f"   Content preview: {preview}")
+
+            pages.append(result)
+    finally:
+        await fetcher.close()
+
     print("\nSearch completed with information extraction.")
-    return search_results
+    return pages
+
 
 if __name__ == "__main__":
-    results = run_search()
+    results = asyncio.run(run_search())
     print("\n\n")
 
     for result in results:
         print(result['title'])
         print(result['url'])
         print(result['content'])
-        print("\n\n")
\ No newline at end of file
+        print("\n\n")
@@ -0,0 +1,115 @@
+import asyncio
+import collections
+
+from .buffers import CHARS_PER_TOKEN, estimate_tokens
+from .models import Message
+
+
+SUMMARY_PROMPT = """
+Below is the summary of a conversation between a user and an AI assistant
+so far, followed by its next messages. Write an updated summary that keeps
+the facts, decisions, names, paths and open questions that may be needed
+later, in at most {words} words. Reply only with the summary.
+
+Summary so far:
+{summary}
+
+Next messages:
+{messages}
+
+Updated summary:
+"""
+
+
+class History:
+    """
+    The messages of a conversation, kept within a token budget.
+
+    The tokens of each message are estimated once, when it is appended,
+    and kept in a running total. When the total goes over `tokens`, the
+    oldest messages are moved out (down to half the budget) and folded into
+    a rolling summary by `summarize(summary, messages)` in the background,
+    e.g., while the user types the next query. Until the summary is ready,
+    the moved messages are still sent verbatim. The last `keep` messages
+    (the last exchange) are never moved out, but cut to fit if needed.
+    """
+
+    def __init__(self, summarize, tokens: int = 2048, summary_tokens: int = 256, keep: int = 2) -> None:
+        self.summarize = summarize
+        self.budget = max(tokens, 1)
+        self.summary_tokens = summary_tokens
+        self.keep = keep
+        self.summary = ""
+        self.tokens = 0
+        self.recent: collections.deque[tuple[Message, int]] = collections.deque()
+        self.pending: list[Message] = []
+        self._task: asyncio.Task | None = None
+
+    def __len__(self):
+        return len(self.recent)
+
+    def append(self, role: str, content: str):
+        self.recent.append((Message(role=role, content=content), estimate_tokens(content)))
+        self.tokens += self.recent[-1][1]
+
+    def messages(self) -> list[Message]:
+        """The summary (if any), the messages being summarized, and the recent ones, to prepend to a prompt."""
+        messages = []
+
+        if self.summary:
+            messages.append(Message(role="system", content=f"Summary of the conversation so far:\n{self.summary}"))
+
+        return messages + self.pending + [m for m, _ in self.recent]
+
+    def compact(self):
+        """Starts summarizing the oldest messages if over budget (and not summarizing already)."""
+        if self.tokens <= self.budget or self._task is not None:
+            return
+
+        while len(self.recent) > self.keep and self.tokens > self.budget // 2:
+            message, tokens = self.recent.popleft()
+            self.tokens -= tokens
+            self.pending.append(message)
+
+        if self.tokens > self.budget:
+            self._truncate()
+
+        if self.pending:
+            self._task = asyncio.create_task(self._summarize())
+
+    def _truncate(self):
+        """Cuts the messages kept to an even share of the budget each, keeping their beginning and end."""
+        share = self.budget // len(self.recent)
+        self.tokens = 0
+
+        for i, (message, tokens) in enumerate(self.recent):
+            if tokens > share:
+                half = share * CHARS_PER_TOKEN // 2
+                # With no room left (more messages than tokens in the budget), only the marker is kept.
+                content = f"{message.content[:half]}\n[...]\n{message.content[-half:]}" if half > 0 else "[...]"
+                message = Message(role=message.role, content=content)
+                tokens = estimate_tokens(message.content)
+
+            self.recent[i] = (message, tokens)
+            self.tokens += tokens
+
+    async def _summarize(self):
+        try:
+            self.summary = await self.summarize(self.summary, self.pending, self.summary_tokens)
+        except Exception:
+            # Better to forget these messages than to let the history grow unbounded.
+            pass
+        finally:
+            self.pending = []
+            self._task = None
+
+        self.compact()
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+def summary_prompt(summary: str, messages: list[Message], tokens: int) -> str:
+    lines = "\n\n".join(f"{m.role}: {m.content}" for m in messages)
+    return SUMMARY_PROMPT.format(words=max(tokens * 3 // 4, 20), summary=summary or "(empty)", messages=lines)
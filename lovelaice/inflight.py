@@ -0,0 +1,136 @@
+import asyncio
+
+
+class SharedStream:
+    """
+    One upstream stream shared by every concurrent subscriber.
+
+    The `source` is consumed by a background task, and each `subscribe()`
+    replays all the chunks received so far before following the live ones,
+    so late subscribers get the complete response. The source is cancelled
+    when the last subscriber leaves before it is done.
+    """
+
+    def __init__(self, source) -> None:
+        self.chunks: list[str] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self.task = asyncio.create_task(self._pump(source))
+
+    async def _pump(self, source):
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self):
+        self.subscribers += 1
+        position = 0
+
+        try:
+            while True:
+                while position < len(self.chunks):
+                    yield self.chunks[position]
+                    position += 1
+
+                if self.done:
+                    break
+
+                await self._changed.wait()
+
+            if self.error is not None:
+                raise self.error
+        finally:
+            self.subscribers -= 1
+
+            if not self.subscribers and not self.done:
+                self.task.cancel()
+
+
+class _Batch:
+    def __init__(self) -> None:
+        self.prompts: list[str] = []
+        self.queues: list[asyncio.Queue] = []
+        self.left = 0
+        self.task: asyncio.Task | None = None
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class Batcher:
+    """
+    Groups completion prompts with the same parameters that arrive within
+    `window` seconds into a single upstream request of up to `max_size`
+    prompts, for providers that accept a list of prompts.
+
+    `send(prompts, params)` must stream `(index, text)` pairs, where `index`
+    is the position of the prompt the text belongs to.
+    """
+
+    def __init__(self, send, window: float = 0.01, max_size: int = 16) -> None:
+        self.send = send
+        self.window = window
+        self.max_size = max(max_size, 1)
+        self._pending: dict[str, _Batch] = {}
+
+    async def stream(self, key: str, prompt: str, params: dict):
+        """Streams the completion of `prompt`, batched with others under the same `key`."""
+        batch = self._pending.get(key)
+
+        if batch is None:
+            batch = self._pending[key] = _Batch()
+            batch.timer = asyncio.get_running_loop().call_later(self.window, self._flush, key, params)
+
+        queue = asyncio.Queue()
+        batch.prompts.append(prompt)
+        batch.queues.append(queue)
+
+        if len(batch.prompts) >= self.max_size:
+            self._flush(key, params)
+
+        try:
+            while (chunk := await queue.get()) is not None:
+                if isinstance(chunk, Exception):
+                    raise chunk
+
+                yield chunk
+        finally:
+            batch.left += 1
+
+            # Nobody is listening anymore, so stop generating.
+            if batch.left == len(batch.queues) and batch.task is not None:
+                batch.task.cancel()
+
+    def _flush(self, key: str, params: dict):
+        batch = self._pending.pop(key, None)
+
+        if batch is None:
+            return
+
+        batch.timer.cancel()
+
+        if batch.left == len(batch.queues):
+            return
+
+        batch.task = asyncio.create_task(self._run(batch, params))
+
+    async def _run(self, batch: _Batch, params: dict):
+        try:
+            async for index, text in self.send(batch.prompts, params):
+                batch.queues[index].put_nowait(text)
+        except Exception as e:
+            for queue in batch.queues:
+                queue.put_nowait(e)
+        finally:
+            for queue in batch.queues:
+                queue.put_nowait(None)
@@ -0,0 +1,141 @@
+import fcntl
+import json
+import pathlib
+import time
+
+import numpy as np
+
+from .buffers import CHARS_PER_TOKEN, estimate_tokens
+from .cache import cache_dir
+from .embeddings import HashingVectorizer
+
+
+# Only the beginning of long answers is embedded and recalled.
+EMBEDDED_CHARS = 2000
+SNIPPET_CHARS = 1000
+
+
+class Memory:
+    """
+    Past queries and their answers (including truncated tool outputs),
+    persisted across sessions and searchable by similarity.
+
+    Records are appended to `records.jsonl`, their byte offsets in it to
+    `offsets.u64`, and their vectors (hashed n-grams, see `HashingVectorizer`)
+    to `vectors.f32`, a raw float32 matrix. Searches memory-map the matrix and
+    scan it in blocks of `block` rows, keeping the running top-k, so only the
+    pages being scanned are loaded, however large the index grows. Appends
+    are serialized across processes with a file lock.
+    """
+
+    def __init__(self, path: pathlib.Path | None = None, dim: int = 256, block: int = 65536) -> None:
+        self.path = path or cache_dir() / "memory"
+        self.dim = dim
+        self.block = block
+        self.vectorizer = HashingVectorizer(dim=dim)
+
+    @property
+    def _records(self) -> pathlib.Path:
+        return self.path / "records.jsonl"
+
+    @property
+    def _offsets(self) -> pathlib.Path:
+        return self.path / "offsets.u64"
+
+    @property
+    def _vectors(self) -> pathlib.Path:
+        return self.path / "vectors.f32"
+
+    def __len__(self):
+        try:
+            # The vectors are written last, so every one of them has its record.
+            return self._vectors.stat().st_size // (self.dim * 4)
+        except FileNotFoundError:
+            return 0
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        return self.vectorizer.transform([t[:EMBEDDED_CHARS] for t in texts])
+
+    def add(self, query: str, answer: str, **fields):
+        record = dict(time=time.time(), query=query, answer=answer, **fields)
+        vector = self.embed([f"{query}\n{answer}"])[0]
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        with open(self.path / "lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # An offset written past the last vector (e.g., by a crash) is overwritten.
+            count = len(self)
+
+            with open(self._records, "ab") as fp:
+                offset = fp.tell()
+                fp.write(json.dumps(record, ensure_ascii=False).encode() + b"\n")
+
+            with open(self._offsets, "r+b" if self._offsets.exists() else "wb") as fp:
+                fp.truncate(count * 8)
+                fp.seek(count * 8)
+                fp.write(np.uint64(offset).tobytes())
+
+            with open(self._vectors, "ab") as fp:
+                fp.write(vector.astype(np.float32).tobytes())
+
+    def search(self, query: str, k: int = 3, min_score: float = 0.0) -> list[tuple[float, dict]]:
+        """The (up to) `k` most similar past records to `query`, best first, with their cosine similarity."""
+        count = len(self)
+
+        if not count or k <= 0:
+            return []
+
+        vector = self.embed([query])[0]
+        matrix = np.memmap(self._vectors, dtype=np.float32, mode="r", shape=(count, self.dim))
+        best_scores = np.empty(0, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+
+        for start in range(0, count, self.block):
+            scores = matrix[start:start + self.block] @ vector
+
+            if len(scores) > k:
+                top = np.argpartition(scores, -k)[-k:]
+            else:
+                top = np.arange(len(scores))
+
+            best_scores = np.concatenate([best_scores, scores[top]])
+            best_rows = np.concatenate([best_rows, top + start])
+
+            if len(best_scores) > k:
+                keep = np.argpartition(best_scores, -k)[-k:]
+                best_scores, best_rows = best_scores[keep], best_rows[keep]
+
+        order = np.argsort(best_scores)[::-1]
+        offsets = np.memmap(self._offsets, dtype=np.uint64, mode="r", shape=(count,))
+        results = []
+
+        with open(self._records, "rb") as fp:
+            for i in order:
+                if best_scores[i] < min_score:
+                    break
+
+                fp.seek(int(offsets[best_rows[i]]))
+                results.append((float(best_scores[i]), json.loads(fp.readline())))
+
+        return results
+
+    def recall(self, query: str, k: int = 3, tokens: int = 256, min_score: float = 0.4) -> str:
+        """The most similar past exchanges to `query` as text, within `tokens`."""
+        snippets = []
+        used = 0
+
+        for _, record in self.search(query, k, min_score):
+            snippet = f"Q: {record['query']}\nA: {record['answer'][:SNIPPET_CHARS]}"
+            size = estimate_tokens(snippet)
+
+            if used + size > tokens:
+                snippet = snippet[:max(tokens - used, 0) * CHARS_PER_TOKEN]
+                size = estimate_tokens(snippet)
+
+            if not snippet:
+                break
+
+            snippets.append(snippet)
+            used += size
+
+        return "\n\n".join(snippets)
@@ -1,6 +1,61 @@
 from pydantic import BaseModel
 
 
+class Verbatim(str):
+    """A chunk of a response not written by the model (e.g., a tool's output), to be shown as is."""
+
+
 class Message(BaseModel):
     role:str
     content:str
+
+
+class Route(BaseModel):
+    tool: str
+    source: str
+    confidence: float = 1.0
+    elapsed: float = 0.0
+
+
+class Speculation(BaseModel):
+    attempts: int = 0
+    hits: int = 0
+    wasted: int = 0
+    ttft_saved: float = 0.0
+
+    @property
+    def wasted_rate(self) -> float:
+        return self.wasted / self.attempts if self.attempts else 0.0
+
+
+class Cascade(BaseModel):
+    checked: int = 0
+    escalated: int = 0
+
+    @property
+    def escalation_rate(self) -> float:
+        return self.escalated / self.checked if self.checked else 0.0
+
+
+class Coalescing(BaseModel):
+    requests: int = 0
+    shared: int = 0
+    upstream: int = 0
+    batches: int = 0
+    batched: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.shared / self.requests if self.requests else 0.0
+
+    @property
+    def saved(self) -> int:
+        return self.requests - self.upstream
+
+
+class Scheduling(BaseModel):
+    retries: int = 0
+    stalls: int = 0
+    hedges: int = 0
+    hedge_wins: int = 0
+    throttled: float = 0.0
@@ -0,0 +1,261 @@
+"""
+Output of streamed responses, a frame at a time.
+
+Chunks are buffered and written at most `fps` times per second (the first
+one right away), instead of parsing and writing each one as it arrives.
+On a terminal, `MarkdownRenderer` renders the response block by block: the
+block being streamed (a paragraph, a list, a code fence...) is redrawn in
+place on each frame, and once complete it is printed for good and never
+rendered again. `Verbatim` chunks (what tools output) are written as is.
+"""
+
+import asyncio
+import itertools
+import re
+import sys
+import time
+
+from rich import get_console
+from rich.console import Console, Group, RenderableType
+from rich.live import Live
+from rich.markdown import Markdown
+from rich.padding import Padding
+from rich.syntax import Syntax
+
+from .config import RenderConfig
+from .models import Verbatim
+from .tools import read_input
+
+
+FENCE = re.compile(r" {0,3}(`{3,}|~{3,})(.*)")
+# Lists and tables, which `Markdown` already renders after a blank line.
+SPACED = re.compile(r" {0,3}([-*+]|\d{1,9}[.)])(\s|$)|[^\n]*\n *\|? *:?-+:? *(\| *:?-+:? *)*\|? *(\n|$)")
+# As in `Markdown`.
+CODE_THEME = "monokai"
+
+
+class Renderer:
+    """Writes the text as is, in frames."""
+
+    def __init__(self, fps: float = 20.0, file=None) -> None:
+        self.file = file or sys.stdout
+        self.interval = 1 / fps if fps > 0 else 0.0
+        self.pending: list[str] = []
+        self.last = 0.0
+        self._timer: asyncio.TimerHandle | None = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, text: str):
+        if not text:
+            return
+
+        self.pending.append(text)
+
+        if self._timer is not None:
+            return
+
+        wait = self.last + self.interval - time.monotonic()
+
+        if wait <= 0:
+            self.flush()
+        else:
+            self._timer = asyncio.get_running_loop().call_later(wait, self.flush)
+
+    def flush(self):
+        """Outputs everything written so far."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        self.last = time.monotonic()
+
+        chunks, self.pending = self.pending, []
+
+        for verbatim, group in itertools.groupby(chunks, lambda chunk: isinstance(chunk, Verbatim)):
+            if verbatim:
+                self.verbatim("".join(group))
+            else:
+                self.render("".join(group))
+
+    def render(self, text: str):
+        self.file.write(text)
+        self.file.flush()
+
+    def verbatim(self, text: str):
+        self.render(text)
+
+    def close(self):
+        self.flush()
+
+    async def ask(self, prompt: str) -> str:
+        """A `prompter` that shows everything written before asking."""
+        self.close()
+        return await read_input(prompt)
+
+
+class MarkdownRenderer(Renderer):
+    """
+    Renders the text as Markdown, keeping its line breaks. Only the block in
+    progress is redrawn on each frame, in a `Live` display. The complete lines
+    of a code fence taller than half the screen are printed as they come, so
+    that it never overflows it. Blocks are separated by a blank line, as
+    `Markdown` does within a document. `Verbatim` text ends the block in
+    progress and is written as is.
+    """
+
+    def __init__(self, fps: float = 20.0, console: Console | None = None) -> None:
+        super().__init__(fps)
+        self.console = console or get_console()
+        self.live: Live | None = None
+        # The source of the block in progress, and how much of it is known to be whole lines.
+        self.block = ""
+        self.scanned = 0
+        self.printed = 0
+        # The blocks completed in this frame, printed together.
+        self.completed: list[RenderableType] = []
+        # The opening line of the fence the block is in, if any, and how many parts of it were printed.
+        self.fence: str | None = None
+        self.fence_char = ""
+        self.fence_size = 0
+        self.fence_parts = 0
+        # Whether the cursor is at the start of a line, which is not the case after verbatim text without a line break.
+        self.newline = True
+        # Whether the last thing printed was a Markdown block, to be separated from verbatim text by a blank line.
+        self.after_block = False
+
+    def render(self, text: str):
+        if not self.newline:
+            self.console.file.write("\n")
+            self.newline = True
+
+        self.block += text
+        self._commit_complete()
+
+        if self.live is None:
+            self.live = Live(console=self.console, auto_refresh=False, transient=True, vertical_overflow="crop")
+            self.live.start()
+
+        block = self._renderable(self.block, last=True)
+
+        if not self.fence_parts and self._separated(self.block):
+            block = Padding(block, (1, 0, 0, 0))
+
+        # Printing above the live display redraws it anyway.
+        self.live.update(block, refresh=not self.completed)
+        self._print()
+
+    async def ask(self, prompt: str) -> str:
+        answer = await super().ask(prompt)
+        # Ended by the user's Enter.
+        self.newline = True
+        return answer
+
+    def verbatim(self, text: str):
+        self._end()
+
+        if self.after_block:
+            self.console.file.write("\n")
+            self.after_block = False
+
+        self.console.file.write(text)
+        self.console.file.flush()
+        self.newline = text.endswith("\n")
+
+    def close(self):
+        self.flush()
+        self._end()
+
+    def _end(self):
+        """Prints the block in progress for good."""
+        if self.live is not None:
+            self.live.stop()
+            self.live = None
+
+        self._commit(len(self.block))
+        self._print()
+        self.scanned = 0
+        self.fence, self.fence_parts = None, 0
+
+    def _commit_complete(self):
+        """Prints the blocks completed by the new lines, and the whole lines of a fence taller than half the screen."""
+        while (end := self.block.find("\n", self.scanned)) >= 0:
+            line = self.block[self.scanned:end]
+            start, self.scanned = self.scanned, end + 1
+            fence = FENCE.fullmatch(line)
+
+            if self.fence is not None:
+                if fence and self._closes(fence):
+                    self._commit(self.scanned)
+                    self.fence, self.fence_parts = None, 0
+            elif fence is not None:
+                self._commit(start)
+                self.fence, self.fence_char, self.fence_size, self.fence_parts = line, fence.group(1)[0], len(fence.group(1)), 0
+            elif not line.strip():
+                self._commit(self.scanned)
+
+        if self.fence is not None and self.block.count("\n") > self.console.height // 2:
+            self._commit(self.scanned, last=False)
+
+    def _closes(self, fence: re.Match) -> bool:
+        marker = fence.group(1)
+        return marker[0] == self.fence_char and len(marker) >= self.fence_size and not fence.group(2).strip()
+
+    def _commit(self, end: int, last: bool = True):
+        text, self.block = self.block[:end], self.block[end:]
+        self.scanned -= end
+
+        if not text.strip():
+            return
+
+        if not self.fence_parts and self._separated(text):
+            self.completed.append("")
+
+        self.completed.append(self._renderable(text, last))
+        self.printed += 1
+        self.after_block = True
+
+        if self.fence is not None:
+            self.fence_parts += 1
+
+    def _print(self):
+        """Prints the blocks completed in this frame (above the live display, while it is on)."""
+        if self.completed:
+            self.console.print(Group(*self.completed))
+            self.completed.clear()
+
+    def _separated(self, text: str) -> bool:
+        """Whether a blank line must be printed before the block `text`."""
+        return bool(self.printed) and not SPACED.match(text)
+
+    def _renderable(self, text: str, last: bool) -> RenderableType:
+        if self.fence is None:
+            # Every line break is kept.
+            return Markdown(re.sub(r"(?<! {2})\n(?!\n)", "  \n", text.rstrip("\n")))
+
+        # Rendered as `Markdown` renders a fence, but only padded above its first part and below its last one.
+        lines = text.rstrip("\n").split("\n")
+
+        if not self.fence_parts:
+            lines = lines[1:]
+
+        if lines and (fence := FENCE.fullmatch(lines[-1])) and self._closes(fence):
+            lines = lines[:-1]
+
+        lexer = FENCE.fullmatch(self.fence).group(2).strip().partition(" ")[0] or "text"
+        padding = (0 if self.fence_parts else 1, 1, 1 if last else 0, 1)
+        return Syntax("\n".join(lines), lexer, theme=CODE_THEME, word_wrap=True, padding=padding)
+
+
+def renderer(config: RenderConfig, markdown: bool = True) -> Renderer:
+    """The renderer for the standard output: Markdown on a terminal if enabled, or else the text as is."""
+    console = get_console()
+
+    if markdown and config.markdown and console.is_terminal:
+        return MarkdownRenderer(config.fps, console)
+
+    return Renderer(config.fps)
@@ -0,0 +1,193 @@
+import asyncio
+import importlib
+import multiprocessing
+import os
+import signal
+import traceback
+from multiprocessing.connection import Connection
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None
+
+
+class SandboxError(Exception):
+    pass
+
+
+def _set_limit(kind, soft):
+    _, hard = resource.getrlimit(kind)
+
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+
+    resource.setrlimit(kind, (soft, hard))
+
+
+def _cpu_used() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _serve(conn: Connection, preload: list[str], cpu_seconds: float, memory_mb: int):
+    """Worker loop: runs each received code snippet and sends back its `result`."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    for module in preload:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
+    if resource is not None and memory_mb:
+        _set_limit(resource.RLIMIT_AS, memory_mb * 2**20)
+
+    while True:
+        try:
+            code, cwd, env = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+
+        if resource is not None and cpu_seconds:
+            # RLIMIT_CPU counts the whole process lifetime, so grant `cpu_seconds` more each time.
+            _set_limit(resource.RLIMIT_CPU, int(_cpu_used() + cpu_seconds) + 1)
+
+        try:
+            if cwd is not None:
+                os.chdir(cwd)
+
+            if env is not None:
+                os.environ.clear()
+                os.environ.update(env)
+
+            namespace = {"__name__": "__sandbox__"}
+            exec(code, namespace)
+            conn.send((True, str(namespace.get("result"))))
+        except MemoryError:
+            conn.send((False, "MemoryError: the code exceeded the memory limit"))
+        except BaseException as e:
+            conn.send((False, "".join(traceback.format_exception_only(type(e), e)).strip()))
+
+
+class _Worker:
+    def __init__(self, context, preload, cpu_seconds, memory_mb) -> None:
+        self.conn, child = context.Pipe()
+        self.process = context.Process(
+            target=_serve,
+            args=(child, preload, cpu_seconds, memory_mb),
+            daemon=True,
+        )
+        self.process.start()
+        child.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class SandboxPool:
+    """
+    A pool of pre-started worker processes to run generated Python code.
+
+    Workers import the `preload` modules once at startup, so heavy imports
+    are not paid on every run. Each run is bounded by `cpu_seconds` of CPU
+    time, `memory_mb` of address space and a `timeout` in wall-clock seconds.
+    A worker that times out, crashes or is cancelled is killed and replaced.
+    """
+
+    def __init__(
+        self,
+        workers: int = 1,
+        preload: list[str] | None = None,
+        cpu_seconds: float = 10,
+        memory_mb: int = 1024,
+        timeout: float = 30,
+    ) -> None:
+        self.workers = max(workers, 1)
+        self.preload = preload or []
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.timeout = timeout
+        self._context = multiprocessing.get_context(
+            "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        )
+        self._idle: asyncio.Queue[_Worker] | None = None
+        self._all: set[_Worker] = set()
+
+    def start(self):
+        """Starts the workers, if not running already."""
+        if self._idle is not None:
+            return
+
+        self._idle = asyncio.Queue()
+
+        for _ in range(self.workers):
+            self._idle.put_nowait(self._spawn())
+
+    def close(self):
+        for worker in self._all:
+            worker.kill()
+
+        self._all.clear()
+        self._idle = None
+
+    async def run(self, code: str, cwd: str | None = None, env: dict | None = None) -> str:
+        """
+        Runs `code` in a worker, optionally in the `cwd` directory and with the `env`
+        environment variables, and returns `str(result)` as set by the code.
+        """
+        self.start()
+        worker = await self._idle.get()
+
+        try:
+            worker.conn.send((code, cwd, env))
+            await asyncio.wait_for(_readable(worker.conn), self.timeout or None)
+            ok, result = worker.conn.recv()
+        except asyncio.TimeoutError:
+            worker = self._replace(worker)
+            raise SandboxError(f"The code timed out after {self.timeout} seconds.")
+        except (EOFError, OSError):
+            worker.process.join(1)
+            exitcode = worker.process.exitcode
+            worker = self._replace(worker)
+
+            if exitcode == -signal.SIGXCPU:
+                raise SandboxError(f"The code exceeded the CPU limit of {self.cpu_seconds} seconds.")
+
+            raise SandboxError(f"The sandbox worker died (exit code {exitcode}).")
+        except BaseException:
+            worker = self._replace(worker)
+            raise
+        finally:
+            if self._idle is not None:
+                self._idle.put_nowait(worker)
+
+        if not ok:
+            raise SandboxError(result)
+
+        return result
+
+    def _spawn(self) -> _Worker:
+        worker = _Worker(self._context, self.preload, self.cpu_seconds, self.memory_mb)
+        self._all.add(worker)
+        return worker
+
+    def _replace(self, worker: _Worker) -> _Worker:
+        worker.kill()
+        self._all.discard(worker)
+        return self._spawn()
+
+
+async def _readable(conn: Connection):
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    fd = conn.fileno()
+
+    loop.add_reader(fd, lambda: future.done() or future.set_result(None))
+
+    try:
+        await future
+    finally:
+        loop.remove_reader(fd)
@@ -1,11 +1,75 @@
-import subprocess
-import importlib
-import requests
-from googlesearch import search
+import asyncio
+import contextvars
+import importlib.resources
+import os
+import signal
+import sys
+import threading
+import time
+import urllib.parse
+from typing import TYPE_CHECKING
+
+from .cache import PageCache
+from .sandbox import SandboxError, SandboxPool
+
+if TYPE_CHECKING:
+    import concurrent.futures
+
+    from .google import Fetcher
+
+
+# Per-request context, used when tools run on behalf of a remote client (e.g., in the daemon).
+prompter = contextvars.ContextVar("prompter", default=None)
+workdir = contextvars.ContextVar("workdir", default=None)
+environ = contextvars.ContextVar("environ", default=None)
+
+
+async def read_input(prompt: str) -> str:
+    """
+    `input` without blocking the event loop. It is read in a daemon thread, not in
+    the loop's executor, so that exiting (e.g., on Ctrl+C) does not wait for a line.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def read():
+        try:
+            result = input(prompt) if sys.stdin.isatty() else _read_line(prompt)
+        except BaseException as e:
+            loop.call_soon_threadsafe(lambda e=e: future.done() or future.set_exception(e))
+        else:
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(result))
+
+    threading.Thread(target=read, daemon=True).start()
+    return await future
+
+
+def _read_line(prompt: str) -> str:
+    """A line read from the standard input's descriptor: `input` on a pipe holds a lock that makes exiting abort while it waits."""
+    print(prompt, end="", flush=True)
+    line = bytearray()
+
+    while (byte := os.read(0, 1)) and byte != b"\n":
+        line += byte
+
+    if not byte and not line:
+        raise EOFError
+
+    return line.decode(errors="replace")
+
+
+async def decline(prompt) -> str:
+    """A `prompter` for when nobody is there to confirm, so tools that run code or commands are always declined."""
+    return "n"
 
 
 class Tool:
     skip_use = False
+    cacheable = True
+    examples: list[str] = []
+    # The models (see `LLM.resolve`) that answer the tool prompt and write the conclusion.
+    model = "chat"
+    conclusion_model = "chat"
 
     @property
     def name(self) -> str:
@@ -21,9 +85,31 @@ class Tool:
     def prompt(self, query) -> str:
         return query
 
-    def use(self, query, response):
+    def validate(self, response) -> bool:
+        """Whether `response` to the tool prompt can be used. If not, and cascading is enabled, the chat model is asked instead."""
+        return True
+
+    async def use(self, query, response):
+        """Runs the tool, yielding its output as it is produced."""
+        return
+        yield
+
+    def warmup(self):
+        """Prepares any expensive resources ahead of the first use."""
         pass
 
+    async def close(self):
+        pass
+
+    async def ask(self, prompt) -> str:
+        """Asks the user for confirmation without blocking the event loop."""
+        ask = prompter.get()
+
+        if ask is not None:
+            return await ask(prompt)
+
+        return await read_input(prompt)
+
     def conclude(self, query, output):
         pass
 
@@ -33,6 +119,16 @@ class Chat(Tool):
     When the user engages in general-purpose or casual conversation.
     """
 
+    examples = [
+        "hello, how are you today?",
+        "hi there, good morning",
+        "what is the meaning of life",
+        "tell me a joke",
+        "who was Ada Lovelace",
+        "explain the theory of relativity in simple terms",
+        "give me some ideas for a birthday present",
+    ]
+
     def __init__(self) -> None:
         self.skip_use = True
 
@@ -43,6 +139,23 @@ class Bash(Tool):
     including git commands, or installing new applications or packages.
     """
 
+    cacheable = False
+    model = "fast"
+
+    examples = [
+        "how much free space do i have",
+        "list all files in this folder",
+        "create a folder named backup",
+        "commit all changes and push",
+        "show the git diff",
+        "install the htop package",
+        "what is my ip address",
+        "kill the process listening on port 8000",
+    ]
+
+    def __init__(self, timeout: float | None = None) -> None:
+        self.timeout = timeout
+
     def prompt(self, query) -> str:
         return f"""
 Given the following user query, generate a single bash command line
@@ -55,7 +168,7 @@ Query: {query}
 Command:
 """
 
-    def use(self, query, response):
+    def command(self, response) -> str:
         response = response.strip("`")
 
         if response.startswith("bash"):
@@ -65,12 +178,18 @@ Command:
         response = [s.strip() for s in response.split("\n")]
         response = [s for s in response if s]
 
-        response = ";".join(s for s in response)
+        return ";".join(s for s in response)
+
+    def validate(self, response) -> bool:
+        return bool(self.command(response))
+
+    async def use(self, query, response):
+        response = self.command(response)
 
         yield "Running the following code:\n"
         yield "$ "
         yield response
-        yes = input("\n[y]es / [N]o ")
+        yes = await self.ask("\n[y]es / [N]o ")
 
         if yes != "y":
             yield "(!) Operation cancelled by your request.\n"
@@ -78,8 +197,70 @@ Command:
 
         yield "\n"
 
-        p = subprocess.run(response, shell=True, stdout=subprocess.PIPE)
-        yield p.stdout.decode("utf8")
+        async for line in self.run(response):
+            yield line
+
+    async def run(self, command):
+        """
+        Runs `command` in a shell, yielding stdout and stderr lines as they
+        are produced. The process is killed on timeout or cancellation.
+        """
+        process = await asyncio.create_subprocess_shell(
+            command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=workdir.get(),
+            env=environ.get(),
+            limit=2**20,
+        )
+
+        lines = asyncio.Queue()
+
+        async def pump(stream: asyncio.StreamReader):
+            try:
+                while True:
+                    try:
+                        line = await stream.readline()
+                    except ValueError:
+                        line = b"(!) Line too long, skipped.\n"
+
+                    if not line:
+                        break
+
+                    lines.put_nowait(line.decode("utf8", errors="replace"))
+            finally:
+                lines.put_nowait(None)
+
+        pumps = [asyncio.create_task(pump(process.stdout)), asyncio.create_task(pump(process.stderr))]
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+
+        try:
+            running = len(pumps)
+
+            while running:
+                timeout = deadline - time.monotonic() if deadline else None
+                line = await asyncio.wait_for(lines.get(), timeout)
+
+                if line is None:
+                    running -= 1
+                else:
+                    yield line
+
+            await process.wait()
+
+            if process.returncode:
+                yield f"(!) Command exited with code {process.returncode}.\n"
+
+        except asyncio.TimeoutError:
+            yield f"(!) Command timed out after {self.timeout} seconds.\n"
+
+        finally:
+            for task in pumps:
+                task.cancel()
+
+            if process.returncode is None:
+                _kill_tree(process.pid)
+                await process.wait()
 
     def conclude(self, query, output):
         return f"""
@@ -102,12 +283,53 @@ explain briefly the result of the operation.
 """
 
 
+def _kill_tree(pid: int):
+    """
+    Kills `pid` and, where /proc exposes them, all its descendants, since
+    they would otherwise keep the output pipes open after the shell dies.
+    """
+    pids = [pid]
+
+    for parent in pids:
+        try:
+            with open(f"/proc/{parent}/task/{parent}/children") as fp:
+                pids.extend(int(child) for child in fp.read().split())
+        except OSError:
+            pass
+
+    for child in reversed(pids):
+        try:
+            os.kill(child, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
 class Interpreter(Tool):
     """
     When the user asks a mathematical question that can
     be solved with a simple Python function.
     """
 
+    examples = [
+        "throw three d20 dices and return the middle value",
+        "what is the square root of 1764",
+        "compute the 30th fibonacci number",
+        "how many days are there between 2024-01-01 and 2024-12-25",
+        "solve the equation x^2 - 5x + 6 = 0",
+        "generate 5 random numbers between 1 and 100",
+    ]
+
+    model = "code"
+
+    def __init__(self, sandbox: SandboxPool | None = None) -> None:
+        self.sandbox = sandbox or SandboxPool()
+
+    def warmup(self):
+        self.sandbox.start()
+
+    async def close(self):
+        self.sandbox.close()
+
     def prompt(self, query) -> str:
         return f"""
 Given the following user query,
@@ -128,9 +350,9 @@ Query: {query}
 Function definition:
 """
 
-    def use(self, query, response):
+    def code(self, response) -> str:
+        """The code inside the ```python blocks of `response`."""
         code = []
-        imports = []
         inside = False
 
         for line in response.split("\n"):
@@ -139,26 +361,29 @@ Function definition:
             elif line.startswith("```"):
                 inside = False
             elif inside:
-                if line.startswith("import"):
-                    imports.append(line.split()[1])
-                else:
-                    code.append(line)
+                code.append(line)
 
-        code.append("\nresult = solve()")
-        code = "\n".join(code).strip()
+        return "\n".join(code)
+
+    def validate(self, response) -> bool:
+        return "def solve(" in self.code(response)
+
+    async def use(self, query, response):
+        code = (self.code(response) + "\n\nresult = solve()").strip()
 
         yield "Will run the following code:\n\n"
         yield code
-        yes = input("\n\n[y]es / [N]o ")
+        yes = await self.ask("\n\n[y]es / [N]o ")
 
         if yes != "y":
             yield "(!) Operation cancelled by your request.\n"
             return
 
-        globals = {module: importlib.import_module(module) for module in imports}
-        locals = {}
-        exec(code, globals, locals)
-        result = locals["result"]
+        try:
+            result = await self.sandbox.run(code, cwd=workdir.get(), env=environ.get())
+        except SandboxError as e:
+            yield f"\n(!) {e}\n"
+            return
 
         yield f"\nResult: {result}"
 
@@ -169,6 +394,16 @@ class Codegen(Tool):
     explicitly asks to generate code in a given programming language.
     """
 
+    examples = [
+        "how to make an async iterator in python",
+        "write a function in javascript that reverses a string",
+        "what is the difference between a list and a tuple in python",
+        "show me an example of a rust trait",
+        "how do I read a csv file with pandas",
+    ]
+
+    model = "code"
+
     def __init__(self) -> None:
         self.skip_use = True
 
@@ -189,6 +424,17 @@ class Weather(Tool):
     When the user asks for the weather.
     """
 
+    cacheable = False
+
+    examples = [
+        "what is the weather in Havana",
+        "will it rain tomorrow in Madrid",
+        "temperature in London today",
+        "weather forecast for the next 5 days in Paris",
+    ]
+
+    model = "fast"
+
     def prompt(self, query) -> str:
         yaml_content = importlib.resources.files('lovelaice').joinpath('api.open-meteo.yml').read_text()
         return f"""
@@ -213,11 +459,32 @@ Query: {query}
 URL: 
 """
 
-    def use(self, query, response):
-        endpoint = response.split()[1]
+    def url(self, response) -> str | None:
+        """The first http(s) URL in `response`, if any."""
+        for word in response.split():
+            word = word.strip("`'\"<>")
+            url = urllib.parse.urlparse(word)
+
+            if url.scheme in ("http", "https") and url.netloc:
+                return word
+
+        return None
+
+    def validate(self, response) -> bool:
+        return self.url(response) is not None
+
+    async def use(self, query, response):
+        endpoint = self.url(response)
+
+        if endpoint is None:
+            yield f"(!) Could not find a URL in: {response.strip()}\n"
+            return
+
         yield f"Retrieving weather from {endpoint}\n\n"
 
-        response = requests.get(endpoint)
+        import requests
+
+        response = await asyncio.to_thread(requests.get, endpoint)
         yield response.text.strip() + "\n"
     
     def conclude(self, query, output):
@@ -235,6 +502,17 @@ class GoogleSearch(Tool):
     that requires up-to-date knowledge.
     """
 
+    cacheable = False
+
+    examples = [
+        "search the web for the latest python release",
+        "what are the latest news about open source AI",
+        "find recent articles about deep research agents",
+        "google the release date of the next iPhone",
+    ]
+
+    model = "fast"
+
     def prompt(self, query) -> str:
         return f"""
 Given the following user query, extract the key search terms that would be most effective
@@ -250,50 +528,81 @@ User query: {query}
 Optimized search query:
 """
 
-    def use(self, query, response):
+    def __init__(
+        self,
+        num_results: int = 5,
+        deadline: float = 15.0,
+        page_chars: int = 2000,
+        fetcher: "Fetcher | None" = None,
+        per_host: int = 2,
+        delay: float = 1.0,
+        timeout: float = 10.0,
+        cache: PageCache | None = None,
+        executor: "concurrent.futures.Executor | None" = None,
+    ) -> None:
+        self.num_results = num_results
+        self.deadline = deadline
+        self.page_chars = page_chars
+        self.executor = executor
+        self._fetcher = fetcher
+        self._fetcher_options = dict(per_host=per_host, delay=delay, timeout=timeout, cache=cache)
+
+    @property
+    def fetcher(self) -> "Fetcher":
+        # The search and HTTP libraries are only imported once a search actually runs.
+        if self._fetcher is None:
+            from .google import Fetcher
+
+            self._fetcher = Fetcher(**self._fetcher_options)
+
+        return self._fetcher
+
+    async def close(self):
+        if self._fetcher is not None:
+            await self._fetcher.close()
+
+    def validate(self, response) -> bool:
+        return bool(response.strip())
+
+    async def use(self, query, response):
+        from .google import search_and_fetch
+
         optimized_query = response.strip()
         yield f"Searching Google for: {optimized_query}\n\n"
-        
+
         try:
-            # 
-            results = []
-            
             count = 0
-            for result in search(optimized_query, sleep_interval=2, num_results=7, advanced=True):
-                yield f"{count}. {result.title}\n   {result.url}\n"
+
+            async for page in search_and_fetch(
+                optimized_query,
+                num_results=self.num_results,
+                deadline=self.deadline,
+                fetcher=self.fetcher,
+                executor=self.executor,
+            ):
                 count += 1
-            
-            return results
+                content = page["content"][:self.page_chars].strip()
+                yield f"{count}. {page['title']}\n   {page['url']}\n\n{content}\n\n"
+
+            if not count:
+                yield "No results found.\n"
         except Exception as e:
             yield f"Error performing search: {str(e)}\n"
-            return []
 
     def conclude(self, query, output):
-        # Check if output is a list (search results)
-        if isinstance(output, list) and len(output) > 0:
-            results_text = "\n".join([f"- {result.title}: {result.url}" for result in output])
-            return f"""
+        return f"""
 The user issued the following query:
 
 Query: {query}
 
-Based on this query, I searched Google and found these results:
+Based on this query, I searched Google and got the following results,
+each with the (possibly truncated) content of the page:
 
-{results_text}
+---
+{output}
+---
 
 Using these search results, please provide a comprehensive answer to the user's query.
 Focus on summarizing the most relevant information and citing the sources.
+If the search failed or found nothing relevant, respond appropriately to the user.
 """
-        else:
-            # If output is just text (like an error message)
-            return f"""
-The user issued the following query:
-
-Query: {query}
-
-When I attempted to search Google for this query, I encountered the following:
-
-{output}
-
-Please respond appropriately to the user based on this information.
-"""
\ No newline at end of file
@@ -0,0 +1,151 @@
+"""
+Where the time of a query goes.
+
+A `Trace` started with `tracing()` collects the spans opened with `span()`
+in the same context (including the tasks it starts), nested by the span that
+was open when they started. Without an active trace, `span()` costs next to
+nothing, so the code is instrumented unconditionally.
+"""
+
+import contextlib
+import contextvars
+import json
+import pathlib
+import time
+
+
+_trace = contextvars.ContextVar("trace", default=None)
+_span = contextvars.ContextVar("span", default=None)
+
+
+class Span:
+    def __init__(self, name: str, parent: "Span | None", **attributes) -> None:
+        self.name = name
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.end: float | None = None
+        self.attributes = attributes
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    @property
+    def depth(self) -> int:
+        return 0 if self.parent is None else self.parent.depth + 1
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class _NoSpan:
+    attributes = {}
+
+    def set(self, **attributes):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Trace:
+    def __init__(self, **attributes) -> None:
+        self.time = time.time()
+        self.start = time.perf_counter()
+        self.end: float | None = None
+        self.attributes = attributes
+        self.spans: list[Span] = []
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def to_dict(self) -> dict:
+        index = {id(s): i for i, s in enumerate(self.spans)}
+
+        return dict(
+            time=self.time,
+            duration=self.duration,
+            **self.attributes,
+            spans=[
+                dict(
+                    name=s.name,
+                    parent=index.get(id(s.parent)),
+                    start=s.start - self.start,
+                    duration=s.duration,
+                    **s.attributes,
+                )
+                for s in self.spans
+            ],
+        )
+
+    def append(self, path: str | pathlib.Path):
+        """Appends the trace as one JSON line to `path`."""
+        with open(path, "a") as fp:
+            fp.write(json.dumps(self.to_dict(), ensure_ascii=False) + "\n")
+
+    def report(self) -> list[str]:
+        """A table with the start, duration, time to first token and tokens of each span."""
+        lines = [f"{'stage':<28} {'start':>8} {'ms':>8} {'ttft':>8} {'tokens in/out':>14}"]
+
+        for s in self.spans:
+            a = s.attributes
+            name = "  " * s.depth + s.name + (f" ({a['tool']})" if "tool" in a else "")
+            ttft = f"{a['ttft'] * 1000:.1f}" if "ttft" in a else ""
+            tokens = ""
+
+            if "prompt_tokens" in a:
+                estimated = "~" if a.get("usage") != "provider" else ""
+                tokens = f"{estimated}{a['prompt_tokens']}/{a.get('completion_tokens', 0)}"
+
+            flags = [flag for flag in ("cached", "shared") if a.get(flag)]
+            lines.append(
+                f"{name:<28} {(s.start - self.start) * 1000:>8.1f} {s.duration * 1000:>8.1f} {ttft:>8} {tokens:>14}"
+                + (f"  {', '.join(flags)}" if flags else "")
+            )
+
+        lines.append(f"{'total':<28} {'':>8} {self.duration * 1000:>8.1f}")
+        return lines
+
+
+@contextlib.contextmanager
+def tracing(**attributes):
+    """Traces everything that runs within the block."""
+    trace = Trace(**attributes)
+    previous = _trace.get(), _span.get()
+    _trace.set(trace)
+    _span.set(None)
+
+    try:
+        yield trace
+    finally:
+        trace.end = time.perf_counter()
+        _trace.set(previous[0])
+        _span.set(previous[1])
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """Records the block as a span of the current trace, if any."""
+    trace: Trace | None = _trace.get()
+
+    if trace is None:
+        yield _NO_SPAN
+        return
+
+    parent = _span.get()
+    s = Span(name, parent, **attributes)
+    trace.spans.append(s)
+    # Set and restored by value: inside async generators, the block may end in another context.
+    _span.set(s)
+
+    try:
+        yield s
+    finally:
+        s.end = time.perf_counter()
+        _span.set(parent)
+
+
+def current() -> Span | _NoSpan:
+    """The innermost open span, to add attributes to it."""
+    return _span.get() or _NO_SPAN
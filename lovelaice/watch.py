@@ -0,0 +1,159 @@
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import pathlib
+import struct
+import sys
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT = struct.Struct("iIII")
+
+
+def signature(path: pathlib.Path):
+    """A cheap fingerprint of the file contents, or None if it does not exist."""
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+
+    return stat.st_mtime_ns, stat.st_size
+
+
+class Watcher:
+    """
+    Watches a set of files and directories (non-recursively) for changes,
+    yielding the set of changed files once a burst of events settles for
+    `debounce` seconds.
+
+    Uses inotify where available, so an idle watcher costs no CPU, and
+    falls back to polling file signatures every `interval` seconds.
+    Changes made by ourselves can be ignored by calling `expect()` right
+    after writing a file.
+    """
+
+    def __init__(self, paths, debounce: float = 0.05, interval: float = 1.0) -> None:
+        self.paths = [pathlib.Path(p).absolute() for p in paths]
+        self.files = {p for p in self.paths if not p.is_dir()}
+        self.dirs = {p for p in self.paths if p.is_dir()}
+        self.debounce = debounce
+        self.interval = interval
+        self._expected: dict[pathlib.Path, tuple] = {}
+        self._queue: asyncio.Queue[pathlib.Path] = asyncio.Queue()
+
+    def expect(self, path):
+        """Ignores the current version of `path`, e.g., because we just wrote it."""
+        path = pathlib.Path(path).absolute()
+        self._expected[path] = signature(path)
+
+    def targets(self) -> list[pathlib.Path]:
+        """All the files currently covered by the watcher."""
+        files = set(self.files)
+
+        for directory in self.dirs:
+            files.update(p for p in directory.iterdir() if p.is_file())
+
+        return sorted(files)
+
+    def _wanted(self, path: pathlib.Path) -> bool:
+        return path in self.files or (path.parent in self.dirs and path.is_file())
+
+    async def __aiter__(self):
+        backend = self._inotify() if sys.platform.startswith("linux") else None
+        backend = backend or asyncio.create_task(self._poll())
+
+        try:
+            while True:
+                changed = {await self._queue.get()}
+
+                while True:
+                    try:
+                        changed.add(await asyncio.wait_for(self._queue.get(), self.debounce))
+                    except asyncio.TimeoutError:
+                        break
+
+                # Files gone by now (e.g., temporary files renamed over their target) are ignored.
+                changed = {p for p in changed if p.exists() and self._changed(p)}
+
+                if changed:
+                    yield changed
+        finally:
+            if isinstance(backend, asyncio.Task):
+                backend.cancel()
+            else:
+                backend()
+
+    def _changed(self, path: pathlib.Path) -> bool:
+        if path in self._expected:
+            if self._expected[path] == signature(path):
+                return False
+
+            del self._expected[path]
+
+        return True
+
+    def _inotify(self):
+        """Starts an inotify watch, returning a function that stops it, or None if unavailable."""
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+
+        if fd < 0:
+            return None
+
+        watches = {}
+
+        # Files are watched through their directory, which also catches editors that save by renaming.
+        for directory in self.dirs | {f.parent for f in self.files}:
+            wd = libc.inotify_add_watch(fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO)
+
+            if wd >= 0:
+                watches[wd] = directory
+
+        def read():
+            try:
+                data = os.read(fd, 65536)
+            except BlockingIOError:
+                return
+
+            offset = 0
+
+            while offset < len(data):
+                wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+                name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0")
+                offset += _EVENT.size + length
+
+                if wd in watches and name:
+                    path = watches[wd] / os.fsdecode(name)
+
+                    if self._wanted(path):
+                        self._queue.put_nowait(path)
+
+        loop = asyncio.get_running_loop()
+        loop.add_reader(fd, read)
+
+        def stop():
+            loop.remove_reader(fd)
+            os.close(fd)
+
+        return stop
+
+    async def _poll(self):
+        signatures = {p: signature(p) for p in self.targets()}
+
+        while True:
+            await asyncio.sleep(self.interval)
+
+            for path in self.targets():
+                current = signature(path)
+
+                if signatures.get(path) != current:
+                    signatures[path] = current
+                    self._queue.put_nowait(path)
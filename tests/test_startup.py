@@ -0,0 +1,53 @@
+"""
+Cold-start checks for the `lovelaice` entry points (see `extra/bench/bench_startup.py`).
+
+Budgets can be scaled on slow machines with `LOVELAICE_STARTUP_SCALE`.
+"""
+
+import os
+import pathlib
+import subprocess
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).parents[1]
+
+# Modules that must only be loaded by the code paths that use them.
+HEAVY = ["openai", "httpx", "requests", "googlesearch", "numpy", "fastapi", "uvicorn", "rich.prompt"]
+
+# (module, budget in ms, heavy modules allowed)
+CASES = [
+    ("lovelaice.client", 50, []),
+    ("lovelaice.cli", 600, []),
+    ("lovelaice.core", 1000, ["numpy"]),
+]
+
+
+def importtime(module: str) -> dict[str, int]:
+    """Cumulative import time in microseconds of every module loaded by `import module`."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(ROOT), os.environ.get("PYTHONPATH", "")]))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env, check=True,
+    )
+    times = {}
+
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = int(cumulative)
+
+    return times
+
+
+@pytest.mark.parametrize("module, budget, allowed", CASES)
+def test_startup(module, budget, allowed):
+    runs = [importtime(module) for _ in range(3)]
+    best = min(runs, key=lambda times: times[module])
+    heavy = [name for name in HEAVY if any(name in times for times in runs) and name not in allowed]
+
+    assert not heavy, f"{module} imports {', '.join(heavy)}"
+    assert best[module] / 1000 <= budget * float(os.environ.get("LOVELAICE_STARTUP_SCALE", 1))